@@ -0,0 +1,218 @@
+import os
+import ast
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from file_utils import write_json_atomic, acquire_run_lock, get_run_lock_path
+import bitrix_upload_data as upload_data
+from casebook_worker_pool import CasebookWorkerPool
+from casebook_query_planner import plan_queries
+import prepare_data_for_export as set_data
+from casebook_query_runner import process_query, merge_query_stats, PREPARE_STATS_KEYS
+
+load_dotenv()
+
+logger = logging.getLogger('Backfill')
+
+DATE_FORMAT = '%d.%m.%Y'
+CLEANED_FILE = 'CleanedArbitrage.csv'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Догрузка дел Casebook за прошедшие дни: запросы REQUESTS_BUNDLED × дни диапазона. '
+                    'Работает в том же каталоге, что и планировщик main_scrape.py, поэтому '
+                    'не запускается, пока он работает (и наоборот)'
+    )
+    parser.add_argument('--from', dest='date_from', required=True, help='Первый день, ДД.ММ.ГГГГ')
+    parser.add_argument('--to', dest='date_to', required=True, help='Последний день, ДД.ММ.ГГГГ (включительно)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Число сессий Casebook (по умолчанию CASEBOOK_WORKERS)')
+    parser.add_argument('--state', default='backfill_state.json',
+                        help='Файл прогресса; при повторном запуске готовые поиски пропускаются')
+    parser.add_argument('--upload', action='store_true',
+                        help='Импортировать лиды в Bitrix после каждого дня')
+    return parser.parse_args()
+
+
+def day_range(date_from, date_to):
+    start = datetime.strptime(date_from, DATE_FORMAT)
+    end = datetime.strptime(date_to, DATE_FORMAT)
+    if end < start:
+        raise ValueError(f'Дата --to {date_to} раньше --from {date_from}')
+    return [(start + timedelta(days=offset)).strftime(DATE_FORMAT) for offset in range((end - start).days + 1)]
+
+
+def expand_queries(requests_bundled, day):
+    """Поиски плана на конкретный день.
+
+    Дата каждого запроса REQUESTS_BUNDLED заменяется днём бэкфилла до группировки:
+    запросы, которые план разделял только из-за разных дат, сливаются в один поиск,
+    а не выгружаются дважды под одним item_key.
+    """
+    day_bundles = [
+        tuple(bundle[:3]) + (day,) if isinstance(bundle, (list, tuple)) and len(bundle) >= 3 else bundle
+        for bundle in requests_bundled
+    ]
+    return plan_queries(day_bundles)
+
+
+def item_key(query):
+    return '|'.join([query['date_from'], query['court'], ','.join(query['categories']), str(query['min_sum'])])
+
+
+class BackfillState:
+    """Прогресс бэкфилла в JSON-файле: готовые поиски (день × поиск) и дни, чьи лиды импортированы"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock = threading.Lock()
+        self.data = {'done': [], 'uploaded_days': []}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.data.update(json.load(f))
+            except Exception as e:
+                logger.warning(f'Не удалось прочитать {self.path}, бэкфилл начнётся заново: {e}')
+        self.done = set(self.data['done'])
+
+    def is_done(self, key):
+        return key in self.done
+
+    def mark_done(self, key):
+        with self.lock:
+            self.done.add(key)
+            self.data['done'] = sorted(self.done)
+            self._save()
+
+    def mark_uploaded(self, day):
+        with self.lock:
+            if day not in self.data['uploaded_days']:
+                self.data['uploaded_days'].append(day)
+            self._save()
+
+    def _save(self):
+        write_json_atomic(self.path, self.data, indent=2)
+
+
+def upload_prepared(day):
+    """Импорт накопленного CleanedArbitrage.csv в Bitrix; True — файл импортирован (или пуст)"""
+    if not os.path.exists(CLEANED_FILE):
+        return True
+    logger.info(f'Бэкфилл {day}: импорт лидов...')
+    upload_status = upload_data.bitrix_upload_file()
+    stats = getattr(upload_data.bitrix_upload_file, 'last_stats', {}) or {}
+    status = str(stats.get('status', upload_status))
+    logger.info(f'Бэкфилл {day}: импорт завершён: {status}')
+    if status.startswith('Ошибка'):
+        return False
+    os.remove(CLEANED_FILE)
+    return True
+
+
+def run_backfill(args):
+    """Бэкфилл по дням диапазона.
+
+    Планировщик main_scrape.py каждый час удаляет CleanedArbitrage.csv и
+    ArbitrageSearchExport.csv и (вне режима хоста браузеров) завершает Chrome, поэтому
+    бэкфилл и планировщик занимают рабочий каталог по очереди (см. file_utils.acquire_run_lock).
+    """
+    requests_bundled = ast.literal_eval(os.environ['REQUESTS_BUNDLED'])
+    days = day_range(args.date_from, args.date_to)
+    run_lock = acquire_run_lock()
+    if run_lock is None:
+        logger.error(
+            f'Рабочий каталог занят (блокировка {get_run_lock_path()}): остановите планировщик '
+            f'main_scrape.py на время бэкфилла — он удаляет CleanedArbitrage.csv и завершает Chrome'
+        )
+        return 1
+    try:
+        return _run_days(args, requests_bundled, days)
+    finally:
+        run_lock.close()
+
+
+def _run_days(args, requests_bundled, days):
+    state = BackfillState(args.state)
+
+    # Лиды прошлого запуска, не дошедшие до импорта, дописываются, а не перезаписываются
+    prepare_state = {
+        'lock': threading.Lock(),
+        'first_write': not os.path.exists(CLEANED_FILE),
+        'dedup_index': set_data.DedupIndex()
+    }
+    if args.upload and not prepare_state['first_write']:
+        if not upload_prepared('прошлый запуск'):
+            logger.error('Импорт лидов прошлого запуска не удался, бэкфилл остановлен')
+            return 1
+        prepare_state['first_write'] = True
+
+    totals = {'searches_performed': 0, 'casebook_found': 0, 'casebook_downloaded': 0, 'failed_download_results': 0}
+    for summary_key in PREPARE_STATS_KEYS:
+        totals[summary_key] = 0
+
+    pool = CasebookWorkerPool(args.workers)
+    started = time.monotonic()
+    days_finished = 0
+    exit_code = 0
+    try:
+        for day_idx, day in enumerate(days):
+            day_queries = [query for query in expand_queries(requests_bundled, day) if not state.is_done(item_key(query))]
+            if day_queries:
+                logger.info(f'Бэкфилл {day} ({day_idx + 1}/{len(days)}): {len(day_queries)} поисков')
+
+                def handle_query(worker, query_idx, query):
+                    query_stats = process_query(worker, query_idx, query, len(day_queries), prepare_state)
+                    if query_stats.get('completed'):
+                        state.mark_done(item_key(query))
+                    return query_stats
+
+                for query_stats in pool.run(day_queries, handle_query, keep_open=True):
+                    if query_stats:
+                        merge_query_stats(totals, query_stats)
+
+                pending = [query for query in day_queries if not state.is_done(item_key(query))]
+                if pending:
+                    logger.warning(f'Бэкфилл {day}: {len(pending)} поисков не завершено, будут повторены при следующем запуске')
+
+            # Импортируется всё накопленное, в том числе лиды повторённых поисков прошлых дней
+            if args.upload:
+                if not upload_prepared(day):
+                    logger.error(f'Бэкфилл {day}: импорт в Bitrix не удался, бэкфилл остановлен')
+                    exit_code = 1
+                    break
+                prepare_state['first_write'] = True
+                state.mark_uploaded(day)
+
+            if not day_queries:
+                continue
+            # Скорость считается по дням, разобранным в этом запуске (готовые раньше не в счёт)
+            days_finished += 1
+            elapsed_h = (time.monotonic() - started) / 3600
+            if elapsed_h > 0:
+                rate = days_finished / elapsed_h
+                remaining_h = (len(days) - day_idx - 1) / rate
+                logger.info(
+                    f'Бэкфилл: {day_idx + 1}/{len(days)} дней, {rate:.1f} дн/ч, осталось ~{remaining_h:.1f} ч'
+                )
+    finally:
+        pool.close()
+        prepare_state['dedup_index'].close()
+
+    elapsed_h = (time.monotonic() - started) / 3600
+    logger.info(
+        f"Бэкфилл {args.date_from}–{args.date_to}: разобрано дней {days_finished} из {len(days)} за {elapsed_h:.2f} ч "
+        f"({days_finished / elapsed_h if elapsed_h else 0:.1f} дн/ч) | searches={totals['searches_performed']} | "
+        f"found={totals['casebook_found']} | downloaded={totals['casebook_downloaded']} | "
+        f"prepared_written={totals['prepared_rows']} | failed_download={totals['failed_download_results']}"
+    )
+    return exit_code
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    raise SystemExit(run_backfill(parse_args()))
@@ -1,9 +1,6 @@
 import re
 import os
 import sys
-import time
-import random
-import json
 import logging
 import pandas as pd
 from dotenv import load_dotenv
@@ -19,10 +16,15 @@ except Exception:
     except Exception:
         pass
 
-import undetected_chromedriver as uc
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
+from browser_wait import StepWaiter
+from case_registry import CaseRegistry
+import chrome_driver_cache
+import resource_blocking
+from browser_metrics import record_page_load, log_browser_metrics
+from selenium.webdriver.chrome.options import Options
 
 load_dotenv()
 
@@ -62,6 +64,8 @@ class BitrixUploader:
         self.abs_path = os.getcwd()
         self.driver = None
         self.wait = None
+        self.waiter = None
+        self.page_loads = []
         self.status = "Умный сценарий не был запущен"
         self.summary_stats = {
             'status': self.status,
@@ -74,19 +78,18 @@ class BitrixUploader:
         """Инициализация драйвера и ожиданий"""
         try:
             logger.info("Инициализация процесса загрузки")
-            try:
-                self.driver = uc.Chrome(headless=True)
-            except Exception as start_err:
-                msg = str(start_err)
-                m = re.search(r"Current browser version is (\d+)", msg)
-                if m:
-                    major = int(m.group(1))
-                    self.driver = uc.Chrome(headless=True, version_main=major)
-                else:
-                    raise
+            options = Options()
+            prefs = resource_blocking.content_settings_prefs()
+            if prefs:
+                options.add_experimental_option("prefs", prefs)
+            self.driver = chrome_driver_cache.start_chrome(headless=True, options=options)
             self.driver.set_page_load_timeout(120)
             self.wait = WebDriverWait(self.driver, 30)
-            time.sleep(2)
+            # Мастер импорта работает без картинок, шрифтов и виджетов чата портала
+            resource_blocking.apply_blocking(self.driver)
+            # Явные ожидания по событиям страницы вместо фиксированных пауз
+            self.waiter = StepWaiter(self.driver, timeout=30)
+            self.waiter.install_network_tracker()
         except Exception as e:
             if hasattr(self, 'driver') and self.driver:
                 self.driver.quit()
@@ -111,17 +114,23 @@ class BitrixUploader:
         self.wait.until(EC.presence_of_element_located((By.XPATH, "//input[@type='password']")))
         password_field = self.driver.find_element(By.XPATH, "//input[@type='password']")
         password_field.send_keys(os.getenv('BITRIX_PASSWORD'))
+        old_url = self.driver.current_url
         self.driver.find_element(
             By.XPATH,
             "//button[contains(@class, 'b24net-password-enter-form__continue-btn')]"
         ).click()
-        time.sleep(random.uniform(2, 4))
+        # Ждём перехода в портал после входа; анти-бот пауза задаётся BROWSER_WAIT_FLOOR.
+        # Портал может открыться и без редиректа — тогда таймаут не ошибка
+        self.waiter.url_changes(old_url, 'Логин: переход после входа', timeout=10, required=False)
+        self.waiter.dom_ready('Логин: загрузка портала')
+        record_page_load(self.driver, self.page_loads)
 
     @log_step("Переход на страницу канбана")
     def go_to_kanban(self):
         """Переход на страницу канбана"""
         self.driver.get(os.getenv('BITRIX_KANBAN_PAGE'))
-        time.sleep(2)
+        self.waiter.dom_ready('Импорт: загрузка страницы')
+        record_page_load(self.driver, self.page_loads)
 
     @log_step("Загрузка файла")
     def upload_file(self):
@@ -130,7 +139,7 @@ class BitrixUploader:
         file_input = self.driver.find_element(By.XPATH, "//input[@type='file']")
         path_to_file = os.path.join(self.abs_path, 'CleanedArbitrage.csv')
         file_input.send_keys(path_to_file)
-        time.sleep(2)
+        self.waiter.network_idle('Импорт: загрузка файла')
 
     @log_step("Настройка параметров импорта")
     def configure_import(self):
@@ -142,7 +151,8 @@ class BitrixUploader:
         self.wait.until(EC.presence_of_element_located((By.XPATH, "//div[@id='popup-window-content-popup_window']")))
         cod_xpath = "//div[@id='popup-window-content-popup_window']//tr[.//label[contains(@class,'popup-window-label') and normalize-space(text())='windows-1251']]//button[contains(@class,'popup-window-custom-button')]"
         self.driver.find_element(By.XPATH, cod_xpath).click()
-        time.sleep(2)
+        self.waiter.gone((By.XPATH, "//div[@id='popup-window-content-popup_window']"), 'Импорт: выбор кодировки')
+        self.waiter.network_idle('Импорт: выбор кодировки')
 
         # Настройка полей
         fields = {
@@ -152,16 +162,22 @@ class BitrixUploader:
         }
 
         for field_name, xpath in fields.items():
-            self.wait.until(EC.presence_of_element_located((By.XPATH, xpath)))
-            self.driver.find_element(By.XPATH, xpath).send_keys(field_name)
-            time.sleep(1)
+            select = self.waiter.element((By.XPATH, xpath), 'Импорт: поле сопоставления')
+            select.send_keys(field_name)
+            self.waiter.until(
+                lambda d: field_name in Select(select).first_selected_option.text,
+                'Импорт: выбор поля', timeout=2, required=False
+            )
 
         # Дважды нажимаем "Далее" для завершения настройки
-        for _ in range(2):
-            self.wait.until(EC.presence_of_element_located((
-                By.XPATH, "//input[@title='Перейти к следующему шагу']"
-            ))).click()
-            time.sleep(2)
+        for step_num in range(2):
+            next_button = self.waiter.element(
+                (By.XPATH, "//input[@title='Перейти к следующему шагу']"), 'Импорт: кнопка «Далее»'
+            )
+            next_button.click()
+            # Шаг мастера — отправка формы: ждём ухода старой кнопки и загрузки новой страницы
+            self.waiter.until(EC.staleness_of(next_button), f'Импорт: шаг {step_num + 1}', required=False)
+            self.waiter.dom_ready(f'Импорт: шаг {step_num + 1}')
 
     @log_step("Получение статистики импорта")
     def get_import_stats(self):
@@ -194,32 +210,14 @@ class BitrixUploader:
         try:
             cleaned_path = os.path.join(self.abs_path, 'CleanedArbitrage.csv')
             df = pd.read_csv(cleaned_path, sep=';', encoding='windows-1251')
-            data = df.to_dict(orient='records')
+            case_nums = {re.sub(r'[^\d]', '', str(case_num)) for case_num in df['Номер дела'].dropna()}
 
-            # Загрузка текущего реестра успешно импортированных дел
-            registry_path = os.path.join(self.abs_path, 'processed_cases.json')
-            processed = []
-            if os.path.exists(registry_path):
-                try:
-                    with open(registry_path, 'r', encoding='utf-8') as rf:
-                        arr = json.load(rf)
-                        if isinstance(arr, list):
-                            processed = [str(x).strip() for x in arr]
-                except Exception:
-                    processed = []
-
-            processed_set = set(processed)
-
-            # Добавляем номера дел из текущего файла
-            for line in data:
-                case_num = line['Номер дела']
-                case_for_file = re.sub(r'[^\d]', '', case_num)
-                processed_set.add(case_for_file)
-
-            # Сохраняем реестр в JSON виде массива строк
-            new_list = sorted(processed_set)
-            with open(registry_path, 'w', encoding='utf-8') as wf:
-                json.dump(new_list, wf, ensure_ascii=False, indent=2)
+            # Номера импортированных дел отмечаются в реестре: следующие прогоны их не выгрузят
+            registry = CaseRegistry(base_dir=self.abs_path)
+            try:
+                registry.mark_imported(case_nums)
+            finally:
+                registry.close()
         except Exception as e:
             logger.error(f"Ошибка при обработке файла: {str(e)}")
 
@@ -228,34 +226,31 @@ class BitrixUploader:
         """Настройка фильтров для отбора лидов"""
         try:
             # Открытие фильтра
-            self.wait.until(EC.presence_of_element_located((
+            self.waiter.element((
                 By.XPATH, "//input[@class='main-ui-filter-search-filter' and contains(@id, 'CRM_LEAD_LIST_')]"
-            ))).click()
-            time.sleep(1)
+            ), 'Фильтр: поле поиска', clickable=True).click()
 
             # Выбор стадии
-            self.wait.until(EC.presence_of_element_located((
+            self.waiter.element((
                 By.XPATH, "(//div[@data-name='STATUS_ID'])[2]"
-            ))).click()
-            time.sleep(1)
+            ), 'Фильтр: поле стадии', clickable=True).click()
 
             # Выбор "Заявки, вх. звонки"
-            self.wait.until(EC.presence_of_element_located((
+            self.waiter.element((
                 By.XPATH, "//div[contains(@data-item, 'ЗАЯВКИ, ВХ. ЗВОНКИ')]"
-            ))).click()
-            time.sleep(1)
+            ), 'Фильтр: пункт стадии', clickable=True).click()
 
             # Повторный выбор фильтра
-            self.wait.until(EC.presence_of_element_located((
+            self.waiter.element((
                 By.XPATH, "(//div[@data-name='STATUS_ID'])[2]"
-            ))).click()
-            time.sleep(1)
+            ), 'Фильтр: закрытие списка стадий', clickable=True).click()
 
             # Нажатие кнопки "Найти"
-            self.wait.until(EC.presence_of_element_located((
+            self.waiter.element((
                 By.XPATH, "//div[@class='main-ui-filter-field-preset-button-container']/div/button[1]"
-            ))).click()
-            time.sleep(1)
+            ), 'Фильтр: кнопка «Найти»', clickable=True).click()
+            # Грид лидов перезагружается AJAX-запросом
+            self.waiter.network_idle('Фильтр: обновление списка лидов')
         except Exception as e:
             logger.error(f"Ошибка при настройке фильтров: {str(e)}")
             raise
@@ -293,26 +288,24 @@ class BitrixUploader:
             self.driver.find_element(
                 By.XPATH, "//button[@id='intranet_binding_menu_crm_switcher']"
             ).click()
-            time.sleep(1)
 
             # Выбор умных сценариев
-            self.driver.find_element(
-                By.XPATH, "//span[text()='Умные сценарии']"
+            self.waiter.element(
+                (By.XPATH, "//span[text()='Умные сценарии']"), 'Сценарий: меню', clickable=True
             ).click()
-            time.sleep(1)
 
             # Выбор сценария обогащения
-            self.driver.find_element(
-                By.XPATH, "//span[text()='Обогащение Лида через Checko И exportBase']"
+            self.waiter.element(
+                (By.XPATH, "//span[text()='Обогащение Лида через Checko И exportBase']"), 'Сценарий: пункт', clickable=True
             ).click()
-            time.sleep(2)
 
             # Запуск сценария
-            run_btn = self.driver.find_element(
-                By.XPATH, "//span[@class='ui-btn-text-inner' and text()='Запустить']/parent::span/parent::button"
+            run_btn = self.waiter.element(
+                (By.XPATH, "//span[@class='ui-btn-text-inner' and text()='Запустить']/parent::span/parent::button"),
+                'Сценарий: кнопка «Запустить»', clickable=True
             )
             self.driver.execute_script("arguments[0].click();", run_btn)
-            time.sleep(2)
+            self.waiter.network_idle('Сценарий: запуск', timeout=15)
             self.status = 'Сценарий обогащения данных запущен'
             logger.info("Умный сценарий успешно запущен")
         except Exception as e:
@@ -332,7 +325,9 @@ class BitrixUploader:
 
             # Переход на страницу лидов и запуск сценария в любом случае
             self.driver.get(os.getenv('BITRIX_LEADS_PAGE'))
-            time.sleep(3)
+            self.waiter.dom_ready('Лиды: загрузка страницы')
+            self.waiter.network_idle('Лиды: загрузка списка')
+            record_page_load(self.driver, self.page_loads)
 
             self.process_csv_file()
             self.setup_filters()
@@ -351,7 +346,13 @@ class BitrixUploader:
             self.summary_stats['status'] = self.status
             return self.status
         finally:
+            if self.waiter is not None:
+                self.waiter.log_summary(logger)
             if hasattr(self, 'driver') and self.driver:
+                log_browser_metrics(
+                    getattr(self.driver, 'browser_pid', None), self.page_loads,
+                    f"Браузер Bitrix24 (блокировка: {resource_blocking.get_block_profile()})", logger
+                )
                 try:
                     self.driver.quit()
                     logger.info("Браузер закрыт")
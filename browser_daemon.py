@@ -0,0 +1,202 @@
+import os
+import time
+import signal
+import logging
+from dotenv import load_dotenv
+import browser_daemon_client as client
+from casebook_worker_pool import CasebookWorker, get_workers_count
+from cdp_client import get_debugger_address
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO,
+                    filename='app.log',
+                    filemode='a',
+                    format="{asctime} - {filename} - {levelname} - {message}",
+                    datefmt="%Y-%m-%d %H:%M",
+                    style="{")
+
+logger = logging.getLogger('BrowserDaemon')
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+    _sh = logging.StreamHandler()
+    _sh.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(_sh)
+
+
+def _env_float(name, default):
+    raw = (os.getenv(name) or str(default)).strip()
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}={raw!r}, используется {default}")
+        return float(default)
+
+
+def get_max_age():
+    """Плановый перезапуск браузера слота через CASEBOOK_DAEMON_MAX_AGE_H часов (0 — без перезапуска)"""
+    return _env_float('CASEBOOK_DAEMON_MAX_AGE_H', 12) * 3600
+
+
+def get_check_interval():
+    """Период проверки здоровья браузеров в секундах (CASEBOOK_DAEMON_CHECK_SEC)"""
+    return max(5.0, _env_float('CASEBOOK_DAEMON_CHECK_SEC', 60))
+
+
+def get_keepalive_interval():
+    """Период проверки авторизации простаивающих браузеров в секундах (CASEBOOK_DAEMON_KEEPALIVE_MIN, 0 — выкл.)"""
+    return _env_float('CASEBOOK_DAEMON_KEEPALIVE_MIN', 30) * 60
+
+
+class BrowserDaemon:
+    """Долгоживущий хост залогиненных браузеров Casebook.
+
+    Держит по браузеру на каждого рабочего (CASEBOOK_WORKERS) и публикует их адреса
+    remote debugging в файле состояния; ежечасный прогон main_scrape.py подключается
+    к ним вместо холодного запуска Chrome и входа. Зависший или устаревший браузер
+    заменяется: по провалу проверки здоровья, по запросу прогона или по возрасту.
+    """
+
+    def __init__(self, slots=None):
+        self.state_file = client.get_state_file()
+        self.max_age = get_max_age()
+        self.check_interval = get_check_interval()
+        self.keepalive_interval = get_keepalive_interval()
+        self.running = True
+
+        env_download_dir = (os.getenv('DOWNLOAD_DIR') or '').strip()
+        base_dir = os.path.abspath(env_download_dir) if env_download_dir else os.getcwd()
+        env_profiles_dir = (os.getenv('CASEBOOK_PROFILES_DIR') or '').strip()
+        profiles_dir = os.path.abspath(env_profiles_dir) if env_profiles_dir else os.path.join(base_dir, 'chrome_profiles')
+        # Профили хоста отдельные: локальный браузер рабочего не должен конфликтовать с ними
+        self.workers = {
+            slot: CasebookWorker(
+                slot,
+                download_dir=os.path.join(base_dir, 'daemon', f'slot_{slot}'),
+                profile_dir=os.path.join(profiles_dir, f'daemon_slot_{slot}'),
+                use_daemon=False
+            )
+            for slot in range(1, (slots or get_workers_count()) + 1)
+        }
+        self.started_at = {}
+        self.checked_at = {}
+
+    def start_slot(self, slot):
+        """Запустить (или заменить) браузер слота и залогинить его"""
+        worker = self.workers[slot]
+        worker.close()
+        self.started_at.pop(slot, None)
+        try:
+            worker.ensure_session()
+        except Exception as e:
+            logger.error(f"Слот {slot}: не удалось запустить браузер: {e}")
+            worker.close()
+            return False
+        self.started_at[slot] = time.time()
+        self.checked_at[slot] = time.monotonic()
+        logger.info(f"Слот {slot}: браузер готов ({get_debugger_address(worker.downloader.driver)})")
+        return True
+
+    def slot_entry(self, slot):
+        driver = self.workers[slot].downloader.driver
+        patcher = getattr(driver, 'patcher', None)
+        return {
+            'debugger_address': get_debugger_address(driver),
+            'driver_path': getattr(patcher, 'executable_path', None),
+            'browser_pid': getattr(driver, 'browser_pid', None),
+            'started_at': self.started_at[slot]
+        }
+
+    def publish(self):
+        """Записать адреса живых браузеров в файл состояния"""
+        slots = {}
+        for slot in self.workers:
+            if slot in self.started_at:
+                try:
+                    slots[str(slot)] = self.slot_entry(slot)
+                except Exception as e:
+                    logger.warning(f"Слот {slot}: не удалось получить адрес браузера: {e}")
+        client.write_state({'pid': os.getpid(), 'updated_at': time.time(), 'slots': slots}, self.state_file)
+
+    def recycle_reason(self, slot):
+        """Причина замены браузера слота или None, если он здоров"""
+        if slot not in self.started_at:
+            return 'браузер не запущен'
+        if client.recycle_requested(slot, self.state_file):
+            return 'запрос прогона'
+        try:
+            address = get_debugger_address(self.workers[slot].downloader.driver)
+        except Exception:
+            return 'драйвер не отвечает'
+        if not client.endpoint_info(address):
+            return 'браузер не отвечает'
+        # Плановая замена не прерывает прогон, работающий в этом браузере
+        if self.max_age and time.time() - self.started_at[slot] > self.max_age \
+                and not client.slot_leased(slot, self.state_file):
+            return 'плановый перезапуск'
+        return None
+
+    def keep_alive(self, slot):
+        """Проверить авторизацию простаивающего браузера и при необходимости войти заново"""
+        if not self.keepalive_interval or client.slot_leased(slot, self.state_file):
+            return
+        if time.monotonic() - self.checked_at.get(slot, 0) < self.keepalive_interval:
+            return
+        self.checked_at[slot] = time.monotonic()
+        downloader = self.workers[slot].downloader
+        try:
+            if not downloader.is_logged_in():
+                logger.info(f"Слот {slot}: сессия истекла, выполняется вход")
+                downloader.login()
+                downloader.save_session()
+        except Exception as e:
+            logger.warning(f"Слот {slot}: проверка авторизации не удалась: {e}")
+
+    def check_slots(self):
+        replaced = []
+        for slot in self.workers:
+            reason = self.recycle_reason(slot)
+            if reason:
+                logger.info(f"Слот {slot}: замена браузера ({reason})")
+                self.start_slot(slot)
+                replaced.append(slot)
+            else:
+                self.keep_alive(slot)
+        if replaced:
+            self.publish()
+            # Запрос снимаем после публикации нового адреса — прогон ждёт именно его
+            for slot in replaced:
+                try:
+                    os.remove(client.recycle_marker(slot, self.state_file))
+                except FileNotFoundError:
+                    pass
+
+    def stop(self, *_args):
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f"Запуск хоста браузеров Casebook: {len(self.workers)} слотов, состояние {self.state_file}")
+        try:
+            for slot in self.workers:
+                self.start_slot(slot)
+            self.publish()
+            next_check = time.monotonic() + self.check_interval
+            while self.running:
+                # Короткий шаг сна, чтобы SIGTERM обрабатывался без задержки
+                time.sleep(1)
+                if time.monotonic() >= next_check:
+                    self.check_slots()
+                    next_check = time.monotonic() + self.check_interval
+        finally:
+            logger.info("Остановка хоста браузеров Casebook")
+            for worker in self.workers.values():
+                worker.close()
+            try:
+                os.remove(self.state_file)
+            except FileNotFoundError:
+                pass
+
+
+if __name__ == "__main__":
+    BrowserDaemon().run()
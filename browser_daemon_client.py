@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import logging
+from urllib.request import urlopen
+from file_utils import write_json_atomic
+
+logger = logging.getLogger('BrowserDaemonClient')
+
+
+def daemon_mode_enabled():
+    """Подключаться ли к браузерам долгоживущего хоста browser_daemon.py (CASEBOOK_BROWSER_DAEMON)"""
+    return (os.getenv('CASEBOOK_BROWSER_DAEMON') or 'false').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def get_state_file():
+    """Файл состояния хоста браузеров (CASEBOOK_DAEMON_STATE, по умолчанию browser_daemon.json)"""
+    raw = (os.getenv('CASEBOOK_DAEMON_STATE') or '').strip()
+    return os.path.abspath(raw) if raw else os.path.join(os.getcwd(), 'browser_daemon.json')
+
+
+def get_attach_wait():
+    """Сколько секунд ждать освобождения слота после запроса на перезапуск (CASEBOOK_DAEMON_ATTACH_WAIT)"""
+    raw = (os.getenv('CASEBOOK_DAEMON_ATTACH_WAIT') or '90').strip()
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        return 90.0
+
+
+def read_state(path=None):
+    """Прочитать состояние хоста; None, если файла нет или он повреждён"""
+    path = path or get_state_file()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать состояние хоста браузеров {path}: {e}")
+        return None
+
+
+def write_state(state, path=None):
+    """Атомарно записать состояние хоста"""
+    write_json_atomic(path or get_state_file(), state, indent=2)
+
+
+def endpoint_info(address, timeout=2):
+    """Ответ /json/version браузера по адресу remote debugging; None, если браузер не отвечает"""
+    try:
+        with urlopen(f"http://{address}/json/version", timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except Exception:
+        return None
+
+
+def process_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, TypeError, ValueError):
+        return False
+    return True
+
+
+def recycle_marker(slot, path=None):
+    return f"{path or get_state_file()}.recycle.{slot}"
+
+
+def request_recycle(slot, path=None):
+    """Попросить хост заменить браузер слота (например, после зависания в прогоне)"""
+    try:
+        with open(recycle_marker(slot, path), 'w', encoding='utf-8') as f:
+            f.write(str(time.time()))
+        logger.info(f"Запрошен перезапуск браузера слота {slot}")
+    except Exception as e:
+        logger.warning(f"Не удалось запросить перезапуск браузера слота {slot}: {e}")
+
+
+def recycle_requested(slot, path=None):
+    return os.path.exists(recycle_marker(slot, path))
+
+
+def find_slot(slot, wait=None, path=None):
+    """Вернуть запись слота хоста (debugger_address, driver_path, ...), если его браузер жив.
+
+    Пока по слоту висит запрос на перезапуск или браузер не отвечает, ждём до wait секунд,
+    пока хост его заменит. None — хост не запущен или слот недоступен: браузер
+    запускается локально, как без хоста.
+    """
+    deadline = time.monotonic() + (get_attach_wait() if wait is None else wait)
+    while True:
+        state = read_state(path)
+        if not state or not process_alive(state.get('pid')):
+            return None
+        entry = (state.get('slots') or {}).get(str(slot))
+        if not entry:
+            return None
+        if not recycle_requested(slot, path) and endpoint_info(entry.get('debugger_address')):
+            return entry
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(1)
+
+
+def lease_file(slot, path=None):
+    return f"{path or get_state_file()}.lease.{slot}"
+
+
+def acquire_lease(slot, path=None):
+    """Отметить, что прогон работает в браузере слота: плановый перезапуск откладывается"""
+    try:
+        with open(lease_file(slot, path), 'w', encoding='utf-8') as f:
+            f.write(str(os.getpid()))
+    except Exception as e:
+        logger.warning(f"Не удалось занять слот {slot} хоста браузеров: {e}")
+
+
+def release_lease(slot, path=None):
+    try:
+        os.remove(lease_file(slot, path))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Не удалось освободить слот {slot} хоста браузеров: {e}")
+
+
+def slot_leased(slot, path=None):
+    """Занят ли слот живым процессом прогона"""
+    try:
+        with open(lease_file(slot, path), 'r', encoding='utf-8') as f:
+            return process_alive(f.read().strip())
+    except Exception:
+        return False
@@ -0,0 +1,89 @@
+import os
+import logging
+
+logger = logging.getLogger('BrowserMetrics')
+
+# Длительность последней навигации и объём переданных ресурсов по Navigation/Resource Timing
+PAGE_LOAD_JS = """
+var nav = performance.getEntriesByType('navigation')[0];
+var bytes = 0;
+performance.getEntriesByType('resource').forEach(function (r) { bytes += r.transferSize || 0; });
+if (nav) { bytes += nav.transferSize || 0; }
+return {url: location.href, ms: nav ? nav.duration : null, bytes: bytes,
+        resources: performance.getEntriesByType('resource').length};
+"""
+
+
+def _proc_children():
+    """Отображение ppid -> [pid] по /proc (только Linux)"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'r') as f:
+                # Имя процесса в скобках может содержать пробелы — ppid идёт вторым после ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except Exception:
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    return children
+
+
+def _proc_rss(pid):
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    return 0
+
+
+def process_tree_rss(pid):
+    """Суммарный RSS процесса и всех его потомков в байтах; None, если /proc недоступен"""
+    if not pid or not os.path.isdir('/proc'):
+        return None
+    children = _proc_children()
+    total = 0
+    stack = [int(pid)]
+    seen = set()
+    while stack:
+        current = stack.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        total += _proc_rss(current)
+        stack.extend(children.get(current, []))
+    return total
+
+
+def page_load_sample(driver):
+    """Метрики последней загруженной страницы: url, ms, bytes, resources (None при ошибке)"""
+    try:
+        return driver.execute_script(PAGE_LOAD_JS)
+    except Exception:
+        return None
+
+
+def record_page_load(driver, samples):
+    """Добавить метрики текущей страницы в список samples"""
+    sample = page_load_sample(driver)
+    if sample and sample.get('ms') is not None:
+        samples.append(sample)
+
+
+def format_rss(rss):
+    return f"{rss / 1024 / 1024:.0f} МБ" if rss is not None else "н/д"
+
+
+def log_browser_metrics(browser_pid, samples, label, log=None):
+    """Залогировать среднее время загрузки страниц, переданный объём и RSS дерева процессов Chrome"""
+    parts = [label]
+    if samples:
+        avg_ms = sum(s['ms'] for s in samples) / len(samples)
+        avg_kb = sum(s.get('bytes') or 0 for s in samples) / len(samples) / 1024
+        parts.append(f"загрузка страниц: {len(samples)}× в среднем {avg_ms:.0f} мс, {avg_kb:.0f} КБ")
+    parts.append(f"RSS Chrome: {format_rss(process_tree_rss(browser_pid))}")
+    (log or logger).info('; '.join(parts))
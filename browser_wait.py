@@ -0,0 +1,186 @@
+import os
+import re
+import time
+import random
+import logging
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+logger = logging.getLogger('BrowserWait')
+
+# Счётчик незавершённых XHR/fetch на странице — основа ожидания «тишины» в сети
+NETWORK_TRACKER_JS = """
+(function () {
+    if (window.__netTracker) { return; }
+    var tracker = window.__netTracker = {pending: 0, lastChange: Date.now()};
+    function changed(delta) { tracker.pending = Math.max(0, tracker.pending + delta); tracker.lastChange = Date.now(); }
+    var origSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        changed(1);
+        this.addEventListener('loadend', function () { changed(-1); }, {once: true});
+        return origSend.apply(this, arguments);
+    };
+    if (window.fetch) {
+        var origFetch = window.fetch;
+        window.fetch = function () {
+            changed(1);
+            return origFetch.apply(this, arguments).finally(function () { changed(-1); });
+        };
+    }
+})();
+"""
+
+NETWORK_IDLE_JS = """
+var t = window.__netTracker;
+var since = arguments[0];
+if (!t) { return document.readyState === 'complete' ? -1 : null; }
+if (t.pending > 0 || (since && t.lastChange < since)) { return null; }
+return Date.now() - t.lastChange;
+"""
+
+
+def get_wait_floor():
+    """Минимальная пауза после шага для анти-бот джиттера из BROWSER_WAIT_FLOOR.
+
+    Формат: "0.3" (фиксированная) или "0.2-0.6" (случайная в диапазоне); по умолчанию пауз нет.
+    """
+    raw = (os.getenv('BROWSER_WAIT_FLOOR') or '').strip()
+    if not raw:
+        return 0.0, 0.0
+    try:
+        parts = [float(p) for p in raw.split('-', 1)]
+    except ValueError:
+        logger.warning(f"Некорректное значение BROWSER_WAIT_FLOOR={raw!r}, паузы отключены")
+        return 0.0, 0.0
+    low = max(0.0, parts[0])
+    high = max(low, parts[-1])
+    return low, high
+
+
+class StepWaiter:
+    """Явные ожидания по условиям страницы (DOM, сеть, значение поля) с учётом фактического времени по шагам"""
+
+    def __init__(self, driver, timeout=30, poll_frequency=0.05):
+        self.driver = driver
+        self.timeout = timeout
+        self.poll_frequency = poll_frequency
+        self.floor_range = get_wait_floor()
+        # Шаг -> [число ожиданий, суммарно секунд]
+        self.stats = {}
+
+    def install_network_tracker(self):
+        """Подключить счётчик запросов ко всем будущим документам и к текущей странице"""
+        try:
+            self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': NETWORK_TRACKER_JS})
+        except Exception as cdp_err:
+            logger.warning(f"Не удалось подключить счётчик сетевых запросов через CDP: {cdp_err}")
+        try:
+            self.driver.execute_script(NETWORK_TRACKER_JS)
+        except Exception:
+            pass
+
+    def _record(self, step, started):
+        entry = self.stats.setdefault(step, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.monotonic() - started
+
+    def measure(self, step, func, *args, **kwargs):
+        """Выполнить func и учесть его время как шаг (для ожиданий внутри страницы)"""
+        started = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._record(step, started)
+
+    def floor(self, step):
+        """Пауза-джиттер после шага, если задан BROWSER_WAIT_FLOOR"""
+        low, high = self.floor_range
+        if high <= 0:
+            return
+        started = time.monotonic()
+        time.sleep(random.uniform(low, high))
+        self._record(f'{step} (джиттер)', started)
+
+    def until(self, condition, step, timeout=None, required=True):
+        """Дождаться условия; при required=False таймаут не считается ошибкой и возвращается None"""
+        started = time.monotonic()
+        try:
+            return WebDriverWait(
+                self.driver, timeout if timeout is not None else self.timeout, poll_frequency=self.poll_frequency
+            ).until(condition)
+        except TimeoutException:
+            if required:
+                raise
+            return None
+        finally:
+            self._record(step, started)
+            self.floor(step)
+
+    def element(self, locator, step, clickable=False, timeout=None):
+        """Дождаться появления (или кликабельности) элемента"""
+        condition = EC.element_to_be_clickable(locator) if clickable else EC.presence_of_element_located(locator)
+        return self.until(condition, step, timeout=timeout)
+
+    def gone(self, locator, step, timeout=5):
+        """Дождаться исчезновения элемента (закрытие выпадающих списков и попапов)"""
+        return self.until(EC.invisibility_of_element_located(locator), step, timeout=timeout, required=False)
+
+    def url_changes(self, old_url, step, timeout=None, required=True):
+        return self.until(EC.url_changes(old_url), step, timeout=timeout, required=required)
+
+    def dom_ready(self, step, timeout=None):
+        """Дождаться полной загрузки документа"""
+        return self.until(
+            lambda d: d.execute_script("return document.readyState;") == 'complete',
+            step, timeout=timeout, required=False
+        )
+
+    def page_time(self):
+        """Текущее время страницы (мс) — отметка для network_idle(since=...)"""
+        try:
+            return self.driver.execute_script("return Date.now();")
+        except Exception:
+            return None
+
+    def network_idle(self, step, idle_ms=250, timeout=10, since=None):
+        """Дождаться, пока на странице не останется XHR/fetch в течение idle_ms.
+
+        since — отметка page_time(): ждать, пока после неё пройдёт хотя бы один запрос.
+        """
+        def idle(driver):
+            try:
+                quiet_for = driver.execute_script(NETWORK_IDLE_JS, since)
+            except Exception:
+                return False
+            return quiet_for is not None and (quiet_for < 0 or quiet_for >= idle_ms)
+
+        return self.until(idle, step, timeout=timeout, required=False)
+
+    def value_committed(self, element, expected, step, timeout=2, digits_only=False):
+        """Дождаться, пока значение поля станет равным expected (с учётом форматирования чисел)"""
+        def normalize(value):
+            value = (value or '').strip()
+            return re.sub(r'\D', '', value) if digits_only else value
+
+        target = normalize(str(expected))
+
+        def committed(_driver):
+            try:
+                return normalize(element.get_attribute('value')) == target
+            except Exception:
+                return False
+
+        return self.until(committed, step, timeout=timeout, required=False)
+
+    def summary(self):
+        """Строка со статистикой ожиданий: шаг — число ожиданий и суммарное время"""
+        parts = [
+            f"{step}: {count}×, {total:.2f} с"
+            for step, (count, total) in sorted(self.stats.items(), key=lambda item: -item[1][1])
+        ]
+        return '; '.join(parts)
+
+    def log_summary(self, log=None):
+        if self.stats:
+            (log or logger).info(f"Время ожиданий по шагам: {self.summary()}")
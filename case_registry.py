@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from file_utils import file_signature
+
+logger = logging.getLogger('CaseRegistry')
+
+# Статусы дела в реестре: уже разобранные раньше (cases_num.txt), записанные
+# в CleanedArbitrage.csv и импортированные в Bitrix
+STATUS_LEGACY = 'legacy'
+STATUS_PREPARED = 'prepared'
+STATUS_IMPORTED = 'imported'
+# Дела с этими статусами повторно не выгружаются; prepared — импорт мог не дойти до Bitrix
+SEEN_STATUSES = (STATUS_LEGACY, STATUS_IMPORTED)
+
+# Ограничение SQLite на число параметров в одном запросе с запасом
+BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    case_num TEXT PRIMARY KEY,
+    first_seen TEXT NOT NULL,
+    source_bundle TEXT,
+    bitrix_status TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def get_registry_path(base_dir=None):
+    """Файл реестра дел (CASE_REGISTRY_DB, по умолчанию case_registry.sqlite3 в рабочем каталоге)"""
+    raw = (os.getenv('CASE_REGISTRY_DB') or '').strip()
+    return os.path.abspath(raw) if raw else os.path.join(base_dir or os.getcwd(), 'case_registry.sqlite3')
+
+
+def normalize_case_number(case_num):
+    """Номер дела для реестра — только цифры (как в prepare_data_for_export)"""
+    if not case_num:
+        return ""
+    return re.sub(r'[^\d]', '', str(case_num).strip())
+
+
+def _batches(items):
+    items = list(items)
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start + BATCH_SIZE]
+
+
+class CaseRegistry:
+    """Реестр номеров дел в SQLite (WAL): когда дело впервые встретилось, из какого поиска
+    и дошло ли оно до Bitrix. Первичный ключ по номеру даёт проверку пачки номеров
+    за O(k log n) и дозапись без перезаписи всей истории.
+
+    При открытии в реестр переносятся cases_num.txt и processed_cases.json; перенос
+    повторяется, только если эти файлы изменились с прошлого раза.
+    """
+
+    def __init__(self, path=None, base_dir=None):
+        self.base_dir = base_dir or os.getcwd()
+        self.path = path or get_registry_path(self.base_dir)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.migrate_legacy()
+
+    def _meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _insert(self, case_nums, status, source_bundle=None):
+        """Добавить номера, которых ещё нет в реестре; возвращает число новых"""
+        now = datetime.now().isoformat(timespec='seconds')
+        before = self.conn.total_changes
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO cases (case_num, first_seen, source_bundle, bitrix_status) VALUES (?, ?, ?, ?)',
+            ((case_num, now, source_bundle, status) for case_num in case_nums if case_num)
+        )
+        return self.conn.total_changes - before
+
+    def migrate_legacy(self):
+        """Перенести cases_num.txt (legacy) и processed_cases.json (imported) в реестр"""
+        sources = (
+            ('cases_num.txt', STATUS_LEGACY),
+            ('processed_cases.json', STATUS_IMPORTED),
+        )
+        with self.lock, self.conn:
+            for name, status in sources:
+                path = os.path.join(self.base_dir, name)
+                signature = file_signature(path)
+                if signature is None:
+                    continue
+                signature = '%d:%d' % signature
+                meta_key = f'migrated:{name}'
+                if self._meta(meta_key) == signature:
+                    continue
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        if name.endswith('.json'):
+                            arr = json.load(f)
+                            values = arr if isinstance(arr, list) else []
+                        else:
+                            values = f.readlines()
+                except Exception as e:
+                    logger.warning(f"Не удалось перенести {name} в реестр дел: {e}")
+                    continue
+                case_nums = {normalize_case_number(value) for value in values}
+                added = self._insert(case_nums, status)
+                if status == STATUS_IMPORTED:
+                    self._set_status(case_nums, STATUS_IMPORTED)
+                else:
+                    # Номер, дописанный в cases_num.txt вручную или старым загрузчиком,
+                    # больше не выгружается, даже если раньше был только подготовлен
+                    self._set_status(case_nums, STATUS_LEGACY, from_status=STATUS_PREPARED)
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (meta_key, signature)
+                )
+                logger.info(f"Реестр дел: из {name} перенесено {added} новых номеров")
+
+    def _set_status(self, case_nums, status, from_status=None):
+        """Сменить статус номеров; from_status — менять только дела с этим статусом"""
+        condition = 'bitrix_status = ? AND ' if from_status else ''
+        for batch in _batches(case_nums):
+            self.conn.execute(
+                f"UPDATE cases SET bitrix_status = ? WHERE {condition}case_num IN ({','.join('?' * len(batch))})",
+                (status, *((from_status,) if from_status else ()), *batch)
+            )
+
+    def seen(self, case_nums):
+        """Номера из case_nums, которые уже выгружались раньше (legacy или imported)"""
+        case_nums = [case_num for case_num in case_nums if case_num]
+        found = set()
+        statuses = ','.join('?' * len(SEEN_STATUSES))
+        with self.lock:
+            for batch in _batches(case_nums):
+                rows = self.conn.execute(
+                    f"SELECT case_num FROM cases WHERE bitrix_status IN ({statuses}) "
+                    f"AND case_num IN ({','.join('?' * len(batch))})",
+                    (*SEEN_STATUSES, *batch)
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def record_prepared(self, case_nums, source_bundle=None):
+        """Отметить дела, записанные в CleanedArbitrage.csv (время первой встречи не меняется)"""
+        with self.lock, self.conn:
+            return self._insert(case_nums, STATUS_PREPARED, source_bundle)
+
+    def mark_imported(self, case_nums):
+        """Отметить дела, импортированные в Bitrix"""
+        case_nums = {case_num for case_num in case_nums if case_num}
+        with self.lock, self.conn:
+            self._insert(case_nums, STATUS_IMPORTED)
+            self._set_status(case_nums, STATUS_IMPORTED)
+        return len(case_nums)
+
+    def counts(self):
+        """Число дел по статусам"""
+        with self.lock:
+            return dict(self.conn.execute('SELECT bitrix_status, COUNT(*) FROM cases GROUP BY bitrix_status'))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    registry = CaseRegistry()
+    logger.info(f"Реестр дел {registry.path}: {registry.counts()}")
+    registry.close()
@@ -0,0 +1,64 @@
+import os
+import re
+
+# Номер дела арбитражного суда: код суда, порядковый номер и год — "А40-123456/2026".
+# Порядковые номера в пределах суда и года выдаются по мере регистрации дел.
+CASE_NUMBER_RE = re.compile(r'^\s*([^\W\d_]+\d+)\s*-\s*(\d+)\s*/\s*(\d{2,4})')
+
+
+def incremental_enabled():
+    """Инкрементальный режим (CASEBOOK_INCREMENTAL): повторные проходы за день берут только дела
+    с номером выше водяного знака поиска. Выключен по умолчанию: дело со старым номером,
+    попавшее в выборку позже (например, после смены категории), в этом режиме не попадёт в лиды."""
+    return (os.getenv('CASEBOOK_INCREMENTAL') or 'false').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def case_sequence(case_num):
+    """('А40/2026', 123456) для номера дела или None, если номер не распознан"""
+    if not isinstance(case_num, str):
+        return None
+    m = CASE_NUMBER_RE.match(case_num)
+    if not m:
+        return None
+    return f"{m.group(1).upper()}/{m.group(3)}", int(m.group(2))
+
+
+def export_watermark(case_numbers, watermark=None):
+    """Водяной знак выгрузки: наибольший порядковый номер дела по каждому суду и году.
+
+    case_numbers — столбец 'Номер дела' (или его часть при чтении выгрузки частями);
+    watermark — знак предыдущих частей, он дополняется на месте и возвращается.
+    """
+    if watermark is None:
+        watermark = {}
+    for case_num in case_numbers.dropna():
+        parsed = case_sequence(case_num)
+        if parsed and parsed[1] > watermark.get(parsed[0], 0):
+            watermark[parsed[0]] = parsed[1]
+    return watermark
+
+
+def merge_watermarks(*watermarks):
+    merged = {}
+    for watermark in watermarks:
+        for prefix, seq in (watermark or {}).items():
+            if seq > merged.get(prefix, 0):
+                merged[prefix] = seq
+    return merged
+
+
+def highest_case(watermark):
+    """Самый старший номер дела водяного знака: (строка 'А40-123456/2026', порядковый номер)"""
+    if not watermark:
+        return '', 0
+    prefix, seq = max(watermark.items(), key=lambda item: (item[0].rsplit('/', 1)[-1], item[1]))
+    court_code, year = prefix.rsplit('/', 1)
+    return f"{court_code}-{seq}/{year}", seq
+
+
+def below_watermark(case_numbers, watermark):
+    """Маска строк, чьи дела уже учтены водяным знаком (номер не выше него)"""
+    def seen(case_num):
+        parsed = case_sequence(case_num)
+        return bool(parsed) and parsed[1] <= watermark.get(parsed[0], 0)
+    return case_numbers.map(seen).astype(bool)
@@ -1,6 +1,11 @@
+import io
 import os
 import re
 import sys
+import base64
+import codecs
+import hashlib
+import fnmatch
 import time
 import random
 import logging
@@ -9,14 +14,27 @@ from datetime import datetime, timedelta
 from typing import Literal
 from dotenv import load_dotenv
 from urllib.parse import urlparse
-import undetected_chromedriver as uc
+from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
+from casebook_http_client import CasebookHttpClient, http_mode_enabled
+from browser_wait import StepWaiter
+from cdp_client import CdpConnection
+from browser_daemon_client import endpoint_info
+import session_store
+import chrome_driver_cache
+import resource_blocking
+from export_merge import ExportWriter
+from case_watermark import incremental_enabled, merge_watermarks
+from casebook_form import batch_form_enabled, fill_search_form, form_delta_enabled, form_changes
+from browser_metrics import record_page_load, log_browser_metrics
+from rate_limiter import get_rate_limiter
 
 load_dotenv()
 
@@ -52,14 +70,20 @@ def log_step(step_description):
 
 
 class CasebookDownloader:
-    def __init__(self, court_type=None, category_code=None, min_summ=None):
-        # Каталог загрузки можно переопределить через DOWNLOAD_DIR
+    def __init__(self, court_type=None, category_code=None, min_summ=None, download_dir=None, profile_dir=None):
+        # Каталог загрузки можно переопределить через DOWNLOAD_DIR (или явно для рабочего пула)
         env_download_dir = (os.getenv('DOWNLOAD_DIR') or '').strip()
-        self.abs_path = os.path.abspath(env_download_dir) if env_download_dir else os.getcwd()
+        if download_dir:
+            self.abs_path = os.path.abspath(download_dir)
+        else:
+            self.abs_path = os.path.abspath(env_download_dir) if env_download_dir else os.getcwd()
         try:
             os.makedirs(self.abs_path, exist_ok=True)
         except Exception:
             pass
+        self.export_path = os.path.join(self.abs_path, 'ArbitrageSearchExport.csv')
+        # Отдельный профиль Chrome нужен, когда параллельно работают несколько сессий
+        self.profile_dir = os.path.abspath(profile_dir) if profile_dir else None
         self.court_type = court_type
         self.category_code = category_code
         self.min_summ = min_summ
@@ -67,6 +91,38 @@ class CasebookDownloader:
         self.yesterday = (datetime.now() - timedelta(days=1)).strftime('%d.%m.%Y')
         self.driver = None
         self.wait = None
+        self.waiter = None
+        # Подключение к браузеру хоста browser_daemon.py: quit() не закрывает сам браузер
+        self.attached = False
+        self.browser_pid = None
+        # Метрики загрузки страниц поиска за сессию (см. browser_metrics)
+        self.page_loads = []
+        # Фильтры, которыми заполнена открытая форма поиска (None — форма не заполнена или не известна)
+        self.form_state = None
+        # Число результатов поиска, открытого сейчас на странице (для form_state)
+        self.last_search_count = None
+        # Блок результатов не содержал счётчика (пустой контейнер — возможный признак блокировки)
+        self.last_count_missing = False
+        # Последний запрос не выгружался (или не требует подготовки): результаты не изменились (result_cache)
+        self.last_request_cached = False
+        # Водяной знак номеров дел прошлых проходов для текущего запроса (инкрементальный режим)
+        self.request_watermark = None
+        # Запись кэша результатов для свежей выгрузки: (ключ, число, хэш).
+        # Попадает в result_cache только после успешной подготовки (record_cache_entry)
+        self.pending_cache_entry = None
+        # SHA-256 последней выгрузки, посчитанный по ходу её получения (HTTP-загрузка,
+        # перехват в память, склейка частей); None — файл сохранил браузер, хэш считает prepare_data
+        self.export_hash = None
+        # Прямое CDP-подключение к браузеру для событий загрузки (Browser.downloadProgress)
+        self.cdp = None
+        self.last_download = None
+        # Перехват CSV-экспорта в память через CDP Fetch (CASEBOOK_EXPORT_IN_MEMORY) вместо записи на диск
+        self.capture_in_memory = (os.getenv('CASEBOOK_EXPORT_IN_MEMORY') or 'false').strip().lower() in ('1', 'true', 'yes', 'y')
+        self.export_url_pattern = (os.getenv('CASEBOOK_EXPORT_URL_PATTERN') or '*').strip() or '*'
+        self.export_buffer = None
+        self._page_sessions = {}
+        # HTTP-клиент с cookies браузера (CASEBOOK_HTTP_MODE), создаётся после login()
+        self.http_client = None
         # Установка диапазона дат из ENV с дефолтом на «сегодня»
         env_date = os.getenv('CASEBOOK_DATE')
         env_date_from = os.getenv('CASEBOOK_DATE_FROM')
@@ -91,8 +147,10 @@ class CasebookDownloader:
             logger.info("Инициализация процесса загрузки")
 
             # Удаление старого файла, если существует
-            if os.path.exists(os.path.join(self.abs_path, 'ArbitrageSearchExport.csv')):
-                os.remove(os.path.join(self.abs_path, 'ArbitrageSearchExport.csv'))
+            if os.path.exists(self.export_path):
+                os.remove(self.export_path)
+            if self.profile_dir:
+                os.makedirs(self.profile_dir, exist_ok=True)
 
             options = Options()
             options.page_load_strategy = 'eager'
@@ -101,6 +159,8 @@ class CasebookDownloader:
                 "download.prompt_for_download": False,
                 "safebrowsing.enabled": True
             }
+            # Картинки отключаются на уровне движка, остальное — через Network.setBlockedURLs
+            prefs.update(resource_blocking.content_settings_prefs())
             options.add_experimental_option("prefs", prefs)
             options.add_argument("--disable-dev-shm-usage")
             options.add_argument("--no-sandbox")
@@ -109,26 +169,76 @@ class CasebookDownloader:
             # Управление режимом headless через переменную окружения HEADLESS (true/false)
             headless_env = (os.getenv('HEADLESS') or 'true').strip().lower()
             run_headless = headless_env in ('1', 'true', 'yes', 'y')
-            try:
-                self.driver = uc.Chrome(headless=run_headless, options=options)
-            except Exception as start_err:
-                # Авто-подбор major-версии Chrome при несовпадении драйвера
-                msg = str(start_err)
-                m = re.search(r"Current browser version is (\d+)", msg)
-                if m:
-                    major = int(m.group(1))
-                    self.driver = uc.Chrome(headless=run_headless, options=options, version_main=major)
-                else:
-                    raise
-
-            self.driver.set_page_load_timeout(120)
-            time.sleep(1)
-            try:
-                self.driver.set_window_size(1400, 1000)
-            except Exception:
-                pass
+            # Драйвер и major-версия Chrome берутся из кэша: один запуск без повторного патча
+            self.driver = chrome_driver_cache.start_chrome(
+                headless=run_headless, options=options, user_data_dir=self.profile_dir
+            )
+
+            self.browser_pid = getattr(self.driver, 'browser_pid', None)
             self.driver.delete_all_cookies()
-            self.wait = WebDriverWait(self.driver, 60)
+            self._setup_driver()
+
+        except Exception as e:
+            if hasattr(self, 'driver') and self.driver:
+                self.driver.quit()
+            logger.error(f"Ошибка инициализации: {str(e)}")
+            raise
+
+    def attach(self, slot_entry):
+        """Подключиться к уже запущенному и залогиненному браузеру хоста browser_daemon.py.
+
+        chromedriver запускается отдельно с debuggerAddress и при quit() браузер не закрывает,
+        поэтому холодный старт Chrome и вход в Casebook выпадают из прогона.
+        """
+        address = slot_entry['debugger_address']
+        logger.info(f"Подключение к браузеру хоста: {address}")
+        if os.path.exists(self.export_path):
+            os.remove(self.export_path)
+
+        driver_path = slot_entry.get('driver_path')
+        if not driver_path or not os.path.exists(driver_path):
+            info = endpoint_info(address) or {}
+            m = re.search(r"Chrome/(\d+)", info.get('Browser', ''))
+            driver_path, _ = chrome_driver_cache.get_driver(int(m.group(1)) if m else None)
+
+        options = Options()
+        options.debugger_address = address
+        self.driver = webdriver.Chrome(service=ChromeService(executable_path=driver_path), options=options)
+        self.attached = True
+        self.browser_pid = slot_entry.get('browser_pid')
+        try:
+            self._setup_driver()
+        except Exception:
+            self.driver.quit()
+            raise
+
+    def _setup_driver(self):
+        """Общая настройка драйвера после запуска браузера или подключения к нему"""
+        self.driver.set_page_load_timeout(120)
+        try:
+            self.driver.set_window_size(1400, 1000)
+        except Exception:
+            pass
+        self.wait = WebDriverWait(self.driver, 60)
+        resource_blocking.apply_blocking(self.driver)
+        # Явные ожидания по событиям страницы вместо фиксированных пауз
+        self.waiter = StepWaiter(self.driver, timeout=60)
+        self.waiter.install_network_tracker()
+        # Загрузки отслеживаем по событиям CDP: файл сохраняется под GUID загрузки,
+        # поэтому итоговый путь известен точно и не путается с соседними загрузками
+        try:
+            self.cdp = CdpConnection.browser_for_driver(self.driver)
+            self.cdp.send('Browser.setDownloadBehavior', {
+                'behavior': 'allowAndName',
+                'downloadPath': self.abs_path,
+                'eventsEnabled': True
+            })
+            logger.info(f"Каталог загрузки: {self.abs_path} (отслеживание через CDP)")
+        except Exception as cdp_err:
+            logger.warning(f"CDP-отслеживание загрузок недоступно, используется опрос каталога: {cdp_err}")
+            if self.cdp is not None:
+                self.cdp.close()
+                self.cdp = None
             # Явно разрешаем скачивания и задаём каталог через CDP (надёжно для headless/macOS)
             try:
                 self.driver.execute_cdp_cmd('Page.setDownloadBehavior', {
@@ -139,25 +249,17 @@ class CasebookDownloader:
             except Exception as cdp_err:
                 logger.warning(f"Не удалось применить Page.setDownloadBehavior: {cdp_err}")
 
-        except Exception as e:
-            if hasattr(self, 'driver') and self.driver:
-                self.driver.quit()
-            logger.error(f"Ошибка инициализации: {str(e)}")
-            raise
-
     @log_step("Авторизация в Casebook")
     def login(self):
         """Выполнение авторизации в системе"""
         self.driver.get(os.getenv('CASEBOOK_LOGIN_URL'))
 
         # Ввод логина
-        self.wait.until(EC.presence_of_element_located((By.XPATH, "//input[@name='UserName']")))
-        login_field = self.driver.find_element(By.XPATH, "//input[@name='UserName']")
+        login_field = self.waiter.element((By.XPATH, "//input[@name='UserName']"), 'Логин: поле логина')
         login_field.send_keys(os.getenv('CASEBOOK_LOGIN'))
 
         # Ввод пароля
-        self.wait.until(EC.presence_of_element_located((By.XPATH, "//input[@name='Password']")))
-        password_field = self.driver.find_element(By.XPATH, "//input[@name='Password']")
+        password_field = self.waiter.element((By.XPATH, "//input[@name='Password']"), 'Логин: поле пароля')
         password_field.send_keys(os.getenv('CASEBOOK_PASSWORD'))
 
         old_url = self.driver.current_url
@@ -168,7 +270,56 @@ class CasebookDownloader:
             "//div[@class='b-form-control']/div[contains(@class, 'ui-button')]"
         ).click()
         # Ждём, когда произойдёт переход на другую страницу (смена URL)
-        self.wait.until(EC.url_changes(old_url))
+        self.waiter.url_changes(old_url, 'Логин: переход после входа')
+
+    def _origin(self):
+        login_url = os.getenv('CASEBOOK_LOGIN_URL') or self.driver.current_url
+        parsed = urlparse(login_url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def save_session(self):
+        """Сохранить cookies и localStorage после успешного входа (CASEBOOK_SESSION_FILE)"""
+        path = session_store.get_session_file()
+        if not path:
+            return
+        try:
+            session_store.save_browser_session(self.driver, path, self._origin())
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить сессию Casebook: {e}")
+
+    def is_logged_in(self):
+        """Проба авторизации: открыть страницу поиска и дождаться фильтра суда или формы входа"""
+        self.driver.get(self._origin() + "/app/request/new/cases")
+        probe = self.waiter.until(
+            lambda d: d.find_elements(By.XPATH, "//div[@data-title='Укажите суд']")
+            or d.find_elements(By.XPATH, "//input[@name='UserName']"),
+            'Сессия: проверка авторизации', timeout=20, required=False
+        )
+        return bool(probe) and probe[0].tag_name.lower() != 'input'
+
+    def restore_session(self):
+        """Восстановить сохранённую сессию и проверить её дешёвым запросом страницы поиска.
+
+        Возвращает True, если авторизация действует и login() не нужен.
+        """
+        path = session_store.get_session_file()
+        data = session_store.load_browser_session(path)
+        if not data:
+            return False
+        try:
+            session_store.restore_browser_session(self.driver, data)
+            if self.is_logged_in():
+                logger.info("Сессия Casebook восстановлена без повторного входа")
+                return True
+        except Exception as e:
+            logger.warning(f"Не удалось восстановить сессию Casebook: {e}")
+        logger.info("Сохранённая сессия недействительна, требуется вход")
+        session_store.delete_browser_session(path, data.get('saved_at'))
+        try:
+            self.driver.delete_all_cookies()
+        except Exception:
+            pass
+        return False
 
     @log_step("Переход на страницу поиска")
     def go_to_search_page(self):
@@ -189,58 +340,158 @@ class CasebookDownloader:
         target = origin + "/app/request/new/cases"
         self.driver.get(target)
         # Ждём появления ключевого фильтра "Укажите суд"
-        self.wait.until(EC.presence_of_element_located((
-            By.XPATH, "//div[@data-title='Укажите суд']"
-        )))
+        self.waiter.element((By.XPATH, "//div[@data-title='Укажите суд']"), 'Страница поиска: фильтр суда')
+        record_page_load(self.driver, self.page_loads)
 
     @log_step("Настройка параметров поиска")
     def setup_search_parameters(self):
-        """Установка параметров поиска дел"""
+        """Установка параметров поиска дел: одним скриптом на странице, при сбое — по шагам"""
+        if batch_form_enabled():
+            try:
+                result = self.waiter.measure(
+                    'Форма: пакетное заполнение', fill_search_form, self.driver, self.court_type,
+                    self.category_codes(), self.date_from_str, self.date_to_str, self.min_summ
+                )
+            except Exception as e:
+                result = {'ok': False, 'step': 'скрипт', 'error': str(e)}
+            if result.get('ok'):
+                return
+            logger.warning(
+                f"Пакетное заполнение формы не подтвердилось ({result.get('step')}: {result.get('error')}), "
+                f"заполнение по шагам"
+            )
+            # Форма могла остаться заполненной частично — начинаем с чистой страницы
+            self.go_to_search_page_via_url()
+        self._setup_search_parameters_steps()
+
+    def _setup_search_parameters_steps(self):
+        """Пошаговая установка параметров поиска через WebDriver"""
         # Выбор типа суда
-        court_filter = self.wait.until(EC.element_to_be_clickable((
-            By.XPATH, "//div[@data-title='Укажите суд']"
-        )))
+        court_filter = self.waiter.element(
+            (By.XPATH, "//div[@data-title='Укажите суд']"), 'Форма: фильтр суда', clickable=True
+        )
         self.driver.execute_script("arguments[0].scrollIntoView({block:'center'});", court_filter)
         self.driver.execute_script("arguments[0].click();", court_filter)
-        court_option = self.wait.until(EC.element_to_be_clickable((
-            By.XPATH, f"//label[contains(text(), '{self.court_type}')]"
-        )))
+        court_option = self.waiter.element(
+            (By.XPATH, f"//label[contains(text(), '{self.court_type}')]"), 'Форма: пункт суда', clickable=True
+        )
         self.driver.execute_script("arguments[0].click();", court_option)
-        # Выбор категории спора по коду
-        category_container = self.wait.until(EC.element_to_be_clickable((
-            By.XPATH, "//div[contains(@class,'b-filter-container') and contains(@class,'js-filter-container') and @data-title='Укажите категорию спора']"
-        )))
-        self.driver.execute_script("arguments[0].scrollIntoView({block:'center'});", category_container)
-        self.driver.execute_script("arguments[0].click();", category_container)
+        # Выбор категорий спора по коду (фильтр — мультиселект, категорий может быть несколько)
+        category_codes = self.category_codes()
+        for code_idx, code in enumerate(category_codes):
+            # Фолбэк на первый пункт списка допустим только для одиночной категории
+            self._select_category(code, allow_first_fallback=len(category_codes) == 1, reopen=code_idx == 0)
+        # Установка даты "с"
+        # Закрываем дропдаун категорией кликом вне (по телу) и ESC, чтобы не перекрывал поля
+        # self.driver.execute_script("document.body.click();")
+        # ActionChains(self.driver).send_keys(Keys.ESCAPE).perform()
+        self.waiter.network_idle('Форма: применение категорий')
+        # На некоторых страницах дропдаун категории перекрывает поля дат — закрываем ESC
+        try:
+            ActionChains(self.driver).send_keys(Keys.ESCAPE).perform()
+            self.waiter.gone(
+                (By.CSS_SELECTOR, "div.b-filter--case_categories ul.b-filter-dropdown-list"),
+                'Форма: закрытие списка категорий', timeout=2
+            )
+        except Exception:
+            pass
+
+        # Устанавливаем даты с повторными попытками и верификацией значения
+        self._set_date_field_with_retry("//input[@data-name='from']", self.date_from_str)
+        self._set_date_field_with_retry("//input[@data-name='to']", self.date_to_str)
+
+        sum_param = self.driver.find_elements(By.XPATH, "//div[@data-id='param-sum']")
+        if not sum_param:
+            # Добавление поля для суммы 
+            self.driver.find_element(
+                By.XPATH, "//div[contains(@class, 'b-operator-button')]"
+            ).click()
+            self.waiter.element((By.XPATH, "//div[@data-id='param-sum']"), 'Форма: параметр суммы').click()
+        # Указание минимальной суммы
+        min_summ_field = self.waiter.element((By.XPATH, "//input[@name='minSum']"), 'Форма: поле суммы')
+        min_summ_field.send_keys(self.min_summ)
+        self.waiter.value_committed(min_summ_field, self.min_summ, 'Форма: ввод суммы', timeout=1, digits_only=True)
+
+    def form_target(self):
+        """Значения фильтров текущего запроса в виде состояния формы"""
+        return {
+            'court': self.court_type,
+            'categories': self.category_codes(),
+            'date_from': self.date_from_str,
+            'date_to': self.date_to_str,
+            'min_sum': str(self.min_summ),
+        }
+
+    def update_search_form(self, state):
+        """Изменить в заполненной форме только отличающиеся фильтры; False — нужна чистая страница"""
+        if not (form_delta_enabled() and batch_form_enabled()):
+            return False
+        changes = form_changes(state, self.form_target())
+        if changes is None or '/app/request' not in self.driver.current_url:
+            return False
+        try:
+            result = self.waiter.measure('Форма: частичное обновление', fill_search_form, self.driver, **changes)
+        except Exception as e:
+            result = {'ok': False, 'step': 'скрипт', 'error': str(e)}
+        if not result.get('ok'):
+            logger.warning(f"Частичное обновление формы не удалось ({result.get('step')}: {result.get('error')})")
+            return False
+        changed = [key for key, value in changes.items() if value not in (None, [], False)]
+        logger.info(f"Форма поиска обновлена без перезагрузки: {', '.join(changed) or 'без изменений'}")
+        return True
+
+    def category_codes(self):
+        """Коды категорий текущего запроса списком (category_code — строка или список)"""
+        if isinstance(self.category_code, (list, tuple)):
+            return [str(code) for code in self.category_code]
+        return [str(self.category_code)]
+
+    def _select_category(self, code, allow_first_fallback=True, reopen=True):
+        """Отметить категорию спора с кодом code в выпадающем списке категорий"""
+        input_inside = None
+        if not reopen:
+            visible_inputs = [
+                el for el in self.driver.find_elements(
+                    By.XPATH, "//div[contains(@class,'b-filter--case_categories')]//input"
+                ) if el.is_displayed()
+            ]
+            input_inside = visible_inputs[0] if visible_inputs else None
+        if input_inside is None:
+            category_container = self.waiter.element((
+                By.XPATH, "//div[contains(@class,'b-filter-container') and contains(@class,'js-filter-container') and @data-title='Укажите категорию спора']"
+            ), 'Категория: открытие списка', clickable=True)
+            self.driver.execute_script("arguments[0].scrollIntoView({block:'center'});", category_container)
+            self.driver.execute_script("arguments[0].click();", category_container)
 
         # Пытаемся вводить код в поле ввода внутри категории (если есть)
         try:
-            input_inside = self.wait.until(EC.presence_of_element_located((
-                By.XPATH, "//div[contains(@class,'b-filter--case_categories')]//input"
-            )))
+            if input_inside is None:
+                input_inside = self.waiter.element(
+                    (By.XPATH, "//div[contains(@class,'b-filter--case_categories')]//input"), 'Категория: поле ввода'
+                )
             input_inside.clear()
-            input_inside.send_keys(str(self.category_code))
-            time.sleep(0.5)
+            input_inside.send_keys(code)
+            self.waiter.network_idle('Категория: фильтрация списка')
         except Exception:
             try:
                 actions = ActionChains(self.driver)
-                for ch in str(self.category_code):
+                for ch in code:
                     actions.send_keys(ch)
                 actions.perform()
-                time.sleep(0.5)
+                self.waiter.network_idle('Категория: фильтрация списка')
             except Exception:
                 pass
 
         # Пытаемся выбрать пункт, содержащий код категории
         label_elem = None
         try:
-            label_elem = self.wait.until(EC.presence_of_element_located((
-                By.XPATH, f"//div[contains(@class,'b-filter--case_categories')]//li[contains(@class,'b-filter-option')]//label[contains(., '{str(self.category_code)}')]"
-            )))
+            label_elem = self.waiter.element((
+                By.XPATH, f"//div[contains(@class,'b-filter--case_categories')]//li[contains(@class,'b-filter-option')]//label[contains(., '{code}')]"
+            ), 'Категория: пункт списка')
         except Exception:
             pass
 
-        if not label_elem:
+        if not label_elem and allow_first_fallback:
             # Фолбэк: берём первый элемент списка
             lis = self.wait.until(EC.presence_of_all_elements_located((
                 By.CSS_SELECTOR, "div.b-filter--case_categories ul.b-filter-dropdown-list li.b-filter-option"
@@ -251,51 +502,25 @@ class CasebookDownloader:
         if label_elem:
             self.driver.execute_script("arguments[0].scrollIntoView({block:'center'});", label_elem)
             self.driver.execute_script("arguments[0].click();", label_elem)
-        # Установка даты "с"
-        # Закрываем дропдаун категорией кликом вне (по телу) и ESC, чтобы не перекрывал поля
-        # self.driver.execute_script("document.body.click();")
-        # ActionChains(self.driver).send_keys(Keys.ESCAPE).perform()
-        time.sleep(0.5)
-        # На некоторых страницах дропдаун категории перекрывает поля дат — закрываем ESC
-        try:
-            ActionChains(self.driver).send_keys(Keys.ESCAPE).perform()
-            time.sleep(0.2)
-        except Exception:
-            pass
-
-        # Устанавливаем даты с повторными попытками и верификацией значения
-        self._set_date_field_with_retry("//input[@data-name='from']", self.date_from_str)
-        self._set_date_field_with_retry("//input[@data-name='to']", self.date_to_str)
-
-        sum_param = self.driver.find_elements(By.XPATH, "//div[@data-id='param-sum']")
-        if not sum_param:
-            # Добавление поля для суммы 
-            self.driver.find_element(
-                By.XPATH, "//div[contains(@class, 'b-operator-button')]"
-            ).click()
-            self.wait.until(EC.presence_of_element_located((
-                By.XPATH, "//div[@data-id='param-sum']"
-            ))).click()
-            time.sleep(0.2)
-        # Указание минимальной суммы
-        min_summ_field = self.wait.until(EC.presence_of_element_located((
-            By.XPATH, "//input[@name='minSum']"
-        )))
-        min_summ_field.send_keys(self.min_summ)
-        time.sleep(0.2)
+        else:
+            logger.warning(f"Категория спора с кодом {code} не найдена в списке")
 
     @log_step("Выполнение поиска дел")
     def perform_search(self):
         """Запуск поиска дел"""
+        # При повторном поиске на той же странице блок результатов уже есть — ждём его обновления
+        since = self.waiter.page_time() if self.driver.find_elements(By.ID, "search_results_total") else None
         self.driver.find_element(
             By.XPATH, "//div[contains(@class, 'b-quick_menu-button--search')]"
         ).click()
+        if since:
+            self.waiter.network_idle('Поиск: обновление результатов', since=since, timeout=60)
         # Ожидаем, когда появится блок с количеством результатов
-        self.wait.until(EC.presence_of_element_located((By.ID, "search_results_total")))
+        self.waiter.element((By.ID, "search_results_total"), 'Поиск: блок результатов')
 
     def _set_date_field_with_retry(self, xpath: str, value: str):
         """Надёжно установить дату в поле: клик, очистка, ввод, проверка и JS-фолбэк."""
-        elem = self.wait.until(EC.presence_of_element_located((By.XPATH, xpath)))
+        elem = self.waiter.element((By.XPATH, xpath), 'Дата: поле')
         try:
             self.driver.execute_script("arguments[0].scrollIntoView({block:'center'});", elem)
         except Exception:
@@ -318,12 +543,12 @@ class CasebookDownloader:
             elem.send_keys(Keys.DELETE)
         except Exception:
             pass
-        time.sleep(0.1)
+        self.waiter.value_committed(elem, '', 'Дата: очистка', timeout=1)
         try:
             elem.send_keys(value)
         except Exception:
             pass
-        time.sleep(0.2)
+        self.waiter.value_committed(elem, value, 'Дата: ввод', timeout=1)
         actual = (elem.get_attribute('value') or '').strip()
         if actual != value:
             try:
@@ -331,16 +556,16 @@ class CasebookDownloader:
                     "arguments[0].value = arguments[1]; arguments[0].dispatchEvent(new Event('input', {bubbles:true})); arguments[0].dispatchEvent(new Event('change', {bubbles:true}));",
                     elem, value
                 )
-                time.sleep(0.1)
+                self.waiter.value_committed(elem, value, 'Дата: JS-фолбэк', timeout=1)
             except Exception:
                 pass
-            actual = (elem.get_attribute('value') or '').strip()
 
     @log_step("Проверка количества результатов")
     def get_results_count(self):
         """Считать число найденных дел из блока с id=search_results_total"""
+        self.last_count_missing = False
         try:
-            elem = self.wait.until(EC.presence_of_element_located((By.ID, "search_results_total")))
+            elem = self.waiter.element((By.ID, "search_results_total"), 'Поиск: счётчик результатов')
             text = (elem.text or "").replace('\xa0', ' ').strip()
 
             # Универсальный парсинг: берём число после "Найдено", регистронезависимо; запасной парсер — первое число в строке
@@ -349,35 +574,218 @@ class CasebookDownloader:
                 match = re.search(r"([\d\s]+)", text)
             if match:
                 return int(re.sub(r"\s+", "", match.group(1)))
+            self.last_count_missing = True
             return 0
         except Exception:
+            self.last_count_missing = True
             return 0
 
+    def block_signal(self):
+        """Признак блокировки на открытой странице: 'login' (форма входа), 'captcha' или None"""
+        try:
+            if self.driver.find_elements(By.XPATH, "//input[@name='UserName']"):
+                return 'login'
+            page = (self.driver.page_source or '').lower()
+        except Exception:
+            return None
+        if 'captcha' in page or 'капч' in page:
+            return 'captcha'
+        return None
+
+    def export_source(self):
+        """Источник последней выгрузки для prepare_data: буфер в памяти или путь к файлу"""
+        if self.export_buffer is not None:
+            self.export_buffer.seek(0)
+            return self.export_buffer
+        return self.export_path
+
     @log_step("Скачивание результатов")
     def download_results(self):
         """Скачивание результатов в CSV формате"""
+        # Файл от предыдущего запроса (если prepare_data его не удалил) нельзя принять за новый
+        target_name = self.export_path
+        self.export_buffer = None
+        self.export_hash = None
+        if os.path.exists(target_name):
+            os.remove(target_name)
+
         # Открытие меню
         self.driver.find_element(
             By.XPATH, "(//div[contains(@class, 'js-extra_menu')])[1]"
         ).click()
 
+        # События прошлых загрузок не должны попасть в ожидание текущей
+        if self.cdp is not None:
+            self.cdp.drain_events()
+
+        capture_session = None
+        if self.cdp is not None and self.capture_in_memory:
+            try:
+                capture_session = self._page_session()
+                self.cdp.send('Fetch.enable', {
+                    'patterns': [{'urlPattern': self.export_url_pattern, 'requestStage': 'Response'}]
+                }, session_id=capture_session)
+            except Exception as fetch_err:
+                logger.warning(f"Перехват экспорта в память недоступен, файл будет сохранён на диск: {fetch_err}")
+                capture_session = None
+
         # Выбор опции экспорта
         start_ts = time.time()
         self.wait.until(EC.presence_of_element_located((
             By.XPATH, "//div[@id='extra_menu_subpartition']/li[2]"
         ))).click()
 
-        # Ожидание загрузки файла: учитываем .crdownload и варианты имён
-        target_name = os.path.join(self.abs_path, 'ArbitrageSearchExport.csv')
+        if capture_session is not None:
+            try:
+                self.export_buffer = self._capture_export_cdp(capture_session)
+            finally:
+                try:
+                    self.cdp.send('Fetch.disable', session_id=capture_session)
+                except Exception:
+                    pass
+            if self.export_buffer is not None:
+                self.export_hash = hashlib.sha256(self.export_buffer.getbuffer()).hexdigest()
+                return
+            # Ответ не попал под перехват — браузер начал обычную загрузку на диск
+            downloaded_path = self._wait_download_cdp()
+        elif self.cdp is not None:
+            downloaded_path = self._wait_download_cdp()
+        else:
+            downloaded_path = self._wait_download_glob(start_ts)
+
+        if downloaded_path and os.path.abspath(downloaded_path) != os.path.abspath(target_name):
+            try:
+                if os.path.exists(target_name):
+                    os.remove(target_name)
+                os.replace(downloaded_path, target_name)
+            except Exception as rn_err:
+                logger.warning(f"Не удалось переименовать {downloaded_path} → ArbitrageSearchExport.csv: {rn_err}")
+
+    def _page_session(self):
+        """CDP-сессия (flatten) для текущей вкладки драйвера на браузерном подключении"""
+        target_id = self.driver.current_window_handle
+        session_id = self._page_sessions.get(target_id)
+        if session_id is None:
+            session_id = self.cdp.send('Target.attachToTarget', {'targetId': target_id, 'flatten': True})['sessionId']
+            self._page_sessions[target_id] = session_id
+        return session_id
+
+    @staticmethod
+    def _is_export_response(params):
+        """Ответ с CSV-выгрузкой: вложение или text/csv"""
+        if params.get('responseStatusCode') != 200:
+            return False
+        headers = {h.get('name', '').lower(): h.get('value', '') for h in params.get('responseHeaders') or []}
+        disposition = headers.get('content-disposition', '').lower()
+        content_type = headers.get('content-type', '').lower()
+        return 'attachment' in disposition or 'csv' in content_type
+
+    @staticmethod
+    def _response_charset(params, default='windows-1251'):
+        """Кодировка ответа из Content-Type; без charset — кодировка выгрузок Casebook"""
+        for header in params.get('responseHeaders') or []:
+            if header.get('name', '').lower() != 'content-type':
+                continue
+            match = re.search(r'charset\s*=\s*"?([\w.:-]+)', header.get('value', ''), re.IGNORECASE)
+            if match:
+                try:
+                    return codecs.lookup(match.group(1)).name
+                except LookupError:
+                    logger.warning(f"Неизвестная кодировка ответа экспорта {match.group(1)!r}, используется {default}")
+        return default
+
+    def _capture_export_cdp(self, session_id, timeout=300):
+        """Перехватить тело ответа экспорта через Fetch.requestPaused и не дать ему уйти на диск.
+
+        Возвращает BytesIO с CSV или None, если браузер начал обычную загрузку файла.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Превышено время ожидания ответа экспорта")
+            event = self.cdp.wait_for_event(
+                lambda e: e.get('method') == 'Browser.downloadWillBegin' or (
+                    e.get('method') == 'Fetch.requestPaused' and e.get('sessionId') == session_id
+                ),
+                timeout=min(remaining, 10)
+            )
+            if event is None:
+                continue
+            if event['method'] == 'Browser.downloadWillBegin':
+                self.cdp.events.appendleft(event)
+                return None
+
+            params = event.get('params', {})
+            request_id = params['requestId']
+            if not self._is_export_response(params) or not fnmatch.fnmatch(params.get('request', {}).get('url', ''), self.export_url_pattern):
+                self.cdp.send('Fetch.continueRequest', {'requestId': request_id}, session_id=session_id)
+                continue
+
+            body = self.cdp.send('Fetch.getResponseBody', {'requestId': request_id}, session_id=session_id, timeout=120)
+            if body.get('base64Encoded'):
+                content = base64.b64decode(body['body'])
+            else:
+                # Текстовое тело Chrome отдаёт уже декодированным — возвращаем байты в кодировке ответа
+                content = body['body'].encode(self._response_charset(params))
+            # Прерываем запрос в браузере — файл не записывается в каталог загрузки
+            self.cdp.send('Fetch.failRequest', {'requestId': request_id, 'errorReason': 'Aborted'}, session_id=session_id)
+            self.last_download = {'guid': None, 'path': None, 'suggested_name': None, 'bytes': len(content)}
+            logger.info(f"Выгрузка получена в память: {len(content)} байт")
+            return io.BytesIO(content)
+
+    def _wait_download_cdp(self, timeout=300):
+        """Дождаться завершения загрузки по событиям Browser.downloadWillBegin/downloadProgress"""
+        deadline = time.monotonic() + timeout
+        next_log = time.monotonic() + 10
+        guid = None
+        suggested_name = None
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Превышено время ожидания загрузки файла")
+            event = self.cdp.wait_for_event(
+                lambda e: e.get('method') in ('Browser.downloadWillBegin', 'Browser.downloadProgress'),
+                timeout=min(remaining, 10)
+            )
+            if time.monotonic() >= next_log:
+                logger.info(f"Ожидание загрузки файла... {int(timeout - remaining)} сек.")
+                next_log = time.monotonic() + 10
+            if event is None:
+                continue
+
+            params = event.get('params', {})
+            if event['method'] == 'Browser.downloadWillBegin':
+                if guid is None:
+                    guid = params.get('guid')
+                    suggested_name = params.get('suggestedFilename')
+                continue
+            if params.get('guid') != guid:
+                continue
+            state = params.get('state')
+            if state == 'completed':
+                path = os.path.join(self.abs_path, guid)
+                self.last_download = {
+                    'guid': guid,
+                    'path': path,
+                    'suggested_name': suggested_name,
+                    'bytes': params.get('receivedBytes')
+                }
+                logger.info(f"Файл {suggested_name} загружен: {params.get('receivedBytes')} байт")
+                return path
+            if state == 'canceled':
+                raise RuntimeError(f"Загрузка {suggested_name} отменена браузером")
+
+    def _wait_download_glob(self, start_ts):
+        """Опрос каталога загрузки: учитываем .crdownload и варианты имён"""
+        target_name = self.export_path
         spent_time = 0
-        downloaded_path: str | None = None
         while True:
             if spent_time >= 300:  # 5 минут timeout
                 raise TimeoutError("Превышено время ожидания загрузки файла")
 
             if os.path.exists(target_name):
-                downloaded_path = target_name
-                break
+                return target_name
 
             candidates = [
                 p for p in glob.glob(os.path.join(self.abs_path, 'ArbitrageSearchExport*.csv'))
@@ -388,22 +796,13 @@ class CasebookDownloader:
                 for p in glob.glob(os.path.join(self.abs_path, '*.crdownload'))
             )
             if candidates and not cr_in_progress:
-                downloaded_path = max(candidates, key=os.path.getmtime)
-                break
+                return max(candidates, key=os.path.getmtime)
 
             time.sleep(1)
             spent_time += 1
             if spent_time % 10 == 0:
                 logger.info(f"Ожидание загрузки файла... {spent_time} сек.")
 
-        if downloaded_path and os.path.abspath(downloaded_path) != os.path.abspath(target_name):
-            try:
-                if os.path.exists(target_name):
-                    os.remove(target_name)
-                os.replace(downloaded_path, target_name)
-            except Exception as rn_err:
-                logger.warning(f"Не удалось переименовать {downloaded_path} → ArbitrageSearchExport.csv: {rn_err}")
-
     def execute(self):
         """Основной метод выполнения процесса"""
         try:
@@ -430,6 +829,10 @@ class CasebookDownloader:
             logger.error(f"Критическая ошибка: {str(e)}")
             return False, f"Ошибка: {str(e)}"
         finally:
+            if self.waiter is not None:
+                self.waiter.log_summary(logger)
+            if self.cdp is not None:
+                self.cdp.close()
             if hasattr(self, 'driver') and self.driver:
                 try:
                     self.driver.quit()
@@ -451,17 +854,232 @@ def run_casebook_driver(court_type, category_code, min_summ):
     return downloader.execute()
 
 
-def create_casebook_session() -> CasebookDownloader:
+def create_casebook_session(download_dir=None, profile_dir=None) -> CasebookDownloader:
     """Создать и залогинить сессию Casebook для множества запросов"""
-    downloader = CasebookDownloader()
+    downloader = CasebookDownloader(download_dir=download_dir, profile_dir=profile_dir)
     downloader.initialize()
-    downloader.login()
+    # Сначала пробуем сохранённую сессию; полный вход — только если она не прошла проверку
+    if not downloader.restore_session():
+        downloader.login()
+        downloader.save_session()
+    _enable_http_mode(downloader)
     return downloader
 
 
-def process_casebook_request(downloader: CasebookDownloader, court_type: str, category_code: str, min_summ: str, date_from: str | None = None):
-    """Обработать один запрос в рамках открытой сессии. Возвращает (bool, count)."""
-    # Настройка дат: приоритет параметра функции, затем ENV, затем «сегодня»
+def attach_casebook_session(slot_entry, download_dir=None) -> CasebookDownloader:
+    """Подключиться к залогиненному браузеру хоста browser_daemon.py вместо запуска нового"""
+    downloader = CasebookDownloader(download_dir=download_dir)
+    downloader.attach(slot_entry)
+    try:
+        # Хост держит сессию живой, но проверяем её той же пробой, что и при восстановлении
+        if not downloader.is_logged_in():
+            logger.info("Сессия браузера хоста истекла, выполняется вход")
+            downloader.login()
+            downloader.save_session()
+    except Exception:
+        close_casebook_session(downloader)
+        raise
+    _enable_http_mode(downloader)
+    return downloader
+
+
+def _enable_http_mode(downloader: CasebookDownloader):
+    if http_mode_enabled():
+        try:
+            downloader.http_client = CasebookHttpClient.from_driver(downloader.driver)
+            logger.info("Включён режим прямых HTTP-запросов к Casebook")
+        except Exception as http_err:
+            logger.warning(f"Не удалось создать HTTP-клиент Casebook, используется браузер: {http_err}")
+
+
+def process_casebook_request(downloader: CasebookDownloader, court_type: str, category_code: str, min_summ: str, date_from: str | None = None, result_cache=None):
+    """Обработать один запрос в рамках открытой сессии. Возвращает (bool, count).
+
+    С result_cache выгрузка пропускается, если число результатов не изменилось с прошлого
+    прохода; тогда downloader.last_request_cached = True (так же — если выгрузка совпала
+    с прошлой побайтно, и её подготовку можно пропустить). В инкрементальном режиме
+    downloader.request_watermark — водяной знак прошлых проходов для prepare_data.
+    Запись о свежей выгрузке остаётся в downloader.pending_cache_entry, пока вызывающий
+    не подготовит её и не вызовет record_cache_entry.
+    """
+    _apply_request_dates(downloader, date_from)
+    downloader.last_request_cached = False
+    downloader.export_hash = None
+    downloader.request_watermark = None
+    downloader.pending_cache_entry = None
+    cache_key = None
+    if result_cache is not None and result_cache.enabled:
+        cache_key = result_cache.key(
+            court_type, category_code, min_summ, downloader.date_from_str, downloader.date_to_str
+        )
+        if incremental_enabled():
+            downloader.request_watermark = (result_cache.get(cache_key) or {}).get('watermark')
+
+    if downloader.http_client is not None:
+        try:
+            return _process_casebook_request_http(
+                downloader, court_type, category_code, min_summ, result_cache, cache_key
+            )
+        except Exception as http_err:
+            _http_failed(downloader, http_err)
+            logger.warning(f"HTTP-запрос к Casebook не удался, переход на браузер: {http_err}")
+
+    results_count = _search_ui(downloader, court_type, category_code, min_summ)
+    if results_count > 0:
+        if _skip_unchanged(downloader, result_cache, cache_key, results_count):
+            return False, results_count
+        _fetch_export(downloader, court_type, category_code, min_summ, results_count)
+        _remember_export(downloader, result_cache, cache_key, results_count)
+        return True, results_count
+    return False, 0
+
+
+def get_max_results():
+    """Потолок результатов одной выгрузки (CASEBOOK_MAX_RESULTS, по умолчанию 5000; 0 — без разбиения)"""
+    raw = (os.getenv('CASEBOOK_MAX_RESULTS') or '5000').strip()
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return 5000
+
+
+def _fetch_export(downloader: CasebookDownloader, court_type, category_code, min_summ, results_count, http=False):
+    """Выгрузить результаты открытого поиска; при превышении потолка — по частям диапазона дат.
+
+    Части выгружаются по очереди в той же сессии и сразу дописываются в файл выгрузки
+    (downloader.export_path) с одним заголовком, так что подготовка видит обычную выгрузку,
+    а в памяти одновременно держится не больше одной части.
+    """
+    ceiling = get_max_results()
+    date_from, date_to = downloader.date_from_str, downloader.date_to_str
+    if not ceiling or results_count <= ceiling or date_from == date_to:
+        _download_window(downloader, court_type, category_code, min_summ, http)
+        return
+
+    logger.info(f"Результатов {results_count} больше потолка {ceiling} — диапазон {date_from}–{date_to} выгружается по частям")
+    # Части скачиваются в export_path, поэтому собираются рядом и заменяют его в конце
+    merged_path = f"{downloader.export_path}.parts"
+    try:
+        with open(merged_path, 'wb') as out:
+            writer = ExportWriter(out)
+            _collect_windows(downloader, court_type, category_code, min_summ, http,
+                             _parse_date(date_from), _parse_date(date_to), results_count, ceiling, writer)
+        os.replace(merged_path, downloader.export_path)
+        downloader.export_hash = writer.hexdigest()
+    finally:
+        downloader.date_from_str, downloader.date_to_str = date_from, date_to
+        if os.path.exists(merged_path):
+            os.remove(merged_path)
+    downloader.export_buffer = None
+    logger.info(f"Выгрузка собрана из {writer.parts} частей")
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%d.%m.%Y')
+
+
+def _collect_windows(downloader, court_type, category_code, min_summ, http, start, end, count, ceiling, writer):
+    """Рекурсивно делить окно дат пополам, пока число результатов не уложится в потолок"""
+    if count == 0:
+        return
+    downloader.date_from_str = start.strftime('%d.%m.%Y')
+    downloader.date_to_str = end.strftime('%d.%m.%Y')
+    if count <= ceiling or start == end:
+        if count > ceiling:
+            logger.warning(f"За {downloader.date_from_str} найдено {count} дел — больше потолка, но день не делится")
+        _download_window(downloader, court_type, category_code, min_summ, http)
+        _append_window(downloader, writer)
+        return
+    middle = start + timedelta(days=(end - start).days // 2)
+    for window_start, window_end in ((start, middle), (middle + timedelta(days=1), end)):
+        downloader.date_from_str = window_start.strftime('%d.%m.%Y')
+        downloader.date_to_str = window_end.strftime('%d.%m.%Y')
+        if http:
+            window_count = _http_results_count(downloader, court_type, category_code, min_summ)
+        else:
+            window_count = _search_ui(downloader, court_type, category_code, min_summ)
+        logger.info(f"Окно {downloader.date_from_str}–{downloader.date_to_str}: {window_count} дел")
+        _collect_windows(downloader, court_type, category_code, min_summ, http,
+                         window_start, window_end, window_count, ceiling, writer)
+
+
+def _download_window(downloader: CasebookDownloader, court_type, category_code, min_summ, http):
+    """Выгрузить текущее окно дат: через HTTP-экспорт или меню открытого в браузере поиска"""
+    get_rate_limiter().acquire()
+    if http:
+        downloader.export_buffer = None
+        downloader.export_hash = downloader.http_client.download_export(
+            court_type, category_code, downloader.date_from_str, downloader.date_to_str, min_summ,
+            downloader.export_path, watermark=downloader.request_watermark
+        )
+    else:
+        downloader.download_results()
+
+
+def _append_window(downloader: CasebookDownloader, writer):
+    """Дописать последнюю выгрузку в общий файл; файл части удаляется, чтобы не попасть в следующую"""
+    source = downloader.export_source()
+    downloader.export_buffer = None
+    writer.append(source)
+    if isinstance(source, (str, os.PathLike)):
+        os.remove(source)
+
+
+def _skip_unchanged(downloader: CasebookDownloader, result_cache, cache_key, results_count):
+    if cache_key and result_cache.is_unchanged(cache_key, results_count):
+        downloader.last_request_cached = True
+        logger.info("Число результатов не изменилось с прошлого прохода — выгрузка пропущена")
+        return True
+    return False
+
+
+def _remember_export(downloader: CasebookDownloader, result_cache, cache_key, results_count):
+    """Подготовить запись кэша: число результатов и хэш свежей выгрузки.
+
+    Хэш, посчитанный при получении выгрузки, сразу сравнивается с прошлым: совпавшую
+    выгрузку не нужно готовить. Для файла, сохранённого браузером, хэш и водяной знак
+    берутся из прохода prepare_data (record_cache_entry) — файл не перечитывается.
+    """
+    if not cache_key:
+        return
+    content_hash = downloader.export_hash
+    if content_hash and result_cache.same_content(cache_key, content_hash):
+        downloader.last_request_cached = True
+        logger.info("Выгрузка совпадает с прошлой — подготовка не нужна")
+    downloader.pending_cache_entry = (cache_key, results_count, content_hash)
+
+
+def record_cache_entry(downloader: CasebookDownloader, result_cache, prepare_stats=None):
+    """Учесть выгрузку в кэше результатов — после того, как её дела подготовлены.
+
+    prepare_stats — prepare_data.last_stats этой выгрузки: хэш и водяной знак из её прохода.
+    Без них (выгрузка совпала с прошлой) водяной знак остаётся прежним.
+    """
+    if result_cache is None or downloader.pending_cache_entry is None:
+        return
+    cache_key, results_count, content_hash = downloader.pending_cache_entry
+    prepare_stats = prepare_stats or {}
+    watermark = None
+    if incremental_enabled():
+        watermark = merge_watermarks(downloader.request_watermark, prepare_stats.get('export_watermark'))
+    result_cache.record(cache_key, results_count, content_hash or prepare_stats.get('content_hash'), watermark)
+    downloader.pending_cache_entry = None
+
+
+def probe_casebook_request(downloader: CasebookDownloader, court_type: str, category_code, min_summ: str, date_from: str | None = None) -> int:
+    """Только число результатов запроса (без выгрузки): HTTP-счётчик, если доступен, иначе поиск в браузере"""
+    _apply_request_dates(downloader, date_from)
+    if downloader.http_client is not None:
+        try:
+            return _http_results_count(downloader, court_type, category_code, min_summ)
+        except Exception as http_err:
+            _http_failed(downloader, http_err)
+            logger.warning(f"HTTP-счётчик Casebook недоступен, переход на браузер: {http_err}")
+    return _search_ui(downloader, court_type, category_code, min_summ)
+
+
+def _apply_request_dates(downloader: CasebookDownloader, date_from: str | None):
+    """Настройка дат: приоритет параметра запроса, затем ENV, затем «сегодня»"""
     if date_from and date_from.strip():
         downloader.date_from_str = date_from.strip()
         downloader.date_to_str = date_from.strip()
@@ -481,26 +1099,118 @@ def process_casebook_request(downloader: CasebookDownloader, court_type: str, ca
             downloader.date_from_str = downloader.today
             downloader.date_to_str = downloader.today
 
-    downloader.go_to_search_page_via_url()
-    downloader.setup_search_parameters_for(court_type, category_code, min_summ)
+
+def _search_ui(downloader: CasebookDownloader, court_type, category_code, min_summ) -> int:
+    """Поиск в браузере: заполнить (или обновить) форму, запустить поиск и вернуть число результатов"""
+    downloader.court_type = court_type
+    downloader.category_code = category_code
+    downloader.min_summ = min_summ
+    target = downloader.form_target()
+    # Результаты этого же поиска уже на странице (например, после фазы проб) — повторный поиск не нужен
+    if downloader.form_state == target and downloader.last_search_count is not None:
+        logger.info("Результаты поиска уже открыты, повторный поиск пропущен")
+        return downloader.last_search_count
+
+    # Сбрасываем состояние формы заранее: при ошибке следующая попытка начнёт с чистой страницы
+    form_state, downloader.form_state = downloader.form_state, None
+    downloader.last_search_count = None
+    if not downloader.update_search_form(form_state):
+        downloader.go_to_search_page_via_url()
+        downloader.setup_search_parameters()
+    limiter = get_rate_limiter()
+    limiter.acquire()
+    started = time.monotonic()
     downloader.perform_search()
+    downloader.form_state = target
     results_count = downloader.get_results_count()
+    if downloader.last_count_missing:
+        limiter.record_signal(downloader.block_signal() or 'empty')
+    else:
+        limiter.record_success(time.monotonic() - started)
+    downloader.last_search_count = results_count
     try:
         logger.info(f"Результаты поиска: {num_to_emoji(results_count)} {pluralize_cases(results_count)}")
     except Exception:
         pass
+    return results_count
+
+
+def _http_results_count(downloader: CasebookDownloader, court_type, category_code, min_summ):
+    """HTTP-счётчик результатов с учётом общего темпа запросов"""
+    limiter = get_rate_limiter()
+    limiter.acquire()
+    started = time.monotonic()
+    results_count = downloader.http_client.get_results_count(
+        court_type, category_code, downloader.date_from_str, downloader.date_to_str, min_summ
+    )
+    limiter.record_success(time.monotonic() - started)
+    return results_count
+
+
+def _http_failed(downloader: CasebookDownloader, error):
+    """Учесть ошибку HTTP-клиента; при отказе в авторизации клиент отключается до конца сессии.
+
+    Cookies HTTP-клиента взяты из браузера при открытии сессии: истёкшие, они не оживут,
+    и каждый следующий запрос снова упал бы в браузер, снижая общий темп запросов.
+    """
+    get_rate_limiter().record_signal(http_signal(error))
+    if isinstance(error, PermissionError) and downloader.http_client is not None:
+        logger.warning("Cookies HTTP-клиента Casebook недействительны, до конца сессии используется браузер")
+        downloader.http_client.close()
+        downloader.http_client = None
+
+
+def http_signal(error):
+    """Сигнал для ограничителя темпа по ошибке HTTP-клиента"""
+    if isinstance(error, PermissionError):
+        return 'login'
+    response = getattr(error, 'response', None)
+    if response is not None and response.status_code == 429:
+        return 'throttle'
+    return 'error'
+
+
+def failure_signal(downloader):
+    """Сигнал для ограничителя темпа после исключения в сессии: блокировка на странице или ошибка"""
+    if downloader is None or getattr(downloader, 'driver', None) is None:
+        return 'error'
+    return downloader.block_signal() or 'error'
+
+
+def _process_casebook_request_http(downloader: CasebookDownloader, court_type, category_code, min_summ,
+                                   result_cache=None, cache_key=None):
+    """Тот же запрос через HTTP-клиент: счётчик и CSV-экспорт без кликов в браузере"""
+    results_count = _http_results_count(downloader, court_type, category_code, min_summ)
+    logger.info(f"Результаты поиска (HTTP): {num_to_emoji(results_count)} {pluralize_cases(results_count)}")
     if results_count > 0:
-        downloader.download_results()
+        if _skip_unchanged(downloader, result_cache, cache_key, results_count):
+            return False, results_count
+        _fetch_export(downloader, court_type, category_code, min_summ, results_count, http=True)
+        _remember_export(downloader, result_cache, cache_key, results_count)
         return True, results_count
     return False, 0
 
 
 def close_casebook_session(downloader: CasebookDownloader):
     """Закрыть браузер и завершить сессию"""
+    if getattr(downloader, 'waiter', None) is not None:
+        downloader.waiter.log_summary(logger)
+    if getattr(downloader, 'driver', None) is not None:
+        log_browser_metrics(
+            downloader.browser_pid, downloader.page_loads,
+            f"Браузер Casebook (блокировка: {resource_blocking.get_block_profile()})", logger
+        )
+    if getattr(downloader, 'cdp', None) is not None:
+        downloader.cdp.close()
+        downloader.cdp = None
+    if getattr(downloader, 'http_client', None) is not None:
+        downloader.http_client.close()
+        downloader.http_client = None
     if hasattr(downloader, 'driver') and downloader.driver:
         try:
+            # Для браузера хоста quit() завершает только chromedriver, сам браузер остаётся
             downloader.driver.quit()
-            logger.info("Браузер закрыт")
+            logger.info("Отключение от браузера хоста" if downloader.attached else "Браузер закрыт")
         except Exception as quit_error:
             logger.error(f"Ошибка при закрытии браузера: {str(quit_error)}")
 
@@ -0,0 +1,226 @@
+import os
+import logging
+
+logger = logging.getLogger('CasebookForm')
+
+# Заполнение формы расширенного поиска целиком на странице: те же шаги, что и в
+# CasebookDownloader.setup_search_parameters, но без round trip WebDriver на каждый клик.
+# Параметры со значением null не трогаются — так же выполняется и частичное обновление
+# уже заполненной формы. Скрипт ждёт, пока виджеты подтвердят значения, и возвращает {ok, step, error}.
+FORM_FILL_JS = """
+var params = arguments[0];
+var done = arguments[arguments.length - 1];
+var deadline = Date.now() + params.timeout_ms;
+
+function sleep(ms) { return new Promise(function (resolve) { setTimeout(resolve, ms); }); }
+
+async function waitFor(probe, step) {
+    while (true) {
+        var value = probe();
+        if (value) { return value; }
+        if (Date.now() > deadline) { throw {step: step, message: 'таймаут'}; }
+        await sleep(50);
+    }
+}
+
+function visible(el) { return !!(el && (el.offsetWidth || el.offsetHeight || el.getClientRects().length)); }
+
+function setValue(input, value) {
+    var setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+    input.focus();
+    setter.call(input, value);
+    ['input', 'keyup', 'change'].forEach(function (type) {
+        input.dispatchEvent(new Event(type, {bubbles: true}));
+    });
+}
+
+function checkedState(label) {
+    var box = label.querySelector('input') || (label.htmlFor ? document.getElementById(label.htmlFor) : null);
+    return box ? box.checked : null;
+}
+
+function select(label) {
+    label.scrollIntoView({block: 'center'});
+    if (checkedState(label) !== true) { label.click(); }
+}
+
+function networkIdle() {
+    var t = window.__netTracker;
+    return !t || (t.pending === 0 && Date.now() - t.lastChange >= 250);
+}
+
+function escapeRegExp(text) { return text.replace(/[.*+?^${}()|[\\]\\\\]/g, '\\\\$&'); }
+
+function categoryLabel(code, allowFirst) {
+    var labels = Array.from(document.querySelectorAll(
+        'div.b-filter--case_categories li.b-filter-option label'
+    )).filter(visible);
+    var exact = new RegExp('^\\\\s*' + escapeRegExp(code) + '(?!\\\\d)');
+    return labels.find(function (l) { return exact.test(l.textContent); })
+        || labels.find(function (l) { return l.textContent.indexOf(code) !== -1; })
+        || (allowFirst ? labels[0] : null);
+}
+
+function categoryInput() {
+    return Array.from(document.querySelectorAll(
+        "div.b-filter--case_categories input:not([type='checkbox']):not([type='radio'])"
+    )).find(visible);
+}
+
+async function filterCategories(code) {
+    if (!categoryInput()) {
+        var container = await waitFor(function () {
+            return document.querySelector(
+                "div.b-filter-container.js-filter-container[data-title='Укажите категорию спора']"
+            );
+        }, 'список категорий');
+        container.scrollIntoView({block: 'center'});
+        container.click();
+    }
+    var input = await waitFor(categoryInput, 'поле категории');
+    setValue(input, code);
+    await waitFor(networkIdle, 'фильтрация категорий');
+}
+
+function courtLabel(court) {
+    return Array.from(document.querySelectorAll('label')).find(function (l) {
+        return visible(l) && l.textContent.indexOf(court) !== -1;
+    });
+}
+
+async function openCourts(court) {
+    if (courtLabel(court)) { return; }
+    var courtFilter = await waitFor(function () {
+        return document.querySelector("div[data-title='Укажите суд']");
+    }, 'фильтр суда');
+    courtFilter.scrollIntoView({block: 'center'});
+    courtFilter.click();
+}
+
+(async function () {
+    try {
+        if (params.court_remove !== null) {
+            await openCourts(params.court_remove);
+            var oldCourt = await waitFor(function () { return courtLabel(params.court_remove); }, 'прежний суд');
+            if (checkedState(oldCourt) === true) { oldCourt.click(); }
+            await waitFor(function () { return checkedState(oldCourt) !== true; }, 'снятие суда');
+        }
+        if (params.court !== null) {
+            await openCourts(params.court);
+            var newCourt = await waitFor(function () { return courtLabel(params.court); }, 'пункт суда');
+            select(newCourt);
+            await waitFor(function () { return checkedState(newCourt) !== false; }, 'выбор суда');
+        }
+
+        for (var r = 0; r < params.categories_remove.length; r++) {
+            var removeCode = params.categories_remove[r];
+            await filterCategories(removeCode);
+            var removeLabel = await waitFor(function () {
+                return categoryLabel(removeCode, false);
+            }, 'пункт категории ' + removeCode);
+            if (checkedState(removeLabel) === true) { removeLabel.click(); }
+            await waitFor(function () { return checkedState(removeLabel) !== true; }, 'снятие категории ' + removeCode);
+        }
+        for (var i = 0; i < params.categories.length; i++) {
+            var code = params.categories[i];
+            await filterCategories(code);
+            var label = await waitFor(function () {
+                return categoryLabel(code, params.allow_first);
+            }, 'пункт категории ' + code);
+            select(label);
+            await waitFor(function () { return checkedState(label) !== false; }, 'выбор категории ' + code);
+        }
+        if (params.categories.length || params.categories_remove.length) {
+            await waitFor(networkIdle, 'применение категорий');
+            document.body.dispatchEvent(new KeyboardEvent('keydown', {key: 'Escape', keyCode: 27, which: 27, bubbles: true}));
+        }
+
+        var dates = [['from', params.date_from], ['to', params.date_to]];
+        for (var j = 0; j < dates.length; j++) {
+            var name = dates[j][0], value = dates[j][1];
+            if (value === null) { continue; }
+            var field = await waitFor(function () {
+                return document.querySelector("input[data-name='" + name + "']");
+            }, 'поле даты ' + name);
+            setValue(field, value);
+            field.dispatchEvent(new Event('blur'));
+            await waitFor(function () { return field.value.trim() === value; }, 'дата ' + name);
+        }
+
+        if (params.min_sum !== null) {
+            if (!document.querySelector("div[data-id='param-sum']")) {
+                document.querySelector("div.b-operator-button").click();
+                var sumParam = await waitFor(function () {
+                    return document.querySelector("div[data-id='param-sum']");
+                }, 'параметр суммы');
+                sumParam.click();
+            }
+            var sumField = await waitFor(function () {
+                return document.querySelector("input[name='minSum']");
+            }, 'поле суммы');
+            setValue(sumField, params.min_sum);
+            var digits = params.min_sum.replace(/\\D/g, '');
+            await waitFor(function () { return sumField.value.replace(/\\D/g, '') === digits; }, 'сумма');
+        }
+        await waitFor(networkIdle, 'применение формы');
+        done({ok: true});
+    } catch (e) {
+        done({ok: false, step: e.step || 'скрипт', error: String(e.message || e)});
+    }
+})();
+"""
+
+
+def batch_form_enabled():
+    """Заполнять ли форму поиска одним скриптом (CASEBOOK_BATCH_FORM, по умолчанию включено)"""
+    return (os.getenv('CASEBOOK_BATCH_FORM') or 'true').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def form_delta_enabled():
+    """Менять между запросами только отличающиеся фильтры без перезагрузки (CASEBOOK_FORM_DELTA)"""
+    return (os.getenv('CASEBOOK_FORM_DELTA') or 'true').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def form_changes(state, target):
+    """Разница между заполненной формой state и нужной target для частичного обновления.
+
+    None — состояние формы неизвестно, нужна чистая страница. Иначе словарь аргументов
+    fill_search_form, где неизменённые поля равны None; при смене суда прежний снимается.
+    """
+    if not state:
+        return None
+    court_changed = state['court'] != target['court']
+    return {
+        'court': target['court'] if court_changed else None,
+        'court_remove': state['court'] if court_changed else None,
+        'categories': [code for code in target['categories'] if code not in state['categories']],
+        'categories_remove': [code for code in state['categories'] if code not in target['categories']],
+        'date_from': target['date_from'] if target['date_from'] != state['date_from'] else None,
+        'date_to': target['date_to'] if target['date_to'] != state['date_to'] else None,
+        'min_sum': target['min_sum'] if target['min_sum'] != state['min_sum'] else None,
+        'allow_first': False,
+    }
+
+
+def fill_search_form(driver, court, categories, date_from, date_to, min_sum,
+                     categories_remove=(), court_remove=None, allow_first=None, timeout=30):
+    """Заполнить форму поиска одним execute_async_script; возвращает словарь {ok, step, error}.
+
+    Аргументы со значением None пропускаются. allow_first разрешает взять первый пункт
+    списка, если код категории не найден (по умолчанию — только для одной категории).
+    """
+    categories = [str(code) for code in categories]
+    params = {
+        'court': court,
+        'court_remove': court_remove,
+        'categories': categories,
+        'categories_remove': [str(code) for code in categories_remove],
+        'allow_first': len(categories) == 1 if allow_first is None else allow_first,
+        'date_from': date_from,
+        'date_to': date_to,
+        'min_sum': str(min_sum) if min_sum is not None else None,
+        'timeout_ms': int(timeout * 1000),
+    }
+    driver.set_script_timeout(timeout + 5)
+    result = driver.execute_async_script(FORM_FILL_JS, params)
+    return result or {'ok': False, 'step': 'скрипт', 'error': 'пустой ответ'}
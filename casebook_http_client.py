@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from datetime import datetime
+from urllib.parse import urlparse, urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from case_watermark import highest_case
+
+logger = logging.getLogger('CasebookHttpClient')
+
+# Плейсхолдеры шаблона CASEBOOK_HTTP_PAYLOAD; значение-строка целиком из плейсхолдера
+# заменяется типизированным значением (число для суммы, список для категорий)
+PAYLOAD_PLACEHOLDERS = (
+    '{court}', '{court_id}', '{category}', '{categories}',
+    '{date_from}', '{date_to}', '{date_from_iso}', '{date_to_iso}', '{min_sum}',
+    '{after_case}', '{after_seq}'
+)
+
+
+def http_mode_enabled():
+    """Режим прямых HTTP-запросов включён (CASEBOOK_HTTP_MODE) и эндпоинты заданы"""
+    enabled = (os.getenv('CASEBOOK_HTTP_MODE') or 'false').strip().lower() in ('1', 'true', 'yes', 'y')
+    if not enabled:
+        return False
+    required = ('CASEBOOK_HTTP_SEARCH_URL', 'CASEBOOK_HTTP_EXPORT_URL', 'CASEBOOK_HTTP_PAYLOAD')
+    missing = [name for name in required if not (os.getenv(name) or '').strip()]
+    if missing:
+        logger.warning(f"CASEBOOK_HTTP_MODE включён, но не заданы {', '.join(missing)} — используется браузер")
+        return False
+    return True
+
+
+def _to_iso(date_str):
+    try:
+        return datetime.strptime(date_str, '%d.%m.%Y').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return date_str
+
+
+class CasebookHttpClient:
+    """Поиск и экспорт Casebook прямыми HTTP-запросами с cookies залогиненного браузера"""
+
+    def __init__(self, origin, cookies, user_agent=None):
+        self.origin = origin
+        self.search_url = urljoin(origin, (os.getenv('CASEBOOK_HTTP_SEARCH_URL') or '').strip())
+        export_url = (os.getenv('CASEBOOK_HTTP_EXPORT_URL') or '').strip()
+        self.export_url = urljoin(origin, export_url) if export_url else None
+        self.payload_template = json.loads(os.getenv('CASEBOOK_HTTP_PAYLOAD') or '{}')
+        self.count_field = (os.getenv('CASEBOOK_HTTP_COUNT_FIELD') or 'total').strip()
+        try:
+            self.court_ids = json.loads(os.getenv('CASEBOOK_HTTP_COURT_IDS') or '{}')
+        except ValueError:
+            logger.warning("Некорректный JSON в CASEBOOK_HTTP_COURT_IDS, карта судов не используется")
+            self.court_ids = {}
+        self.timeout = float((os.getenv('CASEBOOK_HTTP_TIMEOUT') or '30').strip() or 30)
+
+        # Пул соединений с повтором на временных ошибках шлюза
+        self.session = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json, text/plain, */*',
+            'Origin': origin,
+            'Referer': origin + '/app/request/new/cases',
+        })
+        if user_agent:
+            self.session.headers['User-Agent'] = user_agent
+        self.set_cookies(cookies)
+
+    @classmethod
+    def from_driver(cls, driver):
+        """Создать клиент из открытой сессии Selenium (после login())"""
+        parsed = urlparse(driver.current_url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        try:
+            user_agent = driver.execute_script("return navigator.userAgent;")
+        except Exception:
+            user_agent = None
+        return cls(origin, driver.get_cookies(), user_agent)
+
+    def set_cookies(self, cookies):
+        """Перенести cookies браузера (формат driver.get_cookies()) в HTTP-сессию"""
+        self.session.cookies.clear()
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie['name'], cookie['value'],
+                domain=cookie.get('domain'), path=cookie.get('path', '/')
+            )
+
+    def build_payload(self, court, categories, date_from, date_to, min_sum, watermark=None):
+        """Подставить параметры запроса в шаблон CASEBOOK_HTTP_PAYLOAD.
+
+        {after_case}/{after_seq} — старший номер дела водяного знака инкрементального режима
+        ('' и 0 без него): шаблон экспорта может запросить только дела после него.
+        """
+        if isinstance(categories, (list, tuple)):
+            categories = [str(c) for c in categories]
+        else:
+            categories = [str(categories)]
+        try:
+            min_sum_value = int(str(min_sum).replace(' ', ''))
+        except ValueError:
+            min_sum_value = min_sum
+        values = {
+            '{court}': court,
+            '{court_id}': self.court_ids.get(court, court),
+            '{category}': categories[0],
+            '{categories}': categories,
+            '{date_from}': date_from,
+            '{date_to}': date_to,
+            '{date_from_iso}': _to_iso(date_from),
+            '{date_to_iso}': _to_iso(date_to),
+            '{min_sum}': min_sum_value,
+        }
+        values['{after_case}'], values['{after_seq}'] = highest_case(watermark)
+
+        def substitute(node):
+            if isinstance(node, dict):
+                return {key: substitute(value) for key, value in node.items()}
+            if isinstance(node, list):
+                return [substitute(value) for value in node]
+            if isinstance(node, str):
+                if node in values:
+                    return values[node]
+                for placeholder in PAYLOAD_PLACEHOLDERS:
+                    if placeholder in node:
+                        node = node.replace(placeholder, str(values[placeholder]))
+                return node
+            return node
+
+        return substitute(self.payload_template)
+
+    def _post(self, url, payload, **kwargs):
+        response = self.session.post(url, json=payload, timeout=self.timeout, allow_redirects=False, **kwargs)
+        # Редирект или 401/403 означают, что cookies браузера больше не действуют
+        if response.status_code in (301, 302, 303, 401, 403):
+            raise PermissionError(f"Casebook отклонил HTTP-запрос ({response.status_code}): требуется авторизация")
+        response.raise_for_status()
+        return response
+
+    def _extract_count(self, data):
+        node = data
+        for part in self.count_field.split('.'):
+            if isinstance(node, dict) and part in node:
+                node = node[part]
+            else:
+                raise ValueError(f"В ответе поиска нет поля {self.count_field!r}")
+        if isinstance(node, str):
+            node = re.sub(r"\s+", "", node)
+        return int(node)
+
+    def get_results_count(self, court, categories, date_from, date_to, min_sum):
+        """Число найденных дел по параметрам запроса"""
+        payload = self.build_payload(court, categories, date_from, date_to, min_sum)
+        response = self._post(self.search_url, payload)
+        return self._extract_count(response.json())
+
+    def download_export(self, court, categories, date_from, date_to, min_sum, target_path, watermark=None):
+        """Скачать CSV-экспорт по параметрам запроса в target_path; возвращает SHA-256 файла,
+        посчитанный по ходу загрузки"""
+        if not self.export_url:
+            raise RuntimeError("CASEBOOK_HTTP_EXPORT_URL не задан")
+        payload = self.build_payload(court, categories, date_from, date_to, min_sum, watermark)
+        response = self._post(self.export_url, payload, stream=True)
+        tmp_path = target_path + '.part'
+        digest = hashlib.sha256()
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if chunk:
+                    f.write(chunk)
+                    digest.update(chunk)
+        os.replace(tmp_path, target_path)
+        return digest.hexdigest()
+
+    def close(self):
+        self.session.close()
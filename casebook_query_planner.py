@@ -0,0 +1,137 @@
+import os
+import logging
+from datetime import datetime
+
+logger = logging.getLogger('CasebookQueryPlanner')
+
+
+def coalesce_categories_enabled():
+    """Объединять ли категории одного суда в один поиск (CASEBOOK_COALESCE_CATEGORIES)"""
+    return (os.getenv('CASEBOOK_COALESCE_CATEGORIES') or 'true').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def collapse_min_sum_enabled():
+    """Сводить варианты порога суммы одной категории в один поиск (CASEBOOK_COLLAPSE_MIN_SUM)"""
+    return (os.getenv('CASEBOOK_COLLAPSE_MIN_SUM') or 'true').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def min_sum_value(min_sum):
+    """Числовое значение порога суммы для сравнения (строки вида '500 000' допустимы)"""
+    try:
+        return float(str(min_sum).replace(' ', ''))
+    except ValueError:
+        return float('inf')
+
+
+def get_max_categories_per_search():
+    """Ограничение числа категорий в одном поиске (0 — без ограничения)"""
+    raw = (os.getenv('CASEBOOK_MAX_CATEGORIES_PER_SEARCH') or '0').strip()
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return 0
+
+
+def parse_bundle(bundle):
+    """Разобрать элемент REQUESTS_BUNDLED в словарь; None — если формат некорректен"""
+    try:
+        date_from = bundle[3] if len(bundle) > 3 else None
+        return {
+            'court': bundle[0],
+            'category': str(bundle[1]),
+            'min_sum': bundle[2],
+            'date_from': str(date_from).strip() if date_from and str(date_from).strip() else None
+        }
+    except Exception:
+        return None
+
+
+def plan_queries(requests_bundled, coalesce=None, collapse_min_sum=None):
+    """Сгруппировать запросы в поиски Casebook.
+
+    Варианты одной категории суда, отличающиеся только min_summ, ищутся один раз
+    по наименьшему порогу — порог каждого запроса затем применяется локально
+    (см. prepare_data_for_export.count_rows_by_bundle). Запросы с одинаковыми
+    судом, порогом поиска и датой объединяются в один поиск с несколькими
+    категориями (фильтр категорий — мультиселект). Поиски упорядочены для частичного
+    обновления формы (см. order_for_form_reuse), категории внутри поиска — в порядке
+    первого появления в списке. Каждый поиск — словарь
+    с ключами court, categories, min_sum, date_from и bundles (список пар
+    (индекс запроса, разобранный запрос) с исходными порогами).
+    """
+    if coalesce is None:
+        coalesce = coalesce_categories_enabled()
+    if collapse_min_sum is None:
+        collapse_min_sum = collapse_min_sum_enabled()
+    max_categories = get_max_categories_per_search()
+
+    parsed_bundles = []
+    for req_idx, bundle in enumerate(requests_bundled):
+        parsed = parse_bundle(bundle)
+        if parsed is None:
+            print(f"Некорректный формат REQUESTS_BUNDLED в элементе {bundle}, пропуск")
+            continue
+        parsed_bundles.append((req_idx, parsed))
+
+    # Наименьший порог для каждой категории суда на дату
+    search_min_sums = {}
+    if collapse_min_sum:
+        for _, parsed in parsed_bundles:
+            category_key = (parsed['court'], parsed['category'], parsed['date_from'])
+            current = search_min_sums.get(category_key)
+            if current is None or min_sum_value(parsed['min_sum']) < min_sum_value(current):
+                search_min_sums[category_key] = parsed['min_sum']
+
+    queries = []
+    open_queries = {}
+    for req_idx, parsed in parsed_bundles:
+        search_min_sum = search_min_sums.get(
+            (parsed['court'], parsed['category'], parsed['date_from']), parsed['min_sum']
+        )
+        key = (parsed['court'], str(search_min_sum), parsed['date_from'], None if coalesce else parsed['category'])
+        query = open_queries.get(key)
+        if query is not None and max_categories and parsed['category'] not in query['categories'] \
+                and len(query['categories']) >= max_categories:
+            query = None
+        if query is None:
+            query = {
+                'court': parsed['court'],
+                'categories': [],
+                'min_sum': search_min_sum,
+                'date_from': parsed['date_from'],
+                'bundles': []
+            }
+            queries.append(query)
+            open_queries[key] = query
+
+        if parsed['category'] not in query['categories']:
+            query['categories'].append(parsed['category'])
+        query['bundles'].append((req_idx, parsed))
+
+    if len(queries) < len(parsed_bundles):
+        logger.info(f"План поисков: {len(requests_bundled)} запросов → {len(queries)} поисков Casebook")
+    return order_for_form_reuse(queries)
+
+
+def date_sort_key(date_from):
+    """Ключ сортировки даты ДД.ММ.ГГГГ: поиски без даты — первыми, нераспознанные — в конце по строке"""
+    if not date_from:
+        return 0, datetime.min, ''
+    try:
+        return 1, datetime.strptime(date_from, '%d.%m.%Y'), ''
+    except ValueError:
+        return 2, datetime.min, date_from
+
+
+def order_for_form_reuse(queries):
+    """Упорядочить поиски так, чтобы соседние отличались как можно меньшим числом фильтров.
+
+    Поиски одного суда идут подряд (суды — в порядке первого появления), внутри суда —
+    по дате и порогу суммы: между ними форма обновляется частично, без перезагрузки страницы.
+    """
+    court_order = {}
+    for query in queries:
+        court_order.setdefault(query['court'], len(court_order))
+    return sorted(queries, key=lambda q: (
+        court_order[q['court']], date_sort_key(q['date_from']), min_sum_value(q['min_sum'])
+    ))
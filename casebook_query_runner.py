@@ -0,0 +1,243 @@
+import os
+import time
+import logging
+from datetime import datetime
+import casebook_download_data as get_data
+import prepare_data_for_export as set_data
+from rate_limiter import get_rate_limiter
+
+# Обработка одного поиска Casebook для main_scrape.py и backfill.py: модуль не настраивает
+# логирование и не регистрирует задач расписания при импорте
+logger = logging.getLogger('CasebookQueryRunner')
+
+# Счётчики из prepare_data.last_stats, которые суммируются в сводку прогона
+PREPARE_STATS_KEYS = {
+    'csv_rows_total': 'rows_in_file',
+    'passed_filters': 'passed_filters',
+    'prepared_rows': 'prepared_count',
+    'skipped_seen': 'skipped_seen_before',
+    'skipped_defendant': 'skipped_defendant_block',
+    'skipped_empty_defendant': 'skipped_empty_defendant',
+    'skipped_invalid_inn': 'skipped_invalid_inn_range',
+    'skipped_watermark': 'skipped_below_watermark',
+    'skipped_duplicate': 'skipped_duplicate_in_run',
+}
+
+
+def resolve_bundle_dates(date_from_opt):
+    """Эффективный диапазон дат запроса: дата из bundle, затем ENV, затем «сегодня»"""
+    env_date_val = (os.getenv('CASEBOOK_DATE') or '').strip()
+    env_date_from_val = (os.getenv('CASEBOOK_DATE_FROM') or '').strip()
+    env_date_to_val = (os.getenv('CASEBOOK_DATE_TO') or '').strip()
+
+    if date_from_opt and str(date_from_opt).strip():
+        eff_from = eff_to = str(date_from_opt).strip()
+    elif env_date_val:
+        eff_from = eff_to = env_date_val
+    elif env_date_from_val or env_date_to_val:
+        eff_from = env_date_from_val or env_date_to_val
+        eff_to = env_date_to_val or env_date_from_val
+    else:
+        eff_from = eff_to = datetime.now().strftime('%d.%m.%Y')
+    return eff_from, eff_to
+
+
+def query_category_param(query):
+    """Категории поиска для process_casebook_request: одиночная категория передаётся строкой, как и раньше"""
+    return query['categories'] if len(query['categories']) > 1 else query['categories'][0]
+
+
+def probe_query(worker, query_idx, query, total_queries):
+    """Фаза проб: только число результатов поиска; None — проба не удалась"""
+    progress = f"Проба {query_idx + 1}/{total_queries}"
+    for attempt_num in range(2):
+        try:
+            downloader = worker.ensure_session()
+            results_count = get_data.probe_casebook_request(
+                downloader, query['court'], query_category_param(query), query['min_sum'], query['date_from']
+            )
+            logger.info(f"{progress}: {query['court']} / {', '.join(query['categories'])} — {results_count}")
+            return results_count
+        except Exception as e:
+            logger.warning(f'{progress}: ошибка пробы {query["court"]}: {str(e)}')
+            rate_limiter = get_rate_limiter()
+            rate_limiter.record_signal(get_data.failure_signal(worker.downloader))
+            worker.close(recycle=True)
+            time.sleep(rate_limiter.backoff(attempt_num + 1))
+    return None
+
+
+def query_cache_key(query, result_cache):
+    """Ключ кэша результатов для поиска — тот же, что строит process_casebook_request"""
+    eff_from, eff_to = resolve_bundle_dates(query['date_from'])
+    return result_cache.key(query['court'], query_category_param(query), query['min_sum'], eff_from, eff_to)
+
+
+def order_by_yield(queries, counts):
+    """Поиски с результатами по убыванию числа дел; не прошедшие пробу — в конце, в исходном порядке"""
+    with_results = [(query, count) for query, count in zip(queries, counts) if count != 0]
+    with_results.sort(key=lambda item: (item[1] is None, -(item[1] or 0)))
+    return [query for query, _ in with_results]
+
+
+def merge_query_stats(summary_data, query_stats):
+    """Прибавить счётчики одного поиска к сводке прогона (словари счётчиков — по ключам)"""
+    for key, value in query_stats.items():
+        if key not in summary_data:
+            continue
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                summary_data[key][sub_key] = summary_data[key].get(sub_key, 0) + sub_value
+        elif isinstance(value, int) and not isinstance(value, bool):
+            summary_data[key] += value
+
+
+def process_query(worker, query_idx, query, total_queries, prepare_state, result_cache=None):
+    """Обработать один поиск Casebook (один или несколько запросов REQUESTS_BUNDLED).
+
+    Возвращает счётчики поиска для сводки (completed — поиск доведён до конца:
+    выгрузка подготовлена или результатов нет); запись в CleanedArbitrage.csv
+    сериализуется через prepare_state['lock'].
+    """
+    query_stats = {
+        'requests_attempted': 0,
+        'searches_performed': 0,
+        'casebook_found': 0,
+        'casebook_downloaded': 0,
+        'failed_download_results': 0,
+        'cache_hits': 0,
+        'cache_misses': 0,
+        'bundle_rows': {},
+        'got_new_leads': False,
+        'completed': False
+    }
+    for summary_key in PREPARE_STATS_KEYS:
+        query_stats[summary_key] = 0
+
+    court = query['court']
+    category_codes = query['categories']
+    min_sum = query['min_sum']
+    date_from_opt = query['date_from']
+    category_param = query_category_param(query)
+
+    court_type = f"\n\tСуд в деле: {court}"
+    category = f"\n\tКатегория спора: {', '.join(category_codes)}"
+    # Если в bundle передана дата, используем её для обеих границ
+    eff_from, eff_to = resolve_bundle_dates(date_from_opt)
+
+    from_date = f"\n\tДата регистрации дела с: {eff_from}"
+    to_date = f"\n\tДата регистрации дела по: {eff_to}"
+    min_summ = f"\n\tИсковые требования в деле от: {min_sum}"
+
+    last_params = f'{from_date}{to_date}{min_summ}\n'
+    params = f'\n{court_type}{category}{last_params}'
+    progress = f"Проход {query_idx + 1}/{total_queries}"
+    if worker.download_dir:
+        progress = f"{progress} [рабочий {worker.worker_id}]"
+    logger.info(progress)
+    logger.info(f'Выгрузка дел со следующими параметрами: {params}')
+
+    query_stats['requests_attempted'] += len(query['bundles'])
+    last_results_count = 0
+    download_success = False
+    attempt_num = 0
+    while attempt_num < 3:
+        try:
+            downloader = worker.ensure_session()
+            query_stats['searches_performed'] += 1
+            downloaded, results_count = get_data.process_casebook_request(
+                downloader, court, category_param, min_sum, date_from_opt, result_cache=result_cache
+            )
+            last_results_count = results_count or 0
+            if downloader.last_request_cached:
+                # Результаты не изменились с прошлого прохода: дела уже подготовлены и отправлены
+                get_data.record_cache_entry(downloader, result_cache)
+                download_success = True
+                query_stats['cache_hits'] += 1
+                query_stats['casebook_found'] += last_results_count
+                logger.info(f'✅ {progress}: без изменений с прошлого прохода, выгрузка и подготовка пропущены')
+                break
+            if downloaded:
+                if result_cache is not None and result_cache.enabled:
+                    query_stats['cache_misses'] += 1
+                logger.info(f'{progress}: Подготовка лидов...')
+                with prepare_state['lock']:
+                    headers = prepare_state['first_write']
+                    mode = 'w' if prepare_state['first_write'] else 'a'
+                    got_new_leads = set_data.prepare_data(
+                        headers=headers, mode=mode, raw_csv_path=downloader.export_source(),
+                        watermark=downloader.request_watermark, dedup_index=prepare_state.get('dedup_index'),
+                        source=f"{court} | {','.join(category_codes)} | {min_sum}", bundles=query['bundles']
+                    )
+                    prepare_stats = getattr(set_data.prepare_data, 'last_stats', {}) or {}
+                    if got_new_leads:
+                        prepare_state['first_write'] = False
+                # Выгрузка учитывается в кэше только подготовленной: при ошибке повтор выгрузит её заново
+                get_data.record_cache_entry(downloader, result_cache, prepare_stats)
+                query_stats['bundle_rows'] = bundle_split(progress, prepare_stats.get('bundle_counts') or {}, query)
+                download_success = True
+                query_stats['casebook_found'] += last_results_count
+                query_stats['casebook_downloaded'] += last_results_count
+                for summary_key, stats_key in PREPARE_STATS_KEYS.items():
+                    query_stats[summary_key] += prepare_stats.get(stats_key, 0) or 0
+                if got_new_leads:
+                    query_stats['got_new_leads'] = True
+                else:
+                    logger.info(f'✅ {progress}: Новых лидов нет')
+                logger.info(f'✅ {progress}: завершён успешно')
+                break
+            else:
+                attempt_num += 1
+                if results_count == 0:
+                    query_stats['casebook_found'] += last_results_count
+                    query_stats['completed'] = True
+                    logger.info(f'✅ {progress}: Найдено 0️⃣ арбитражных дел')
+                    break
+                else:
+                    logger.warning(f"{progress}: Не удалось скачать по параметрам: {params}")
+        except Exception as e:
+            attempt_num += 1
+            logger.error(f'{progress}: Ошибка при обработке запроса {court} / {category_codes}: {str(e)}')
+            # Ошибка (капча, выход из сессии) снижает общий темп запросов; пауза растёт с попытками
+            rate_limiter = get_rate_limiter()
+            rate_limiter.record_signal(get_data.failure_signal(worker.downloader))
+            # Перезапускаем сессию браузера (браузер хоста — через запрос на замену) и продолжаем с того же поиска
+            worker.close(recycle=True)
+            time.sleep(rate_limiter.backoff(attempt_num))
+            try:
+                worker.ensure_session()
+            except Exception as se:
+                logger.error(f'{progress}: Ошибка при создании новой сессии: {str(se)}')
+                time.sleep(rate_limiter.backoff(attempt_num + 1))
+            # Продолжаем цикл; накопленные файлы не трогаем
+    if download_success:
+        query_stats['completed'] = True
+    if not download_success and last_results_count:
+        query_stats['casebook_found'] += last_results_count
+        query_stats['failed_download_results'] += last_results_count
+    return query_stats
+
+
+def bundle_key(bundle):
+    """Ключ запроса REQUESTS_BUNDLED в сводке: суд, категория и порог суммы"""
+    return f"{bundle['court']} | {bundle['category']} | {bundle['min_sum']}"
+
+
+def bundle_split(progress, counts, query):
+    """Разложить выгрузку по исходным запросам (категория и порог суммы).
+
+    counts — разбивка строк из прохода prepare_data (bundle_counts). Возвращает
+    {ключ запроса: число дел} для сводки; разбивка объединённого поиска
+    дополнительно логируется.
+    """
+    bundle_rows = {bundle_key(bundle): counts.get(req_idx, 0) for req_idx, bundle in query['bundles']}
+    if len(query['bundles']) == 1:
+        return bundle_rows
+    parts = [
+        f"#{req_idx + 1} ({bundle['category']}, от {bundle['min_sum']}): {counts.get(req_idx, 0)}"
+        for req_idx, bundle in query['bundles']
+    ]
+    if counts.get(None):
+        parts.append(f'без категории: {counts[None]}')
+    logger.info(f"{progress}: Дела по запросам — {', '.join(parts)}")
+    return bundle_rows
@@ -0,0 +1,179 @@
+import os
+import queue
+import logging
+import threading
+import casebook_download_data as get_data
+import browser_daemon_client
+from browser_metrics import process_tree_rss, format_rss
+
+logger = logging.getLogger('CasebookWorkerPool')
+
+# uc.Chrome патчит общий бинарник chromedriver при старте — браузеры запускаем по одному
+_session_start_lock = threading.Lock()
+
+
+def get_workers_count():
+    """Число параллельных сессий Casebook из CASEBOOK_WORKERS (по умолчанию 1)"""
+    raw = (os.getenv('CASEBOOK_WORKERS') or '1').strip()
+    try:
+        return max(1, int(raw))
+    except ValueError:
+        logger.warning(f"Некорректное значение CASEBOOK_WORKERS={raw!r}, используется 1")
+        return 1
+
+
+def get_recycle_policy():
+    """Порог плановой пересборки сессии: (число запросов, RSS Chrome в байтах); 0 — без ограничения.
+
+    CASEBOOK_RECYCLE_REQUESTS (по умолчанию 200) и CASEBOOK_RECYCLE_RSS_MB (по умолчанию 1500).
+    """
+    limits = []
+    for name, default in (('CASEBOOK_RECYCLE_REQUESTS', 200), ('CASEBOOK_RECYCLE_RSS_MB', 1500)):
+        raw = (os.getenv(name) or str(default)).strip()
+        try:
+            limits.append(max(0, int(raw)))
+        except ValueError:
+            logger.warning(f"Некорректное значение {name}={raw!r}, используется {default}")
+            limits.append(default)
+    return limits[0], limits[1] * 1024 * 1024
+
+
+class CasebookWorker:
+    """Рабочий пула: своя сессия браузера, свой профиль Chrome и свой каталог загрузки"""
+
+    def __init__(self, worker_id, download_dir=None, profile_dir=None, use_daemon=None):
+        self.worker_id = worker_id
+        self.download_dir = download_dir
+        self.profile_dir = profile_dir
+        self.downloader = None
+        self.requests_in_session = 0
+        self.max_requests, self.max_rss = get_recycle_policy()
+        # Рабочий с номером N подключается к слоту N хоста browser_daemon.py, если он запущен
+        self.use_daemon = browser_daemon_client.daemon_mode_enabled() if use_daemon is None else use_daemon
+
+    def ensure_session(self):
+        """Вернуть открытую сессию, при необходимости создав и залогинив новую"""
+        if self.downloader is None:
+            self.requests_in_session = 0
+        if self.downloader is None and self.use_daemon:
+            slot_entry = browser_daemon_client.find_slot(self.worker_id)
+            if slot_entry:
+                browser_daemon_client.acquire_lease(self.worker_id)
+                try:
+                    self.downloader = get_data.attach_casebook_session(slot_entry, self.download_dir)
+                except Exception as e:
+                    browser_daemon_client.release_lease(self.worker_id)
+                    logger.warning(f"Рабочий {self.worker_id}: не удалось подключиться к браузеру хоста: {e}")
+            else:
+                logger.warning(f"Рабочий {self.worker_id}: браузер хоста недоступен, запуск локального браузера")
+        if self.downloader is None:
+            with _session_start_lock:
+                self.downloader = get_data.create_casebook_session(self.download_dir, self.profile_dir)
+        return self.downloader
+
+    def maybe_recycle(self):
+        """Закрыть сессию после запроса, если она отработала N запросов или Chrome разросся по памяти.
+
+        Новая сессия откроется на следующем запросе и восстановится из сохранённых cookies.
+        """
+        if self.downloader is None:
+            return
+        self.requests_in_session += 1
+        rss = process_tree_rss(self.downloader.browser_pid)
+        logger.info(
+            f"Рабочий {self.worker_id}: запросов в сессии {self.requests_in_session}, RSS Chrome {format_rss(rss)}"
+        )
+        reason = None
+        if self.max_requests and self.requests_in_session >= self.max_requests:
+            reason = f"{self.requests_in_session} запросов"
+        elif self.max_rss and rss and rss >= self.max_rss:
+            reason = f"RSS {format_rss(rss)}"
+        if reason:
+            logger.info(f"Рабочий {self.worker_id}: плановая пересборка сессии ({reason})")
+            # Свежие cookies — чтобы следующая сессия обошлась без входа
+            self.downloader.save_session()
+            self.close(recycle=self.downloader.attached)
+
+    def close(self, recycle=False):
+        """Закрыть браузер рабочего; recycle=True — браузер хоста завис и его нужно заменить"""
+        if self.downloader is not None:
+            if recycle and self.downloader.attached:
+                browser_daemon_client.request_recycle(self.worker_id)
+            try:
+                get_data.close_casebook_session(self.downloader)
+            except Exception:
+                pass
+            if self.downloader.attached:
+                browser_daemon_client.release_lease(self.worker_id)
+        self.downloader = None
+
+
+class CasebookWorkerPool:
+    """Пул из N независимых сессий Casebook, разбирающих общую очередь запросов"""
+
+    def __init__(self, workers=None):
+        self.workers_count = workers or get_workers_count()
+        env_download_dir = (os.getenv('DOWNLOAD_DIR') or '').strip()
+        base_dir = os.path.abspath(env_download_dir) if env_download_dir else os.getcwd()
+        env_profiles_dir = (os.getenv('CASEBOOK_PROFILES_DIR') or '').strip()
+        profiles_dir = os.path.abspath(env_profiles_dir) if env_profiles_dir else os.path.join(base_dir, 'chrome_profiles')
+
+        if self.workers_count == 1:
+            # Один рабочий работает как раньше: общий каталог загрузки и временный профиль
+            self.workers = [CasebookWorker(1)]
+        else:
+            self.workers = [
+                CasebookWorker(
+                    worker_id,
+                    download_dir=os.path.join(base_dir, f'worker_{worker_id}'),
+                    profile_dir=os.path.join(profiles_dir, f'worker_{worker_id}')
+                )
+                for worker_id in range(1, self.workers_count + 1)
+            ]
+
+    def run(self, items, handler, keep_open=False):
+        """Обработать элементы всеми рабочими; handler(worker, index, item) -> результат.
+
+        Результаты возвращаются в порядке исходных элементов; None — если handler упал.
+        keep_open=True оставляет сессии открытыми для следующего run (закрытие — close()).
+        """
+        tasks = queue.Queue()
+        for index, item in enumerate(items):
+            tasks.put((index, item))
+        results = [None] * len(items)
+
+        def worker_loop(worker):
+            try:
+                while True:
+                    try:
+                        index, item = tasks.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        results[index] = handler(worker, index, item)
+                    except Exception as e:
+                        logger.error(f"Рабочий {worker.worker_id}: необработанная ошибка на элементе {item}: {e}")
+                    worker.maybe_recycle()
+            finally:
+                if not keep_open:
+                    worker.close()
+
+        if len(self.workers) == 1:
+            worker_loop(self.workers[0])
+            return results
+
+        logger.info(f"Запуск пула Casebook: {len(self.workers)} рабочих, {len(items)} запросов")
+        threads = [
+            threading.Thread(target=worker_loop, args=(worker,), name=f'casebook-worker-{worker.worker_id}', daemon=True)
+            for worker in self.workers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def close(self):
+        """Закрыть сессии всех рабочих"""
+        for worker in self.workers:
+            worker.close()
@@ -0,0 +1,99 @@
+import json
+import time
+import logging
+import itertools
+from collections import deque
+from urllib.request import urlopen
+import websocket
+
+logger = logging.getLogger('CdpClient')
+
+
+def get_debugger_address(driver):
+    """Адрес remote debugging запущенного Chrome (host:port) из capabilities драйвера"""
+    address = (driver.capabilities.get('goog:chromeOptions') or {}).get('debuggerAddress')
+    if not address:
+        raise RuntimeError("Драйвер не сообщил debuggerAddress — прямое подключение к CDP недоступно")
+    return address
+
+
+class CdpConnection:
+    """Минимальный клиент Chrome DevTools Protocol поверх websocket, параллельный chromedriver.
+
+    Нужен там, где chromedriver не отдаёт события CDP (загрузки, перехват ответов):
+    команды выполняются синхронно, события копятся в очереди до явного чтения.
+    """
+
+    def __init__(self, ws_url, timeout=10):
+        self.ws_url = ws_url
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self.events = deque()
+        # Без заголовка Origin: Chrome 111+ иначе требует --remote-allow-origins
+        self.ws = websocket.create_connection(ws_url, timeout=timeout, suppress_origin=True)
+
+    @classmethod
+    def browser_for_driver(cls, driver, timeout=10):
+        """Подключиться к browser-таргету Chrome, которым управляет driver"""
+        address = get_debugger_address(driver)
+        with urlopen(f"http://{address}/json/version", timeout=timeout) as response:
+            info = json.loads(response.read().decode('utf-8'))
+        return cls(info['webSocketDebuggerUrl'], timeout=timeout)
+
+    def _read_message(self, timeout):
+        self.ws.settimeout(max(timeout, 0.01))
+        try:
+            raw = self.ws.recv()
+        except websocket.WebSocketTimeoutException:
+            return None
+        return json.loads(raw) if raw else None
+
+    def send(self, method, params=None, session_id=None, timeout=None):
+        """Выполнить команду CDP и вернуть result; события, пришедшие до ответа, сохраняются"""
+        message_id = next(self._ids)
+        message = {'id': message_id, 'method': method, 'params': params or {}}
+        if session_id:
+            message['sessionId'] = session_id
+        self.ws.send(json.dumps(message))
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"CDP не ответил на {method}")
+            reply = self._read_message(remaining)
+            if reply is None:
+                continue
+            if reply.get('id') == message_id:
+                if 'error' in reply:
+                    raise RuntimeError(f"CDP {method}: {reply['error'].get('message')}")
+                return reply.get('result', {})
+            if 'method' in reply:
+                self.events.append(reply)
+
+    def wait_for_event(self, predicate, timeout):
+        """Вернуть первое событие, удовлетворяющее predicate, или None по таймауту"""
+        deadline = time.monotonic() + timeout
+        while True:
+            while self.events:
+                event = self.events.popleft()
+                if predicate(event):
+                    return event
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = self._read_message(remaining)
+            if message is not None and 'method' in message:
+                self.events.append(message)
+
+    def drain_events(self):
+        """Отбросить накопленные и уже пришедшие события"""
+        self.events.clear()
+        while self._read_message(0.01) is not None:
+            pass
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
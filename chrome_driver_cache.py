@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import shutil
+import logging
+import threading
+import subprocess
+import undetected_chromedriver as uc
+from file_utils import write_json_atomic
+
+logger = logging.getLogger('ChromeDriverCache')
+
+# Подготовка драйвера и запись кэша — по одному потоку за раз
+_cache_lock = threading.Lock()
+
+
+def get_cache_dir():
+    """Каталог кэша пропатченного chromedriver (CHROMEDRIVER_CACHE_DIR, по умолчанию ~/.cache/parser-casebook)"""
+    raw = (os.getenv('CHROMEDRIVER_CACHE_DIR') or '').strip()
+    return os.path.abspath(os.path.expanduser(raw or '~/.cache/parser-casebook'))
+
+
+def _cache_file():
+    return os.path.join(get_cache_dir(), 'chromedriver.json')
+
+
+def _load_cache():
+    try:
+        with open(_cache_file(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_cache(data):
+    write_json_atomic(_cache_file(), data, indent=2)
+
+
+def _binary_fingerprint(binary):
+    """Отпечаток бинарника Chrome: путь, размер и mtime меняются при обновлении браузера"""
+    real_path = os.path.realpath(binary)
+    stat = os.stat(real_path)
+    return f"{real_path}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def detect_chrome_version(binary):
+    """Полная версия Chrome из `chrome --version` (например, '126.0.6478.126') или None"""
+    try:
+        output = subprocess.run(
+            [binary, '--version'], capture_output=True, text=True, timeout=15
+        ).stdout
+    except Exception as e:
+        logger.warning(f"Не удалось определить версию Chrome ({binary}): {e}")
+        return None
+    m = re.search(r"(\d+)\.\d+\.\d+\.\d+", output or '')
+    return m.group(0) if m else None
+
+
+def _prepare_driver(major):
+    """Скачать и пропатчить chromedriver под major-версию и сохранить его копию в кэше"""
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    patcher = uc.Patcher(version_main=major)
+    patcher.auto()
+    driver_path = os.path.join(get_cache_dir(), f'chromedriver_{major}')
+    tmp_path = f"{driver_path}.{os.getpid()}.tmp"
+    shutil.copy2(patcher.executable_path, tmp_path)
+    os.chmod(tmp_path, 0o755)
+    os.replace(tmp_path, driver_path)
+    return driver_path
+
+
+def get_driver(major=None):
+    """Пропатченный chromedriver под установленный Chrome: (путь к драйверу, major-версия).
+
+    Кэш привязан к отпечатку бинарника Chrome и сбрасывается только при его обновлении;
+    major задаётся явно, когда версия известна из ошибки запуска. (None, None) —
+    Chrome не найден, драйвер подбирает сам undetected_chromedriver.
+    """
+    with _cache_lock:
+        binary = uc.find_chrome_executable()
+        if not binary:
+            return None, None
+        fingerprint = _binary_fingerprint(binary)
+        cache = _load_cache()
+        driver_path = cache.get('driver_path')
+        if cache.get('fingerprint') == fingerprint and (major is None or cache.get('major') == major) \
+                and driver_path and os.path.exists(driver_path):
+            return driver_path, cache['major']
+
+        if major is None:
+            version = detect_chrome_version(binary)
+            if not version:
+                return None, None
+            major = int(version.split('.')[0])
+        else:
+            version = None
+        logger.info(f"Подготовка chromedriver под Chrome {version or major}")
+        driver_path = _prepare_driver(major)
+        _save_cache({'fingerprint': fingerprint, 'chrome_version': version, 'major': major, 'driver_path': driver_path})
+        return driver_path, major
+
+
+def invalidate():
+    """Сбросить кэш (драйвер не подошёл к браузеру)"""
+    with _cache_lock:
+        try:
+            os.remove(_cache_file())
+        except FileNotFoundError:
+            pass
+
+
+def start_chrome(**kwargs):
+    """Запустить uc.Chrome с кэшированным драйвером: один запуск без повторного патча.
+
+    Если браузер всё же сообщает другую версию ("Current browser version is N"),
+    кэш пересобирается под N и запуск повторяется один раз.
+    """
+    driver_path, major = get_driver()
+    if driver_path:
+        kwargs.update(driver_executable_path=driver_path, version_main=major)
+    try:
+        return uc.Chrome(**kwargs)
+    except Exception as start_err:
+        m = re.search(r"Current browser version is (\d+)", str(start_err))
+        if not m:
+            raise
+        invalidate()
+        driver_path, major = get_driver(int(m.group(1)))
+        if driver_path:
+            kwargs.update(driver_executable_path=driver_path, version_main=major)
+        else:
+            kwargs.pop('driver_executable_path', None)
+            kwargs['version_main'] = int(m.group(1))
+        return uc.Chrome(**kwargs)
@@ -0,0 +1,115 @@
+import os
+import logging
+import threading
+import pandas as pd
+from file_utils import file_signature
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(name):
+    """Слова имени ответчика так же, как их сравнивал стоп-лист: без кавычек, в нижнем регистре"""
+    return name.replace('"', '').lower().split()
+
+
+class DefendantBlocklist:
+    """Скомпилированный стоп-лист ответчиков: trie по словам.
+
+    Строка defendant.txt — одно правило:
+      банк             — слово целиком ("ПАО Банк" да, "Банковский" нет);
+      нефт*            — слово, начинающееся с "нефт" ("Роснефть" нет, "Нефтьсервис" да);
+      исполнительный комитет — несколько слов подряд, последнее может быть с *.
+    Регистр и кавычки не важны. Проверка имени не зависит от числа правил: на каждое слово
+    имени — переход по trie и поиск в словаре префиксов по их длинам.
+    """
+
+    def __init__(self, entries=()):
+        self.root = self._node()
+        self.size = 0
+        for entry in entries:
+            self.add(entry)
+
+    @staticmethod
+    def _node():
+        return {'next': {}, 'entry': None, 'prefixes': {}, 'prefix_lengths': ()}
+
+    def add(self, entry):
+        tokens = tokenize(entry.strip())
+        if not tokens:
+            return
+        node = self.root
+        for token in tokens[:-1]:
+            node = node['next'].setdefault(token, self._node())
+        last = tokens[-1]
+        stem = last.rstrip('*')
+        if stem != last and stem:
+            node['prefixes'].setdefault(stem, entry.strip())
+            node['prefix_lengths'] = tuple(sorted({len(p) for p in node['prefixes']}))
+        else:
+            child = node['next'].setdefault(stem or last, self._node())
+            if child['entry'] is None:
+                child['entry'] = entry.strip()
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def _match_from(self, tokens, start):
+        node = self.root
+        for token in tokens[start:]:
+            for length in node['prefix_lengths']:
+                if length > len(token):
+                    break
+                entry = node['prefixes'].get(token[:length])
+                if entry is not None:
+                    return entry
+            node = node['next'].get(token)
+            if node is None:
+                return None
+            if node['entry'] is not None:
+                return node['entry']
+        return None
+
+    def match(self, name):
+        """Первое сработавшее правило для имени или None"""
+        if not isinstance(name, str) or not self.size:
+            return None
+        tokens = tokenize(name)
+        for start in range(len(tokens)):
+            entry = self._match_from(tokens, start)
+            if entry is not None:
+                return entry
+        return None
+
+    def match_many(self, names):
+        """Проверить столбец имён: (маска заблокированных, сработавшее правило или None).
+
+        Каждое уникальное имя проверяется один раз, индекс результата совпадает с names.
+        """
+        if not self.size or names.empty:
+            return pd.Series(False, index=names.index), pd.Series(None, index=names.index, dtype=object)
+        unique = pd.unique(names.to_numpy(dtype=object))
+        matches = {name: self.match(name) for name in unique}
+        matched = names.map(matches)
+        return matched.notna(), matched
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def load_blocklist(path):
+    """Стоп-лист из файла; пересобирается только при смене mtime или размера файла"""
+    signature = file_signature(path)
+    with _compiled_lock:
+        cached = _compiled.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        entries = []
+        if signature is not None:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = f.readlines()
+        blocklist = DefendantBlocklist(entries)
+        _compiled[path] = (signature, blocklist)
+        logger.info(f"Стоп-лист ответчиков: {len(blocklist)} правил из {os.path.basename(path)}")
+        return blocklist
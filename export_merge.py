@@ -0,0 +1,51 @@
+import io
+import os
+import hashlib
+
+
+class ExportWriter:
+    """Склейка CSV-выгрузок частей в открытый двоичный файл: заголовок берётся из первой
+    непустой части, строки остальных дописываются блоками без чтения части целиком.
+    SHA-256 записанного считается по ходу записи (hexdigest)."""
+
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, out):
+        self.out = out
+        self.parts = 0
+        self.header_written = False
+        self.ends_with_newline = True
+        self.digest = hashlib.sha256()
+
+    def _write(self, data):
+        if data:
+            self.out.write(data)
+            self.digest.update(data)
+            self.ends_with_newline = data.endswith(b'\n')
+
+    def append(self, source):
+        """Дописать часть: путь к файлу, буфер или bytes"""
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                self._append_stream(f)
+        else:
+            source.seek(0)
+            self._append_stream(source)
+
+    def _append_stream(self, stream):
+        header = stream.readline()
+        if not header.strip():
+            return
+        self.parts += 1
+        if not self.ends_with_newline:
+            self._write(b'\r\n')
+        if not self.header_written:
+            self._write(header)
+            self.header_written = True
+        for block in iter(lambda: stream.read(self.BLOCK_SIZE), b''):
+            self._write(block)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
@@ -0,0 +1,60 @@
+import os
+import json
+import fcntl
+import threading
+
+
+def write_json_atomic(path, data, indent=None, file_mode=None):
+    """Записать JSON через временный файл и os.replace: читатель видит старый или новый файл целиком.
+
+    file_mode — права нового файла (например, 0o600 для файлов с cookies).
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if file_mode is None:
+        f = open(tmp_path, 'w', encoding='utf-8')
+    else:
+        f = os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, file_mode), 'w', encoding='utf-8')
+    try:
+        with f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        if file_mode is not None:
+            os.chmod(tmp_path, file_mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_signature(path):
+    """(mtime в наносекундах, размер) файла для проверки актуальности кэша; None — файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_run_lock_path():
+    """Файл блокировки рабочего каталога (CASEBOOK_RUN_LOCK, по умолчанию casebook_run.lock)"""
+    raw = (os.getenv('CASEBOOK_RUN_LOCK') or '').strip()
+    return os.path.abspath(raw) if raw else os.path.join(os.getcwd(), 'casebook_run.lock')
+
+
+def acquire_run_lock(path=None):
+    """Занять рабочий каталог на время жизни процесса (flock без ожидания).
+
+    Возвращает открытый файл — блокировка держится, пока он не закрыт; None — каталог
+    уже занят другим процессом (планировщиком main_scrape.py или бэкфиллом).
+    """
+    f = open(path or get_run_lock_path(), 'a+', encoding='utf-8')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    f.seek(0)
+    f.truncate()
+    f.write(f'{os.getpid()}\n')
+    f.flush()
+    return f
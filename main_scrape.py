@@ -1,15 +1,23 @@
 import os
 import ast
+import json
 import time
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
 import bitrix_upload_data as upload_data
-import casebook_download_data as get_data
 import prepare_data_for_export as set_data
 from schedule import every, repeat, run_pending
 import subprocess
-import pandas as pd
+import threading
+from casebook_worker_pool import CasebookWorkerPool
+from casebook_query_planner import plan_queries
+from casebook_query_runner import probe_query, query_cache_key, order_by_yield, merge_query_stats, process_query
+from result_cache import ResultCache
+from rate_limiter import get_rate_limiter
+import browser_daemon_client
+from casebook_http_client import http_mode_enabled
+from file_utils import acquire_run_lock, get_run_lock_path
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO,
@@ -26,6 +34,10 @@ if not logger.handlers:
     _sh = logging.StreamHandler()
     _sh.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logger.addHandler(_sh)
+    # Ход поисков (casebook_query_runner) выводится в консоль так же, как и раньше
+    _runner_logger = logging.getLogger('CasebookQueryRunner')
+    _runner_logger.setLevel(logging.INFO)
+    _runner_logger.addHandler(_sh)
 
 SUMMARY_LOG_PATH = 'pipeline_summary.log'
 
@@ -42,8 +54,10 @@ def kill_chrome_processes():
 
 def cleanup_system():
     """Очистка системы перед запуском"""
-    kill_chrome_processes()
-    time.sleep(3)  # Добавьте небольшую паузу после убийства процессов
+    # Браузеры держит хост browser_daemon.py — его процессы не трогаем
+    if not browser_daemon_client.daemon_mode_enabled():
+        kill_chrome_processes()
+        time.sleep(3)  # Добавьте небольшую паузу после убийства процессов
 
     # Очистка временных файлов текущего прогона
     temp_files = ['ArbitrageSearchExport.csv', 'CleanedArbitrage.csv']
@@ -54,29 +68,51 @@ def cleanup_system():
             except:
                 pass
 
+
+def two_phase_enabled():
+    """Сначала пробы числа результатов по всем поискам, затем выгрузки по убыванию (CASEBOOK_TWO_PHASE).
+
+    По умолчанию включено только в режиме HTTP: в браузере проба — это полный второй поиск.
+    """
+    raw = (os.getenv('CASEBOOK_TWO_PHASE') or '').strip().lower()
+    if not raw:
+        return http_mode_enabled()
+    return raw in ('1', 'true', 'yes', 'y')
+
+
+def get_run_deadline():
+    """Ограничение времени фазы выгрузок в секундах (CASEBOOK_RUN_DEADLINE_MIN, 0 — без ограничения)"""
+    raw = (os.getenv('CASEBOOK_RUN_DEADLINE_MIN') or '0').strip()
+    try:
+        return max(0.0, float(raw)) * 60
+    except ValueError:
+        logger.warning(f'Некорректное значение CASEBOOK_RUN_DEADLINE_MIN={raw!r}, ограничение отключено')
+        return 0
+
+
 @repeat(every().hour)
 def check_courts():
     current_hour = datetime.now().strftime('%H')
     bad_times = ['22', '23', '00', '01', '02', '03', '04', '05', '06']
     requests_bundled = ast.literal_eval(os.environ['REQUESTS_BUNDLED'])
-    abs_path = os.getcwd()
 
     if current_hour not in bad_times:
         # Очистка перед запуском
         cleanup_system()
 
         run_bitrix_scenario = False
-        headers = True
-        today = datetime.now().strftime('%d.%m.%Y')
-        mode = 'w'
 
         total_reqs = len(requests_bundled)
         summary_data = {
             'requests_total': total_reqs,
             'requests_attempted': 0,
+            'searches_performed': 0,
             'casebook_found': 0,
             'casebook_downloaded': 0,
             'failed_download_results': 0,
+            'skipped_deadline': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
             'csv_rows_total': 0,
             'passed_filters': 0,
             'prepared_rows': 0,
@@ -84,138 +120,76 @@ def check_courts():
             'skipped_defendant': 0,
             'skipped_empty_defendant': 0,
             'skipped_invalid_inn': 0,
+            'skipped_watermark': 0,
+            'skipped_duplicate': 0,
+            'bundle_rows': {},
             'prepared_file_unique': 0,
             'bitrix_status': 'Bitrix не запущен',
             'bitrix_created': None,
             'bitrix_updated': None
         }
 
-        # Открываем одну сессию браузера Casebook для всех запросов
-        downloader = None
-        try:
-            downloader = get_data.create_casebook_session()
-
-            for req_idx, bundle in enumerate(requests_bundled):
-                try:
-                    court = bundle[0]
-                    category_code = bundle[1]
-                    min_sum = bundle[2]
-                    date_from_opt = bundle[3] if len(bundle) > 3 else None
-                except Exception:
-                    print(f"Некорректный формат REQUESTS_BUNDLED в элементе {bundle}, пропуск")
-                    continue
-
-                court_type = f"\n\tСуд в деле: {court}"
-                category = f"\n\tКатегория спора: {category_code}"
-                # Если в bundle передана дата, используем её для обеих границ
-                env_date_val = (os.getenv('CASEBOOK_DATE') or '').strip()
-                env_date_from_val = (os.getenv('CASEBOOK_DATE_FROM') or '').strip()
-                env_date_to_val = (os.getenv('CASEBOOK_DATE_TO') or '').strip()
-
-                if date_from_opt and str(date_from_opt).strip():
-                    eff_from = eff_to = str(date_from_opt).strip()
-                elif env_date_val:
-                    eff_from = eff_to = env_date_val
-                elif env_date_from_val or env_date_to_val:
-                    eff_from = env_date_from_val or env_date_to_val
-                    eff_to = env_date_to_val or env_date_from_val
-                else:
-                    eff_from = eff_to = datetime.now().strftime('%d.%m.%Y')
-
-                from_date = f"\n\tДата регистрации дела с: {eff_from}"
-                to_date = f"\n\tДата регистрации дела по: {eff_to}"
-                min_summ = f"\n\tИсковые требования в деле от: {min_sum}"
-
-                last_params = f'{from_date}{to_date}{min_summ}\n'
-                params = f'\n{court_type}{category}{last_params}'
-                progress = f"Проход {req_idx + 1}/{total_reqs}"
-                logger.info(progress)
-                logger.info(f'Выгрузка дел со следующими параметрами: {params}')
-
-                summary_data['requests_attempted'] += 1
-                last_results_count = 0
-                download_success = False
-                attempt_num = 0
-                while attempt_num < 3:
-                    try:
-                        if downloader is None:
-                            downloader = get_data.create_casebook_session()
-                        downloaded, results_count = get_data.process_casebook_request(
-                            downloader, court, category_code, min_sum, date_from_opt
-                        )
-                        last_results_count = results_count or 0
-                        if downloaded:
-                            download_success = True
-                            summary_data['casebook_found'] += last_results_count
-                            summary_data['casebook_downloaded'] += last_results_count
-                            logger.info(f'{progress}: Подготовка лидов...')
-                            if req_idx > 0:
-                                headers = False
-                                mode = 'a'
-                            got_new_leads = set_data.prepare_data(headers=headers, mode=mode)
-                            prepare_stats = getattr(set_data.prepare_data, 'last_stats', {}) or {}
-                            summary_data['csv_rows_total'] += prepare_stats.get('rows_in_file', 0) or 0
-                            summary_data['passed_filters'] += prepare_stats.get('passed_filters', 0) or 0
-                            summary_data['prepared_rows'] += prepare_stats.get('prepared_count', 0) or 0
-                            summary_data['skipped_seen'] += prepare_stats.get('skipped_seen_before', 0) or 0
-                            summary_data['skipped_defendant'] += prepare_stats.get('skipped_defendant_block', 0) or 0
-                            summary_data['skipped_empty_defendant'] += prepare_stats.get('skipped_empty_defendant', 0) or 0
-                            summary_data['skipped_invalid_inn'] += prepare_stats.get('skipped_invalid_inn_range', 0) or 0
-                            if got_new_leads:
-                                run_bitrix_scenario = True
-                            else:
-                                logger.info(f'✅ {progress}: Новых лидов нет')
-                            logger.info(f'✅ {progress}: завершён успешно')
-                            break
-                        else:
-                            attempt_num += 1
-                            if results_count == 0:
-                                summary_data['casebook_found'] += last_results_count
-                                logger.info(f'✅ {progress}: Найдено 0️⃣ арбитражных дел')
-                                break
-                            else:
-                                logger.warning(f"{progress}: Не удалось скачать по параметрам: {params}")
-                    except Exception as e:
-                        attempt_num += 1
-                        logger.error(f'{progress}: Ошибка при обработке запроса {bundle}: {str(e)}')
-                        # Перезапускаем сессию браузера и продолжаем с того же бандла
-                        try:
-                            if downloader is not None:
-                                get_data.close_casebook_session(downloader)
-                        except Exception:
-                            pass
-                        downloader = None
-                        time.sleep(2)
-                        try:
-                            downloader = get_data.create_casebook_session()
-                        except Exception as se:
-                            logger.error(f'{progress}: Ошибка при создании новой сессии: {str(se)}')
-                            time.sleep(10)
-                        # Продолжаем цикл; накопленные файлы не трогаем
-                        time.sleep(5)
-                if not download_success and last_results_count:
-                    summary_data['casebook_found'] += last_results_count
-                    summary_data['failed_download_results'] += last_results_count
-        finally:
-            if downloader is not None:
-                get_data.close_casebook_session(downloader)
+        # Запросы разбираются пулом сессий Casebook (CASEBOOK_WORKERS, по умолчанию одна)
+        # Реестры дел и номера, уже записанные в этом прогоне, — один индекс на все поиски
+        prepare_state = {'lock': threading.Lock(), 'first_write': True, 'dedup_index': set_data.DedupIndex()}
+        pool = CasebookWorkerPool()
+        # Запросы с общими судом, суммой и датой объединяются в один поиск по нескольким категориям
+        queries = plan_queries(requests_bundled)
+        # Число результатов и хэш выгрузки по каждому поиску с прошлых проходов
+        result_cache = ResultCache()
+
+        download_queries = queries
+        if two_phase_enabled() and len(queries) > 1:
+            # Фаза проб: только счётчики; поиски без результатов дальше не идут,
+            # остальные выгружаются по убыванию числа дел — крупные суды попадают в Bitrix первыми
+            def handle_probe(worker, query_idx, query):
+                return probe_query(worker, query_idx, query, len(queries))
+
+            # Сессии остаются открытыми: выгрузки идут в тех же браузерах
+            counts = pool.run(queries, handle_probe, keep_open=True)
+            unchanged = set()
+            for query_idx, (query, count) in enumerate(zip(queries, counts)):
+                if count is not None:
+                    summary_data['searches_performed'] += 1
+                if count == 0:
+                    summary_data['requests_attempted'] += len(query['bundles'])
+                elif count and result_cache.is_unchanged(query_cache_key(query, result_cache), count):
+                    # Число дел не изменилось с прошлого прохода — поиск не выгружается повторно
+                    unchanged.add(query_idx)
+                    summary_data['requests_attempted'] += len(query['bundles'])
+                    summary_data['casebook_found'] += count
+                    summary_data['cache_hits'] += 1
+            download_queries = order_by_yield(
+                [q for i, q in enumerate(queries) if i not in unchanged],
+                [c for i, c in enumerate(counts) if i not in unchanged]
+            )
+            logger.info(
+                f"Фаза проб: {len(queries)} поисков, с результатами {len(download_queries)} "
+                f"({sum(c for c in counts if c)} дел), без изменений {len(unchanged)}, выгрузка по убыванию"
+            )
+
+        # Лимит времени отсчитывается с начала выгрузок: долгие пробы его не расходуют
+        deadline_sec = get_run_deadline()
+        deadline = time.monotonic() + deadline_sec if deadline_sec else None
+
+        def handle_query(worker, query_idx, query):
+            if deadline and time.monotonic() > deadline:
+                logger.warning(f"Проход {query_idx + 1}/{len(download_queries)}: лимит времени прогона исчерпан, пропуск")
+                return {'skipped_deadline': len(query['bundles'])}
+            return process_query(worker, query_idx, query, len(download_queries), prepare_state, result_cache)
+
+        for query_stats in pool.run(download_queries, handle_query):
+            if query_stats:
+                merge_query_stats(summary_data, query_stats)
+                if query_stats.get('got_new_leads'):
+                    run_bitrix_scenario = True
+        prepare_state['dedup_index'].close()
 
         bitrix_stats = {}
+        bitrix_failed = False
         if run_bitrix_scenario:
-            # Подсчет общего количества дел по уникальному номеру дела
-            total_prepared = 0
-            try:
-                cleaned_path = os.path.join(abs_path, 'CleanedArbitrage.csv')
-                if os.path.exists(cleaned_path):
-                    df = pd.read_csv(cleaned_path, sep=';', encoding='windows-1251')
-                    if 'Номер дела' in df.columns:
-                        df['__case__'] = df['Номер дела'].astype(str)
-                        total_prepared = df['__case__'].nunique()
-                    else:
-                        total_prepared = len(df)
-            except Exception as te:
-                logger.warning(f'Не удалось посчитать количество дел для выгрузки: {te}')
-
+            # Дела в файле уникальны по номеру (DedupIndex) — перечитывать его не нужно
+            total_prepared = summary_data['prepared_rows']
             summary_data['prepared_file_unique'] = total_prepared
             logger.info(f"Всего дел для выгрузки в Bitrix: {total_prepared}")
             logger.info('Импорт лидов...')
@@ -225,6 +199,13 @@ def check_courts():
             summary_data['bitrix_status'] = bitrix_stats.get('status', upload_status)
             summary_data['bitrix_created'] = bitrix_stats.get('created_leads')
             summary_data['bitrix_updated'] = bitrix_stats.get('updated_leads')
+            bitrix_failed = str(summary_data['bitrix_status']).startswith('Ошибка')
+
+        # Кэш результатов фиксируется, только если лиды прогона дошли до Bitrix
+        if bitrix_failed:
+            result_cache.discard()
+        else:
+            result_cache.commit()
 
         # Принудительная очистка после выполнения
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -232,20 +213,29 @@ def check_courts():
         bitrix_updated_display = summary_data['bitrix_updated'] if summary_data['bitrix_updated'] is not None else 'n/a'
         summary_line = (
             f"{timestamp} | requests={summary_data['requests_attempted']}/{summary_data['requests_total']} | "
+            f"searches={summary_data['searches_performed']} | "
+            f"cache_hits={summary_data['cache_hits']} | cache_misses={summary_data['cache_misses']} | "
             f"found={summary_data['casebook_found']} | downloaded={summary_data['casebook_downloaded']} "
             f"(csv_rows={summary_data['csv_rows_total']}) | passed_filters={summary_data['passed_filters']} | "
             f"prepared_written={summary_data['prepared_rows']} | unique_for_bitrix={summary_data['prepared_file_unique']} | "
             f"bitrix_created={bitrix_created_display} | bitrix_updated={bitrix_updated_display} | "
             f"bitrix_status={summary_data['bitrix_status']} | skipped_seen={summary_data['skipped_seen']} | "
             f"skipped_defendant={summary_data['skipped_defendant']} | skipped_empty={summary_data['skipped_empty_defendant']} | "
-            f"skipped_invalid_inn={summary_data['skipped_invalid_inn']} | failed_download={summary_data['failed_download_results']}"
+            f"skipped_invalid_inn={summary_data['skipped_invalid_inn']} | failed_download={summary_data['failed_download_results']} | "
+            f"skipped_deadline={summary_data['skipped_deadline']} | skipped_watermark={summary_data['skipped_watermark']} | "
+            f"skipped_duplicate={summary_data['skipped_duplicate']} | request_rate={get_rate_limiter().current_rate:.2f}/s | "
+            f"bundles_with_rows={sum(1 for count in summary_data['bundle_rows'].values() if count)}"
         )
+        # Разбивка по запросам REQUESTS_BUNDLED — отдельной строкой, чтобы проверять пороги сумм
+        bundle_line = f"{timestamp} | bundle_rows | " + json.dumps(summary_data['bundle_rows'], ensure_ascii=False)
         try:
             with open(SUMMARY_LOG_PATH, 'a', encoding='utf-8') as summary_file:
                 summary_file.write(summary_line + '\n')
+                summary_file.write(bundle_line + '\n')
         except Exception as write_err:
             logger.warning(f'Не удалось записать сводку в {SUMMARY_LOG_PATH}: {write_err}')
         logger.info(f'Сводка прогона: {summary_line}')
+        logger.info(f'Ограничитель запросов Casebook: {get_rate_limiter().summary()}')
 
         cleanup_system()
     else:
@@ -254,6 +244,12 @@ def check_courts():
 
 
 if __name__ == "__main__":
+    # Бэкфилл работает с теми же CSV и браузерами — вместе с ним планировщик не запускается
+    run_lock = acquire_run_lock()
+    if run_lock is None:
+        logger.error(f"Рабочий каталог занят бэкфиллом (блокировка {get_run_lock_path()}), планировщик не запущен")
+        raise SystemExit(1)
+
     # Очистка при запуске
     cleanup_system()
 
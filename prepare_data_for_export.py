@@ -1,8 +1,12 @@
+import io
 import re
 import os
-import json
 import logging
 import pandas as pd
+from case_watermark import below_watermark, export_watermark
+from case_registry import CaseRegistry
+from defendant_blocklist import load_blocklist
+from result_cache import HashingReader
 
 logger = logging.getLogger(__name__)
 
@@ -27,9 +31,213 @@ def normalize_case_number(case_num):
     return re.sub(r'[^\d]', '', str(case_num).strip())
 
 
-def prepare_data(headers=False, mode='w'):
-    scraped_cases = set()
-    defendant_set = set()
+def normalize_case_numbers(values):
+    """Векторная normalize_case_number для столбца номеров дел (NaN — пустая строка)"""
+    return values.fillna('').astype(str).str.replace(r'[^\d]', '', regex=True)
+
+
+def parse_claim_amounts(values):
+    """Векторно перевести столбец 'Исковые требования' в число (NaN, если суммы нет)"""
+    text = values.fillna('').astype(str).str.replace(r'[\xa0\u202f]', ' ', regex=True)
+    number = text.str.extract(r'(\d[\d ]*(?:[.,]\d+)?)', expand=False)
+    number = number.str.replace(' ', '', regex=False).str.replace(',', '.', regex=False)
+    return pd.to_numeric(number, errors='coerce')
+
+
+def count_rows_by_bundle(data, bundles, counts=None):
+    """Разложить строки объединённой выгрузки по исходным запросам.
+
+    bundles — пары (индекс запроса, {'category', 'min_sum'}). Строка относится к запросу,
+    если её 'Категория спора' начинается с кода категории ("2", "2.", "2 ...", но не "23")
+    и сумма 'Исковые требования' не меньше min_sum запроса; строки без распознанной суммы
+    засчитываются всем запросам своей категории. Строки без подходящей категории
+    возвращаются под ключом None. data — выгрузка или её часть; counts — счётчики
+    предыдущих частей, они дополняются на месте и возвращаются.
+    """
+    if counts is None:
+        counts = {}
+    categories = data['Категория спора'].fillna('').str.strip()
+    amounts = parse_claim_amounts(data['Исковые требования'])
+
+    category_codes = []
+    for _, bundle in bundles:
+        if bundle['category'] not in category_codes:
+            category_codes.append(bundle['category'])
+
+    # Для поиска по одной категории все строки относятся к ней без разбора столбца
+    matched = pd.Series(len(category_codes) == 1, index=data.index)
+    category_masks = {}
+    for code in category_codes:
+        if len(category_codes) == 1:
+            category_masks[code] = matched
+            continue
+        mask = categories.str.match(rf"{re.escape(str(code))}(?![\d])") & ~matched
+        category_masks[code] = mask
+        matched |= mask
+
+    for req_idx, bundle in bundles:
+        try:
+            threshold = float(str(bundle['min_sum']).replace(' ', ''))
+        except ValueError:
+            threshold = 0
+        mask = category_masks[bundle['category']] & (amounts.isna() | (amounts >= threshold))
+        counts[req_idx] = counts.get(req_idx, 0) + int(mask.sum())
+    counts[None] = counts.get(None, 0) + int((~matched).sum())
+    return counts
+
+
+def get_chunk_rows():
+    """Размер части выгрузки в строках (PREPARE_CHUNK_ROWS, по умолчанию 50000; 0 — файл целиком)"""
+    raw = (os.getenv('PREPARE_CHUNK_ROWS') or '50000').strip()
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return 50000
+
+
+def iter_export_chunks(raw_csv_path, chunk_rows=None):
+    """Читать выгрузку частями по chunk_rows строк, чтобы память не росла с размером файла"""
+    if chunk_rows is None:
+        chunk_rows = get_chunk_rows()
+    if not chunk_rows:
+        yield pd.read_csv(raw_csv_path, sep=';', encoding='windows-1251', dtype=str)
+        return
+    with pd.read_csv(raw_csv_path, sep=';', encoding='windows-1251', dtype=str, chunksize=chunk_rows) as reader:
+        yield from reader
+
+
+def filter_rows(frame, scraped_cases, blocklist, stats):
+    """Отфильтровать строки выгрузки и разложить дела с несколькими ответчиками по строкам.
+
+    Дело с несколькими ответчиками и несколькими ИНН (через перевод строки) даёт строку
+    на каждого ответчика с его ИНН; такие строки с диапазоном ИНН ('-') отбрасываются.
+    Строки с ответчиком из стоп-листа blocklist (DefendantBlocklist) отбрасываются.
+    Возвращает DataFrame со столбцами needed_headers, 'Название лида' и '__case__'
+    (нормализованный номер дела) в исходном порядке строк; счётчики пишутся в stats.
+    """
+    frame = frame.reset_index(drop=True).assign(__case__=normalize_case_numbers(frame['Номер дела']).to_numpy())
+    seen = (frame['__case__'] != '') & frame['__case__'].isin(scraped_cases)
+    stats['skipped_seen_before'] += int(seen.sum())
+    frame = frame.loc[~seen]
+
+    defendants = frame['Ответчик/Должник']
+    empty = defendants.isna() | (defendants == '')
+    stats['skipped_empty_defendant'] += int(empty.sum())
+    frame = frame.loc[~empty]
+
+    multi = frame['Ответчик/Должник'].str.contains('\n', regex=False) \
+        & frame['ИНН Ответчика/Должника'].str.contains('\n', regex=False, na=False)
+
+    # Один ответчик: проверяется вся строка, название лида — исходный ответчик
+    single = frame.loc[~multi]
+    single_blocked, _ = blocklist.match_many(single['Ответчик/Должник'])
+    stats['skipped_defendant_block'] += int(single_blocked.sum())
+    single = single.loc[~single_blocked]
+    single = single.assign(**{'Название лида': single['Ответчик/Должник']})
+
+    # Несколько ответчиков: ИНН сопоставляются по позиции, недостающие — пустые
+    multi_names = frame.loc[multi, 'Ответчик/Должник'].str.split('\n')
+    multi_inns = [
+        inn_list[:len(name_list)] + [''] * (len(name_list) - len(inn_list))
+        for name_list, inn_list in zip(multi_names, frame.loc[multi, 'ИНН Ответчика/Должника'].str.split('\n'))
+    ]
+    exploded = frame.loc[multi].assign(**{
+        'Ответчик/Должник': multi_names,
+        'ИНН Ответчика/Должника': pd.Series(multi_inns, index=multi_names.index, dtype=object),
+    }).explode(['Ответчик/Должник', 'ИНН Ответчика/Должника'])
+    exploded['Ответчик/Должник'] = exploded['Ответчик/Должник'].str.replace('\r', '', regex=False)
+    exploded['ИНН Ответчика/Должника'] = exploded['ИНН Ответчика/Должника'].str.replace('\r', '', regex=False)
+
+    # После explode индекс повторяется у ответчиков одного дела — маски применяются позиционно
+    invalid_inn = exploded['ИНН Ответчика/Должника'].str.contains('-', regex=False).to_numpy(dtype=bool)
+    stats['skipped_invalid_inn_range'] += int(invalid_inn.sum())
+    exploded = exploded.loc[~invalid_inn]
+    multi_blocked = blocklist.match_many(exploded['Ответчик/Должник'])[0].to_numpy(dtype=bool)
+    stats['skipped_defendant_block'] += int(multi_blocked.sum())
+    exploded = exploded.loc[~multi_blocked]
+    exploded = exploded.assign(**{'Название лида': exploded['Ответчик/Должник']})
+
+    # Строки ответчиков одного дела сохраняют порядок: сортировка по исходной строке устойчивая
+    ready = pd.concat([single, exploded]).sort_index(kind='stable')
+    return ready.reset_index(drop=True)[needed_headers + ['Название лида', '__case__']]
+
+
+class DedupIndex:
+    """Индекс для отсева дел в рамках прогона: реестр уже выгруженных дел (CaseRegistry),
+    стоп-лист ответчиков и номера дел, записанные в CleanedArbitrage.csv этим прогоном.
+
+    Реестр проверяется только по номерам очередной части выгрузки, стоп-лист из
+    defendant.txt пересобирается только при смене mtime или размера, поэтому один индекс
+    переиспользуется всеми вызовами prepare_data.
+    """
+
+    def __init__(self, base_dir=None, registry=None):
+        self.base_dir = base_dir or abs_path
+        self.written_cases = set()
+        self._registry = registry
+        # Реестр, открытый самим индексом, закрывается в close(); переданный — владельцем
+        self._owns_registry = registry is None
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            self._registry = CaseRegistry(base_dir=self.base_dir)
+        return self._registry
+
+    def close(self):
+        """Закрыть соединение с реестром дел, если его открыл индекс"""
+        if self._owns_registry and self._registry is not None:
+            self._registry.close()
+            self._registry = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def seen_cases(self, case_keys):
+        """Номера из case_keys, уже выгруженные раньше (cases_num.txt или импорт в Bitrix)"""
+        # Правки cases_num.txt и processed_cases.json вручную подхватываются между вызовами
+        self.registry.migrate_legacy()
+        return self.registry.seen(set(case_keys))
+
+    def defendants(self):
+        """Скомпилированный стоп-лист ответчиков из defendant.txt"""
+        return load_blocklist(self._path('defendant.txt'))
+
+    def record_written(self, case_keys, source=None):
+        """Запомнить номера дел, записанные в CleanedArbitrage.csv в этом прогоне"""
+        # Строки без номера дела ('') не должны отсеивать такие же строки других поисков
+        case_keys = {case_key for case_key in case_keys if case_key}
+        self.written_cases.update(case_keys)
+        if case_keys:
+            self.registry.record_prepared(case_keys, source)
+
+
+def prepare_data(headers=False, mode='w', raw_csv_path=None, watermark=None, dedup_index=None, source=None,
+                 bundles=None):
+    """Отфильтровать выгрузку и записать новые дела в CleanedArbitrage.csv.
+
+    watermark — водяной знак поиска из инкрементального режима: строки с номерами дел
+    не выше него уже разобраны прошлыми проходами и отбрасываются до остальных фильтров.
+    dedup_index — общий для прогона DedupIndex: реестры не перечитываются на каждом вызове,
+    а дела, уже записанные прошлыми вызовами, не дублируются в файле. Без него индекс
+    строится заново для одного вызова. source — описание поиска (суд, категории, сумма),
+    с которым записанные дела попадают в реестр.
+
+    Выгрузка читается один раз: в том же проходе в last_stats попадают её SHA-256
+    (content_hash), водяной знак всех её дел (export_watermark) и, если переданы
+    bundles (запросы поиска, см. count_rows_by_bundle), разбивка строк по запросам
+    (bundle_counts).
+    """
+    if dedup_index is None:
+        # Индекс на один вызов закрывается вместе с соединением с реестром
+        with DedupIndex() as own_index:
+            return prepare_data(headers, mode, raw_csv_path, watermark, own_index, source, bundles)
     stats = {
         'rows_in_file': 0,
         'passed_filters': 0,
@@ -37,136 +245,89 @@ def prepare_data(headers=False, mode='w'):
         'skipped_seen_before': 0,
         'skipped_empty_defendant': 0,
         'skipped_defendant_block': 0,
-        'skipped_invalid_inn_range': 0
+        'skipped_invalid_inn_range': 0,
+        'skipped_below_watermark': 0,
+        'skipped_duplicate_in_run': 0,
+        'bundle_counts': {},
+        'export_watermark': {},
+        'content_hash': None
     }
+    blocklist = dedup_index.defendants()
 
-    # Чтение файлов с гарантированным закрытием
-    if os.path.exists('cases_num.txt'):
-        with open(os.path.join(abs_path, 'cases_num.txt'), 'r', encoding='utf-8') as f:
-            # Нормализуем номера (цифры только), даже если в файле уже так
-            scraped_cases = {normalize_case_number(sc) for sc in f.readlines() if normalize_case_number(sc)}
+    # Чтение CSV: путь к файлу или буфер, перехваченный в память загрузчиком
+    if raw_csv_path is None:
+        raw_csv_path = os.path.join(abs_path, 'ArbitrageSearchExport.csv')
+    is_file = isinstance(raw_csv_path, (str, os.PathLike))
+    cleaned_path = os.path.join(abs_path, 'CleanedArbitrage.csv')
+    # Номера дел, уже записанные этим вызовом: дедупликация сквозь все части файла
+    written_cases = set()
+    # Хэш считается по байтам, которые читает парсер, — файл не перечитывается ради него
+    raw_stream = open(raw_csv_path, 'rb') if is_file else raw_csv_path
+    try:
+        if not is_file:
+            raw_stream.seek(0)
+        reader = HashingReader(raw_stream)
+        for data in iter_export_chunks(io.BufferedReader(reader)):
+            stats['rows_in_file'] += len(data)
+            export_watermark(data['Номер дела'], stats['export_watermark'])
+            if bundles:
+                count_rows_by_bundle(data, bundles, stats['bundle_counts'])
+            if watermark:
+                seen_mask = below_watermark(data['Номер дела'], watermark)
+                stats['skipped_below_watermark'] += int(seen_mask.sum())
+                data = data.loc[~seen_mask]
 
-    # Дополнительно исключаем дела из реестра уже импортированных в Bitrix
-    registry_path = os.path.join(abs_path, 'processed_cases.json')
-    if os.path.exists(registry_path):
-        try:
-            with open(registry_path, 'r', encoding='utf-8') as rf:
-                arr = json.load(rf)
-                if isinstance(arr, list):
-                    for x in arr:
-                        normalized_case = normalize_case_number(x)
-                        if normalized_case:  # Проверяем, что номер не пустой
-                            scraped_cases.add(normalized_case)
-                    logger.info(f"Загружено {len(arr)} номеров дел из processed_cases.json для исключения")
-        except Exception as e:
-            logger.warning(f"Ошибка при чтении processed_cases.json: {e}")
-            pass
-
-    if os.path.exists('defendant.txt'):
-        with open(os.path.join(abs_path, 'defendant.txt'), 'r', encoding='utf-8') as f:
-            defendant_set = {li.strip().lower() for li in f.readlines()}
-
-    # Чтение CSV
-    raw_csv_path = os.path.join(abs_path, 'ArbitrageSearchExport.csv')
-    data = pd.read_csv(
-        raw_csv_path,
-        sep=';', encoding='windows-1251', dtype=str).to_dict(orient='records')
-    stats['rows_in_file'] = len(data)
-
-    ready_data = []
-    for line in data:
-        new_line = {}
-        for nh in needed_headers:
-            new_line[nh] = line[nh]
-
-        case_num = new_line['Номер дела']
-        case_for_file = normalize_case_number(case_num)
-
-        if case_for_file and case_for_file in scraped_cases:
-            stats['skipped_seen_before'] += 1
-            continue
+            scraped_cases = dedup_index.seen_cases(normalize_case_numbers(data['Номер дела']))
+            ready_data = filter_rows(data[needed_headers], scraped_cases, blocklist, stats)
+            stats['passed_filters'] += len(ready_data)
 
-        if not new_line.get('Ответчик/Должник') or not isinstance(new_line.get('Ответчик/Должник'), str):
-            stats['skipped_empty_defendant'] += 1
-            continue
+            # Дела, уже записанные прошлыми вызовами этого прогона (другими поисками)
+            earlier = ready_data['__case__'].isin(dedup_index.written_cases)
+            stats['skipped_duplicate_in_run'] += int(earlier.sum())
 
-        names_is_list = new_line['Ответчик/Должник'].split('\n')
-        try:
-            inns_list = new_line['ИНН Ответчика/Должника'].split('\n')
-        except AttributeError:
-            inns_list = []
-
-        if len(names_is_list) > 1 and len(inns_list) > 1:
-            for name_num, name in enumerate(names_is_list):
-                new_line_copy = new_line.copy()
-                name = name.replace('\r', '')
-                name_inn = inns_list[name_num].replace('\r', '') if name_num < len(inns_list) else ''
-
-                if '-' in name_inn:
-                    stats['skipped_invalid_inn_range'] += 1
-                    continue
-
-                def_names_list = [token.lower() for token in name.replace('"', '').split()]
-                has_block = any(token in defendant_set for token in def_names_list)
-
-                if has_block:
-                    stats['skipped_defendant_block'] += 1
-                    continue
-
-                new_line_copy['Ответчик/Должник'] = name
-                new_line_copy['ИНН Ответчика/Должника'] = name_inn
-                new_line_copy['Название лида'] = name
-                ready_data.append(new_line_copy)
-        else:
-            def_names_list = [token.lower() for token in new_line['Ответчик/Должник'].replace('"', '').split()]
-            has_block = any(token in defendant_set for token in def_names_list)
-
-            if has_block:
-                stats['skipped_defendant_block'] += 1
+            # Дедупликация строго по номеру дела (__case__ посчитан в filter_rows)
+            fresh = ~earlier & ~ready_data['__case__'].duplicated() & ~ready_data['__case__'].isin(written_cases)
+            df_new = ready_data.loc[fresh]
+            if not len(df_new):
                 continue
+            written_cases.update(df_new['__case__'])
+            df_new = df_new.drop(columns=['__case__'])
 
-            new_line['Название лида'] = line['Ответчик/Должник']
-            ready_data.append(new_line)
-
-    stats['passed_filters'] = len(ready_data)
-
-    if ready_data:
-        cleaned_path = os.path.join(abs_path, 'CleanedArbitrage.csv')
-
-        # Дедупликация внутри батча строго по номеру дела
-        df_new = pd.DataFrame(ready_data)
-        df_new['__case__'] = df_new['Номер дела'].astype(str).apply(normalize_case_number)
-        df_new = df_new.loc[~df_new['__case__'].duplicated()].copy()
+            # Первая запись — в режиме вызова, следующие части дописываются без заголовка
+            if stats['prepared_count']:
+                chunk_mode, effective_header = 'a', False
+            else:
+                chunk_mode, effective_header = mode, headers
+                if mode == 'a' and not os.path.exists(cleaned_path):
+                    effective_header = True
+            df_new.to_csv(
+                cleaned_path,
+                sep=';',
+                index=False,
+                encoding='windows-1251',
+                mode=chunk_mode,
+                header=effective_header
+            )
+            stats['prepared_count'] += len(df_new)
+        stats['content_hash'] = reader.hexdigest()
+    finally:
+        if is_file:
+            raw_stream.close()
 
-        # Не накапливаем прошлые проходы: всегда сохраняем ТОЛЬКО текущие новые дела
-        if '__case__' in df_new.columns:
-            df_new = df_new.drop(columns=['__case__'])
-        stats['prepared_count'] = len(df_new)
-
-        effective_header = headers
-        if mode == 'a' and not os.path.exists(cleaned_path):
-            effective_header = True
-
-        df_new.to_csv(
-            cleaned_path,
-            sep=';',
-            index=False,
-            encoding='windows-1251',
-            mode=mode,
-            header=effective_header
-        )
+    dedup_index.record_written(written_cases, source)
+    prepare_data.last_stats = stats
+    if stats['prepared_count']:
+        # Не накапливаем прошлые проходы: в файл попадают ТОЛЬКО текущие новые дела.
         # После успешной записи удаляем исходный файл
         try:
-            if os.path.exists(raw_csv_path):
+            if is_file and os.path.exists(raw_csv_path):
                 os.remove(raw_csv_path)
         except Exception as rm_err:
             logger.warning(f"Не удалось удалить ArbitrageSearchExport.csv: {rm_err}")
         logger.info('Data is ready')
-        prepare_data.last_stats = stats
         return True
     else:
         logger.info('No new data since last time')
-        prepare_data.last_stats = stats
         return False
 
 
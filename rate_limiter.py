@@ -0,0 +1,120 @@
+import os
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger('RateLimiter')
+
+# Во сколько раз снижается темп на каждом сигнале (мультипликативное снижение AIMD)
+SIGNAL_FACTORS = {
+    'slow': 0.8,        # ответ дольше CASEBOOK_RATE_SLOW_SEC
+    'empty': 0.7,       # пустой блок результатов вместо счётчика
+    'error': 0.7,       # исключение при поиске или выгрузке
+    'throttle': 0.5,    # HTTP 429
+    'login': 0.5,       # редирект на вход посреди работы
+    'captcha': 0.3,     # страница с капчей
+}
+# Сигналы, после которых все сессии выдерживают паузу CASEBOOK_RATE_COOLDOWN_SEC
+COOLDOWN_SIGNALS = ('throttle', 'login', 'captcha')
+
+
+def _env_float(name, default):
+    raw = (os.getenv(name) or '').strip()
+    try:
+        return float(raw) if raw else default
+    except ValueError:
+        logger.warning(f"Некорректное значение {name}={raw!r}, используется {default}")
+        return default
+
+
+class AdaptiveRateLimiter:
+    """Token bucket с AIMD-подстройкой темпа запросов к Casebook, общий для всех сессий.
+
+    Каждый успешный быстрый ответ прибавляет к темпу step запросов в секунду, каждый
+    сигнал проблемы (медленный ответ, пустые результаты, ошибка, вход, капча) умножает
+    темп на коэффициент из SIGNAL_FACTORS. Темп держится в пределах [min_rate, max_rate].
+    """
+
+    def __init__(self, rate=None, min_rate=None, max_rate=None, burst=None, step=None,
+                 slow_sec=None, cooldown_sec=None):
+        self.min_rate = min_rate if min_rate is not None else _env_float('CASEBOOK_RATE_MIN', 0.05)
+        self.max_rate = max_rate if max_rate is not None else _env_float('CASEBOOK_RATE_MAX', 2.0)
+        initial = rate if rate is not None else _env_float('CASEBOOK_RATE_INITIAL', 0.5)
+        self.rate = min(self.max_rate, max(self.min_rate, initial))
+        self.burst = burst if burst is not None else max(1.0, _env_float('CASEBOOK_RATE_BURST', 2.0))
+        self.step = step if step is not None else _env_float('CASEBOOK_RATE_STEP', 0.05)
+        self.slow_sec = slow_sec if slow_sec is not None else _env_float('CASEBOOK_RATE_SLOW_SEC', 20.0)
+        self.cooldown_sec = cooldown_sec if cooldown_sec is not None else _env_float('CASEBOOK_RATE_COOLDOWN_SEC', 60.0)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.signals = {}
+        self.lock = threading.Lock()
+
+    @property
+    def current_rate(self):
+        """Текущий темп, запросов в секунду"""
+        return self.rate
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """Дождаться токена перед запросом; возвращает время ожидания в секундах"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def record_success(self, duration=None):
+        """Учесть успешный ответ: медленный снижает темп, быстрый — прибавляет step"""
+        if duration is not None and self.slow_sec and duration > self.slow_sec:
+            self.record_signal('slow')
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def record_signal(self, kind):
+        """Сигнал проблемы: мультипликативно снизить темп, при блокировке — общая пауза"""
+        factor = SIGNAL_FACTORS.get(kind, SIGNAL_FACTORS['error'])
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            previous = self.rate
+            self.rate = max(self.min_rate, self.rate * factor)
+            self.tokens = min(self.tokens, 0.0)
+            self.signals[kind] = self.signals.get(kind, 0) + 1
+            if kind in COOLDOWN_SIGNALS:
+                self.paused_until = max(self.paused_until, now + self.cooldown_sec)
+        logger.info(f"Темп запросов Casebook: {previous:.2f} → {self.rate:.2f} в секунду (сигнал: {kind})")
+
+    def backoff(self, attempt):
+        """Пауза перед повтором после ошибки: растёт с номером попытки и падением темпа"""
+        base = max(1.0, 1.0 / self.rate)
+        return min(120.0, base * (2 ** max(0, attempt - 1))) * random.uniform(0.8, 1.2)
+
+    def summary(self):
+        signals = ', '.join(f"{kind}={count}" for kind, count in sorted(self.signals.items())) or 'нет'
+        return f"темп {self.rate:.2f}/с, сигналы: {signals}"
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Общий для процесса ограничитель: его делят все рабочие пула и повторные прогоны"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveRateLimiter()
+        return _shared_limiter
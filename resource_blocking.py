@@ -0,0 +1,81 @@
+import os
+import logging
+
+logger = logging.getLogger('ResourceBlocking')
+
+# Картинки, видео и веб-шрифты: автоматизации они не нужны. SVG не блокируем —
+# ими нарисованы стрелки и флажки выпадающих списков в формах.
+IMAGE_PATTERNS = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.bmp', '*.ico']
+MEDIA_PATTERNS = ['*.mp4', '*.webm', '*.mp3', '*.ogg']
+FONT_PATTERNS = ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot']
+# Аналитика и виджеты чатов сторонних сервисов
+THIRD_PARTY_PATTERNS = [
+    '*google-analytics.com*',
+    '*googletagmanager.com*',
+    '*doubleclick.net*',
+    '*mc.yandex.ru*',
+    '*mc.yandex.com*',
+    '*top-fwz1.mail.ru*',
+    '*connect.facebook.net*',
+    '*vk.com/js/api/openapi*',
+    '*hotjar.com*',
+    '*jivosite.com*',
+    '*code.jivo.ru*',
+    '*carrotquest.io*',
+    '*usedesk.ru*',
+]
+
+PROFILES = {
+    'off': [],
+    'media': IMAGE_PATTERNS + MEDIA_PATTERNS + FONT_PATTERNS,
+    'standard': IMAGE_PATTERNS + MEDIA_PATTERNS + FONT_PATTERNS + THIRD_PARTY_PATTERNS,
+}
+
+
+def _env_list(name):
+    return [item.strip() for item in (os.getenv(name) or '').split(',') if item.strip()]
+
+
+def get_block_profile():
+    """Профиль блокировки ресурсов из BROWSER_BLOCK_PROFILE: off, media или standard (по умолчанию)"""
+    profile = (os.getenv('BROWSER_BLOCK_PROFILE') or 'standard').strip().lower()
+    if profile not in PROFILES:
+        logger.warning(f"Неизвестный BROWSER_BLOCK_PROFILE={profile!r}, блокировка отключена")
+        return 'off'
+    return profile
+
+
+def get_blocked_patterns(profile=None):
+    """Шаблоны URL для Network.setBlockedURLs.
+
+    BROWSER_BLOCK_EXTRA добавляет шаблоны, BROWSER_BLOCK_ALLOW убирает их из списка —
+    например, '*.woff2', если форме понадобится иконочный шрифт.
+    """
+    profile = profile or get_block_profile()
+    allowed = set(_env_list('BROWSER_BLOCK_ALLOW'))
+    patterns = PROFILES[profile] + (_env_list('BROWSER_BLOCK_EXTRA') if profile != 'off' else [])
+    return [pattern for pattern in dict.fromkeys(patterns) if pattern not in allowed]
+
+
+def content_settings_prefs(profile=None):
+    """Префы Chrome, отключающие загрузку картинок на уровне движка (если картинки не разрешены)"""
+    patterns = get_blocked_patterns(profile)
+    if not all(pattern in patterns for pattern in IMAGE_PATTERNS):
+        return {}
+    return {'profile.managed_default_content_settings.images': 2}
+
+
+def apply_blocking(driver, profile=None):
+    """Включить блокировку ресурсов в текущей сессии драйвера; возвращает число шаблонов"""
+    profile = profile or get_block_profile()
+    patterns = get_blocked_patterns(profile)
+    if not patterns:
+        return 0
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+        logger.info(f"Блокировка ресурсов: профиль {profile}, {len(patterns)} шаблонов")
+    except Exception as e:
+        logger.warning(f"Не удалось включить блокировку ресурсов: {e}")
+        return 0
+    return len(patterns)
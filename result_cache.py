@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import io
+import hashlib
+import logging
+import threading
+from file_utils import write_json_atomic
+
+logger = logging.getLogger('ResultCache')
+
+
+def get_cache_file(default_name='.casebook_result_cache.json'):
+    """Файл кэша результатов поиска из CASEBOOK_RESULT_CACHE; пустая строка или off — кэш выключен"""
+    raw = os.getenv('CASEBOOK_RESULT_CACHE')
+    if raw is None:
+        return os.path.join(os.getcwd(), default_name)
+    raw = raw.strip()
+    if raw.lower() in ('', 'off', 'false', '0', 'no'):
+        return None
+    return os.path.abspath(raw)
+
+
+def get_cache_max_age():
+    """Срок хранения записей кэша в секундах (CASEBOOK_RESULT_CACHE_MAX_AGE_H, по умолчанию 48 ч)"""
+    raw = (os.getenv('CASEBOOK_RESULT_CACHE_MAX_AGE_H') or '48').strip()
+    try:
+        return float(raw) * 3600
+    except ValueError:
+        return 48 * 3600
+
+
+class HashingReader(io.RawIOBase):
+    """Двоичный поток, считающий SHA-256 прочитанных байтов: хэш выгрузки получается
+    в том же проходе, в котором её разбирает prepare_data"""
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.digest = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        self.digest.update(data)
+        return len(data)
+
+    def hexdigest(self):
+        """Хэш всего потока: остаток, не понадобившийся парсеру, дочитывается"""
+        for chunk in iter(lambda: self.stream.read(1024 * 1024), b''):
+            self.digest.update(chunk)
+        return self.digest.hexdigest()
+
+
+class ResultCache:
+    """Число результатов, хэш выгрузки и водяной знак номеров дел по ключу
+    (суд, категории, порог суммы, диапазон дат).
+
+    Новые записи копятся в pending и попадают в файл только через commit() — после того,
+    как прогон довёл лиды до Bitrix; при сбое импорта discard() оставляет прежние записи,
+    и следующий прогон выгрузит эти поиски заново.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else get_cache_file()
+        self.entries = self._load()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш результатов {self.path}: {e}")
+            return {}
+
+    @staticmethod
+    def key(court, categories, min_sum, date_from, date_to):
+        if isinstance(categories, (list, tuple)):
+            categories = ','.join(sorted(str(code) for code in categories))
+        min_sum = str(min_sum).replace(' ', '')
+        return '|'.join([str(court), str(categories), min_sum, str(date_from), str(date_to)])
+
+    def get(self, key):
+        with self.lock:
+            return self.pending.get(key) or self.entries.get(key)
+
+    def is_unchanged(self, key, count):
+        """Совпадает ли число результатов с последней учтённой выгрузкой"""
+        if not self.enabled:
+            return False
+        entry = self.get(key)
+        return bool(entry) and entry.get('count') == count
+
+    def same_content(self, key, content_hash):
+        """Совпадает ли содержимое выгрузки с последней учтённой"""
+        entry = self.get(key)
+        return bool(entry) and entry.get('hash') == content_hash
+
+    def record(self, key, count, content_hash, watermark=None):
+        if not self.enabled:
+            return
+        entry = {'count': count, 'hash': content_hash, 'updated_at': time.time()}
+        if watermark:
+            entry['watermark'] = watermark
+        with self.lock:
+            self.pending[key] = entry
+
+    def commit(self):
+        """Записать новые записи в файл, отбросив устаревшие"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.entries.update(self.pending)
+            self.pending = {}
+            oldest = time.time() - get_cache_max_age()
+            self.entries = {k: v for k, v in self.entries.items() if v.get('updated_at', 0) >= oldest}
+            try:
+                write_json_atomic(self.path, self.entries)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить кэш результатов {self.path}: {e}")
+
+    def discard(self):
+        with self.lock:
+            self.pending = {}
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import logging
+from file_utils import write_json_atomic
+
+logger = logging.getLogger('SessionStore')
+
+# Поля cookie, которые принимает Network.setCookies (остальные из getAllCookies отбрасываются)
+COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires', 'priority')
+
+
+def get_session_file(default_name='.casebook_session.json'):
+    """Путь к файлу сохранённой сессии из CASEBOOK_SESSION_FILE; пустая строка — кэш выключен"""
+    raw = os.getenv('CASEBOOK_SESSION_FILE')
+    if raw is None:
+        return os.path.join(os.getcwd(), default_name)
+    raw = raw.strip()
+    if raw.lower() in ('', 'off', 'false', '0', 'no'):
+        return None
+    return os.path.abspath(raw)
+
+
+def get_session_max_age():
+    """Максимальный возраст сохранённой сессии в секундах (CASEBOOK_SESSION_MAX_AGE_H, по умолчанию 24 ч)"""
+    raw = (os.getenv('CASEBOOK_SESSION_MAX_AGE_H') or '24').strip()
+    try:
+        return float(raw) * 3600
+    except ValueError:
+        return 24 * 3600
+
+
+def save_browser_session(driver, path, origin):
+    """Сохранить cookies (включая httpOnly) и localStorage браузера в файл с правами 0600"""
+    cookies = driver.execute_cdp_cmd('Network.getAllCookies', {}).get('cookies', [])
+    try:
+        local_storage = json.loads(driver.execute_script(
+            "return JSON.stringify(Object.assign({}, window.localStorage));"
+        ) or '{}')
+    except Exception:
+        local_storage = {}
+
+    data = {
+        'saved_at': time.time(),
+        'origin': origin,
+        'cookies': cookies,
+        'local_storage': local_storage
+    }
+    # Файл содержит действующие cookies авторизации — доступ только владельцу
+    write_json_atomic(path, data, file_mode=0o600)
+    logger.info(f"Сессия сохранена: {len(cookies)} cookies, {len(local_storage)} ключей localStorage")
+
+
+def load_browser_session(path):
+    """Прочитать сохранённую сессию; None, если файла нет, он повреждён или устарел"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать сохранённую сессию {path}: {e}")
+        return None
+    if time.time() - data.get('saved_at', 0) > get_session_max_age():
+        logger.info("Сохранённая сессия устарела")
+        return None
+    return data
+
+
+def restore_browser_session(driver, data):
+    """Восстановить cookies и localStorage в браузере (до проверки авторизации)"""
+    cookies = []
+    for cookie in data.get('cookies', []):
+        restored = {key: cookie[key] for key in COOKIE_FIELDS if key in cookie}
+        # Сессионные cookies приходят с expires=-1 — такие передаются без срока
+        if cookie.get('session') or restored.get('expires', 0) <= 0:
+            restored.pop('expires', None)
+        cookies.append(restored)
+    driver.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+
+    local_storage = data.get('local_storage') or {}
+    if local_storage and data.get('origin'):
+        # localStorage привязан к origin — открываем его перед записью
+        driver.get(data['origin'])
+        driver.execute_script(
+            "var items = arguments[0]; for (var k in items) { window.localStorage.setItem(k, items[k]); }",
+            local_storage
+        )
+
+
+def delete_browser_session(path, saved_at=None):
+    """Удалить сохранённую сессию, не прошедшую проверку.
+
+    С saved_at файл удаляется, только если его за это время не перезаписала другая сессия.
+    """
+    if not path or not os.path.exists(path):
+        return
+    if saved_at is not None:
+        current = load_browser_session(path)
+        if current and current.get('saved_at') != saved_at:
+            return
+    try:
+        os.remove(path)
+    except Exception:
+        pass
@@ -0,0 +1,86 @@
+import json
+import os
+import pytest
+from case_registry import CaseRegistry, get_registry_path
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.delenv('CASE_REGISTRY_DB', raising=False)
+    opened = CaseRegistry(base_dir=str(tmp_path))
+    yield opened
+    opened.close()
+
+
+def test_registry_path(tmp_path, monkeypatch):
+    monkeypatch.delenv('CASE_REGISTRY_DB', raising=False)
+    assert get_registry_path(str(tmp_path)) == os.path.join(str(tmp_path), 'case_registry.sqlite3')
+    monkeypatch.setenv('CASE_REGISTRY_DB', str(tmp_path / 'other.db'))
+    assert get_registry_path() == str(tmp_path / 'other.db')
+
+
+def test_prepared_cases_are_not_seen_until_imported(registry):
+    assert registry.record_prepared(['4012026', '4022026', ''], 'АС | 2 | 1000000') == 2
+    assert registry.seen(['4012026', '4022026']) == set()
+
+    registry.mark_imported(['4012026', '4032026'])
+    assert registry.seen(['4012026', '4022026', '4032026', '']) == {'4012026', '4032026'}
+    assert registry.counts() == {'imported': 2, 'prepared': 1}
+
+
+def test_first_seen_and_source_are_kept(registry):
+    registry.record_prepared(['4012026'], 'первый поиск')
+    registry.record_prepared(['4012026'], 'второй поиск')
+    registry.mark_imported(['4012026'])
+    source, status = registry.conn.execute(
+        'SELECT source_bundle, bitrix_status FROM cases WHERE case_num = ?', ('4012026',)
+    ).fetchone()
+    assert (source, status) == ('первый поиск', 'imported')
+
+
+def test_large_lookups_are_batched(registry):
+    keys = [str(n) for n in range(1200)]
+    registry.mark_imported(keys[::2])
+    assert registry.seen(keys) == set(keys[::2])
+
+
+def test_legacy_files_are_migrated_once_and_on_change(tmp_path, monkeypatch):
+    monkeypatch.delenv('CASE_REGISTRY_DB', raising=False)
+    (tmp_path / 'cases_num.txt').write_text('А40-1/2026\n\n', encoding='utf-8')
+    (tmp_path / 'processed_cases.json').write_text(json.dumps(['4022026', 'А40-5/2026']), encoding='utf-8')
+
+    registry = CaseRegistry(base_dir=str(tmp_path))
+    assert registry.counts() == {'imported': 2, 'legacy': 1}
+    assert registry.seen(['4012026', '4022026']) == {'4012026', '4022026'}
+
+    registry.mark_imported(['4032026'])
+    registry.migrate_legacy()
+    assert registry.counts() == {'imported': 3, 'legacy': 1}
+
+    with open(tmp_path / 'cases_num.txt', 'a', encoding='utf-8') as f:
+        f.write('А40-4/2026\n')
+    os.utime(tmp_path / 'cases_num.txt', ns=(1, 1))
+    registry.migrate_legacy()
+    assert registry.seen(['4042026']) == {'4042026'}
+    registry.close()
+
+
+def test_corrupted_legacy_json_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.delenv('CASE_REGISTRY_DB', raising=False)
+    (tmp_path / 'processed_cases.json').write_text('{broken', encoding='utf-8')
+    registry = CaseRegistry(base_dir=str(tmp_path))
+    assert registry.counts() == {}
+    registry.close()
+
+
+def test_prepared_case_added_to_legacy_file_is_seen(tmp_path, monkeypatch):
+    monkeypatch.delenv('CASE_REGISTRY_DB', raising=False)
+    registry = CaseRegistry(base_dir=str(tmp_path))
+    registry.record_prepared(['4012026', '4022026'], 'АС | 2 | 1000000')
+    registry.mark_imported(['4022026'])
+
+    (tmp_path / 'cases_num.txt').write_text('А40-1/2026\nА40-2/2026\n', encoding='utf-8')
+    registry.migrate_legacy()
+    assert registry.seen(['4012026', '4022026']) == {'4012026', '4022026'}
+    assert registry.counts() == {'imported': 1, 'legacy': 1}
+    registry.close()
@@ -0,0 +1,37 @@
+import pandas as pd
+from case_watermark import (
+    case_sequence, export_watermark, merge_watermarks, highest_case, below_watermark, incremental_enabled
+)
+
+
+def test_case_sequence():
+    assert case_sequence('А40-123456/2026') == ('А40/2026', 123456)
+    assert case_sequence(' а40 - 7 / 2026 ') == ('А40/2026', 7)
+    assert case_sequence('без номера') is None
+    assert case_sequence(float('nan')) is None
+
+
+def test_export_watermark_keeps_highest_number_per_court_and_year():
+    watermark = export_watermark(pd.Series(['А40-10/2026', 'А40-25/2026', 'А41-3/2026']))
+    export_watermark(pd.Series(['А40-20/2026', 'А40-99/2025', None]), watermark)
+    assert watermark == {'А40/2026': 25, 'А41/2026': 3, 'А40/2025': 99}
+
+
+def test_merge_and_highest_case():
+    merged = merge_watermarks({'А40/2026': 10}, None, {'А40/2026': 5, 'А41/2026': 7})
+    assert merged == {'А40/2026': 10, 'А41/2026': 7}
+    assert highest_case({'А40/2025': 900, 'А40/2026': 10}) == ('А40-10/2026', 10)
+    assert highest_case({}) == ('', 0)
+
+
+def test_below_watermark():
+    numbers = pd.Series(['А40-10/2026', 'А40-11/2026', 'А41-1/2026', None, 'мусор'])
+    mask = below_watermark(numbers, {'А40/2026': 10})
+    assert mask.tolist() == [True, False, False, False, False]
+
+
+def test_incremental_mode_is_off_by_default(monkeypatch):
+    monkeypatch.delenv('CASEBOOK_INCREMENTAL', raising=False)
+    assert not incremental_enabled()
+    monkeypatch.setenv('CASEBOOK_INCREMENTAL', 'true')
+    assert incremental_enabled()
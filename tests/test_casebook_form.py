@@ -0,0 +1,47 @@
+from casebook_form import form_changes
+
+STATE = {
+    'court': 'АС города Москвы',
+    'categories': ['2', '3'],
+    'date_from': '15.01.2025',
+    'date_to': '15.01.2025',
+    'min_sum': 1000000,
+}
+
+
+def test_unknown_form_state_needs_a_clean_page():
+    assert form_changes(None, STATE) is None
+    assert form_changes({}, STATE) is None
+
+
+def test_same_search_changes_nothing():
+    changes = form_changes(STATE, dict(STATE))
+    assert changes == {
+        'court': None,
+        'court_remove': None,
+        'categories': [],
+        'categories_remove': [],
+        'date_from': None,
+        'date_to': None,
+        'min_sum': None,
+        'allow_first': False,
+    }
+
+
+def test_only_changed_filters_are_filled():
+    target = dict(STATE, categories=['3', '4'], date_to='16.01.2025')
+    changes = form_changes(STATE, target)
+    assert changes['court'] is None
+    assert changes['categories'] == ['4']
+    assert changes['categories_remove'] == ['2']
+    assert changes['date_from'] is None
+    assert changes['date_to'] == '16.01.2025'
+    assert changes['min_sum'] is None
+
+
+def test_court_change_removes_previous_court():
+    target = dict(STATE, court='АС Ростовской области', min_sum=800000)
+    changes = form_changes(STATE, target)
+    assert changes['court'] == 'АС Ростовской области'
+    assert changes['court_remove'] == 'АС города Москвы'
+    assert changes['min_sum'] == 800000
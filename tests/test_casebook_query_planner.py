@@ -0,0 +1,75 @@
+import pytest
+from casebook_query_planner import plan_queries, parse_bundle
+
+
+@pytest.fixture(autouse=True)
+def planner_env(monkeypatch):
+    for name in ('CASEBOOK_COALESCE_CATEGORIES', 'CASEBOOK_COLLAPSE_MIN_SUM', 'CASEBOOK_MAX_CATEGORIES_PER_SEARCH'):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_parse_bundle():
+    assert parse_bundle(['АС города Москвы', 2, 1000000]) == {
+        'court': 'АС города Москвы', 'category': '2', 'min_sum': 1000000, 'date_from': None
+    }
+    assert parse_bundle(['АС города Москвы', '2', 1000000, ' 01.02.2026 '])['date_from'] == '01.02.2026'
+    assert parse_bundle(['АС города Москвы']) is None
+
+
+def test_categories_of_one_court_share_a_search():
+    queries = plan_queries([
+        ['АС города Москвы', '2', 1000000],
+        ['АС Ростовской области', '2', 800000],
+        ['АС города Москвы', '3', 1000000],
+    ])
+
+    assert [(q['court'], q['categories']) for q in queries] == [
+        ('АС города Москвы', ['2', '3']),
+        ('АС Ростовской области', ['2']),
+    ]
+    assert [req_idx for req_idx, _ in queries[0]['bundles']] == [0, 2]
+
+
+def test_min_sum_variants_collapse_to_lowest_threshold():
+    queries = plan_queries([
+        ['АС города Москвы', '2', 1000000],
+        ['АС города Москвы', '2', '500 000'],
+        ['АС города Москвы', '3', 1000000],
+    ])
+
+    assert len(queries) == 2
+    lowest = next(q for q in queries if q['min_sum'] == '500 000')
+    assert lowest['categories'] == ['2']
+    assert [bundle['min_sum'] for _, bundle in lowest['bundles']] == [1000000, '500 000']
+
+
+def test_coalescing_can_be_disabled():
+    bundles = [['АС города Москвы', '2', 1000000], ['АС города Москвы', '3', 1000000]]
+    assert len(plan_queries(bundles, coalesce=False)) == 2
+
+
+def test_max_categories_per_search(monkeypatch):
+    monkeypatch.setenv('CASEBOOK_MAX_CATEGORIES_PER_SEARCH', '2')
+    queries = plan_queries([['АС города Москвы', str(code), 1000000] for code in (2, 3, 4, 5, 6)])
+    assert [q['categories'] for q in queries] == [['2', '3'], ['4', '5'], ['6']]
+
+
+def test_invalid_bundles_are_skipped():
+    queries = plan_queries([['АС города Москвы'], ['АС города Москвы', '2', 1000000]])
+    assert [req_idx for req_idx, _ in queries[0]['bundles']] == [1]
+
+
+def test_searches_of_one_court_are_ordered_by_parsed_date():
+    queries = plan_queries([
+        ['АС города Москвы', '2', 1000000, '01.02.2025'],
+        ['АС Ростовской области', '2', 800000, '15.01.2025'],
+        ['АС города Москвы', '2', 1000000, '15.01.2025'],
+        ['АС города Москвы', '2', 1000000],
+    ])
+
+    assert [(q['court'], q['date_from']) for q in queries] == [
+        ('АС города Москвы', None),
+        ('АС города Москвы', '15.01.2025'),
+        ('АС города Москвы', '01.02.2025'),
+        ('АС Ростовской области', '15.01.2025'),
+    ]
@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+from defendant_blocklist import DefendantBlocklist, load_blocklist
+
+
+@pytest.fixture
+def blocklist():
+    return DefendantBlocklist(['банк\n', 'нефт*\n', 'Исполнительный комитет\n', 'альфа банк*\n', '\n', '  \n'])
+
+
+def test_entries(blocklist):
+    assert len(blocklist) == 4
+
+
+@pytest.mark.parametrize('name, entry', [
+    ('ПАО "Банк"', 'банк'),
+    ('ООО Банковский союз', None),
+    ('Нефтьсервис', 'нефт*'),
+    ('ПАО "Роснефть"', None),
+    ('Исполнительный комитет г. Казани', 'Исполнительный комитет'),
+    ('Комитет исполнительный', None),
+    ('АО Альфа Банковские технологии', 'альфа банк*'),
+    ('', None),
+])
+def test_match(blocklist, name, entry):
+    assert blocklist.match(name) == entry
+
+
+def test_match_many_keeps_index_and_reports_entry(blocklist):
+    names = pd.Series(['ПАО Банк', 'ООО Ромашка', 'ПАО Банк', None], index=[3, 3, 7, 9])
+    mask, matched = blocklist.match_many(names)
+    assert mask.tolist() == [True, False, True, False]
+    assert matched.tolist()[:3] == ['банк', None, 'банк']
+    assert list(mask.index) == [3, 3, 7, 9]
+
+
+def test_empty_blocklist_blocks_nothing():
+    mask, matched = DefendantBlocklist().match_many(pd.Series(['ПАО Банк']))
+    assert not mask.any()
+
+
+def test_load_blocklist_is_rebuilt_only_when_file_changes(tmp_path):
+    path = tmp_path / 'defendant.txt'
+    path.write_text('банк\n', encoding='utf-8')
+    first = load_blocklist(str(path))
+    assert load_blocklist(str(path)) is first
+
+    path.write_text('банк\nнефт*\n', encoding='utf-8')
+    second = load_blocklist(str(path))
+    assert second is not first
+    assert len(second) == 2
+    assert len(load_blocklist(str(tmp_path / 'missing.txt'))) == 0
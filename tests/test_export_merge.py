@@ -0,0 +1,50 @@
+import io
+import hashlib
+from export_merge import ExportWriter
+
+HEADER = 'Номер дела;Суд\r\n'.encode('windows-1251')
+
+
+def merged(chunks):
+    out = io.BytesIO()
+    writer = ExportWriter(out)
+    for chunk in chunks:
+        writer.append(chunk)
+    return writer.parts, out.getvalue()
+
+
+def test_header_is_kept_once():
+    parts, data = merged([HEADER + b'1;a\r\n', HEADER + b'2;b\r\n3;c\r\n'])
+    assert parts == 2
+    assert data == HEADER + b'1;a\r\n2;b\r\n3;c\r\n'
+
+
+def test_empty_parts_are_skipped_and_missing_newline_is_added():
+    parts, data = merged([b'', b'  \r\n', HEADER + b'1;a', HEADER + b'2;b'])
+    assert parts == 2
+    assert data == HEADER + b'1;a\r\n2;b'
+
+
+def test_header_only_part_adds_no_rows():
+    parts, data = merged([HEADER, HEADER + b'1;a\r\n'])
+    assert parts == 2
+    assert data == HEADER + b'1;a\r\n'
+
+
+def test_file_and_buffer_parts_are_streamed(tmp_path):
+    part = tmp_path / 'part.csv'
+    part.write_bytes(HEADER + b'1;a\r\n')
+    out = io.BytesIO()
+    writer = ExportWriter(out)
+    writer.BLOCK_SIZE = 2
+    writer.append(str(part))
+    writer.append(io.BytesIO(HEADER + b'2;b\r\n'))
+    assert out.getvalue() == HEADER + b'1;a\r\n2;b\r\n'
+
+
+def test_digest_covers_merged_bytes():
+    out = io.BytesIO()
+    writer = ExportWriter(out)
+    writer.append(HEADER + b'1;a\r\n')
+    writer.append(HEADER + b'2;b\r\n')
+    assert writer.hexdigest() == hashlib.sha256(out.getvalue()).hexdigest()
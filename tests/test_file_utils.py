@@ -0,0 +1,21 @@
+import json
+from file_utils import write_json_atomic, acquire_run_lock
+
+
+def test_write_json_atomic_replaces_file(tmp_path):
+    path = tmp_path / 'state.json'
+    write_json_atomic(str(path), {'done': ['а']})
+    write_json_atomic(str(path), {'done': ['б']}, indent=2)
+    assert json.loads(path.read_text(encoding='utf-8')) == {'done': ['б']}
+    assert [p.name for p in tmp_path.iterdir()] == ['state.json']
+
+
+def test_run_lock_is_exclusive_until_closed(tmp_path):
+    path = str(tmp_path / 'casebook_run.lock')
+    first = acquire_run_lock(path)
+    assert first is not None
+    assert acquire_run_lock(path) is None
+    first.close()
+    second = acquire_run_lock(path)
+    assert second is not None
+    second.close()
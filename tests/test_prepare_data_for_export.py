@@ -0,0 +1,189 @@
+import io
+import hashlib
+import sqlite3
+import pandas as pd
+import pytest
+import prepare_data_for_export as set_data
+from defendant_blocklist import DefendantBlocklist
+
+HEADERS = set_data.needed_headers
+
+
+def export_bytes(rows):
+    frame = pd.DataFrame(rows, columns=HEADERS)
+    return frame.to_csv(sep=';', index=False).encode('windows-1251')
+
+
+def row(case_num, defendant, inn):
+    return [case_num, '01.01.2026', '2', 'https://casebook.ru', 'АС г. Москвы', 'ООО Истец', defendant, inn, '100000']
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(set_data, 'abs_path', str(tmp_path))
+    (tmp_path / 'defendant.txt').write_text('банк\n', encoding='utf-8')
+    return tmp_path
+
+
+def read_cleaned(workdir):
+    return pd.read_csv(workdir / 'CleanedArbitrage.csv', sep=';', encoding='windows-1251', dtype=str)
+
+
+def test_blocked_single_defendant_does_not_leak_into_leads(workdir):
+    raw = export_bytes([
+        row('А40-1/2026', 'ПАО Банк', '7700000001'),
+        row('А40-2/2026', 'ООО Ромашка\nООО Лютик', '7700000002\n7700000003'),
+        row('А40-3/2026', 'ООО Василёк\nИП Иванов', '7700000004\n77-78'),
+    ])
+
+    assert set_data.prepare_data(True, 'w', io.BytesIO(raw))
+
+    stats = set_data.prepare_data.last_stats
+    assert stats['passed_filters'] == 3
+    assert stats['prepared_count'] == 2
+    assert stats['skipped_defendant_block'] == 1
+    assert stats['skipped_invalid_inn_range'] == 1
+    cleaned = read_cleaned(workdir)
+    assert cleaned['Номер дела'].tolist() == ['А40-2/2026', 'А40-3/2026']
+    assert cleaned['Название лида'].tolist() == ['ООО Ромашка', 'ООО Василёк']
+    assert 'ПАО Банк' not in cleaned.fillna('').to_numpy()
+
+
+def test_blocked_defendant_inside_multi_defendant_case(workdir):
+    raw = export_bytes([
+        row('А40-4/2026', 'ПАО Банк\nООО Ромашка', '7700000005\n7700000006'),
+        row('А40-5/2026', 'ООО Лютик', '7700000007'),
+    ])
+
+    assert set_data.prepare_data(True, 'w', io.BytesIO(raw))
+
+    cleaned = read_cleaned(workdir)
+    assert cleaned['Название лида'].tolist() == ['ООО Ромашка', 'ООО Лютик']
+    assert cleaned['ИНН Ответчика/Должника'].tolist() == ['7700000006', '7700000007']
+
+
+def empty_stats():
+    return {
+        'skipped_seen_before': 0,
+        'skipped_empty_defendant': 0,
+        'skipped_defendant_block': 0,
+        'skipped_invalid_inn_range': 0,
+    }
+
+
+def test_filter_rows_splits_defendants_and_counts_skips():
+    frame = pd.DataFrame([
+        row('А40-1/2026', 'ООО Ромашка', '7700000001'),
+        row('А40-2/2026', '', '7700000002'),
+        row('А40-3/2026', 'ООО Лютик\r\nИП Иванов\nАО Банк', '7700000003\r\n7700000004'),
+        row('А40-4/2026', 'ООО Василёк', '7700000005'),
+    ], columns=HEADERS)
+    stats = empty_stats()
+
+    ready = set_data.filter_rows(frame, {'4042026'}, DefendantBlocklist(['банк']), stats)
+
+    assert ready['Название лида'].tolist() == ['ООО Ромашка', 'ООО Лютик', 'ИП Иванов']
+    assert ready['ИНН Ответчика/Должника'].tolist() == ['7700000001', '7700000003', '7700000004']
+    assert ready['__case__'].tolist() == ['4012026', '4032026', '4032026']
+    assert stats == {
+        'skipped_seen_before': 1,
+        'skipped_empty_defendant': 1,
+        'skipped_defendant_block': 1,
+        'skipped_invalid_inn_range': 0,
+    }
+
+
+def test_filter_rows_without_inn_keeps_all_defendants_in_one_row():
+    frame = pd.DataFrame([row('А40-1/2026', 'ООО Ромашка\nООО Лютик', None)], columns=HEADERS)
+
+    ready = set_data.filter_rows(frame, set(), DefendantBlocklist(), empty_stats())
+
+    assert ready['Название лида'].tolist() == ['ООО Ромашка\nООО Лютик']
+
+
+def mixed_export():
+    rows = []
+    for i in range(40):
+        case_num = f'А40-{i % 17}/2026'
+        if i % 5 == 0:
+            rows.append(row(case_num, f'ООО Ромашка {i}\nАО Банк {i}', f'77{i:08d}\n78{i:08d}'))
+        elif i % 7 == 0:
+            rows.append(row(case_num, f'ПАО Банк {i}', f'77{i:08d}'))
+        elif i % 11 == 0:
+            rows.append(row(case_num, '', ''))
+        else:
+            rows.append(row(case_num, f'ООО Лютик {i}', f'77{i:08d}'))
+    return export_bytes(rows)
+
+
+BUNDLES = [(0, {'category': '2', 'min_sum': '50000'}), (1, {'category': '2', 'min_sum': '500000'})]
+
+
+@pytest.mark.parametrize('chunk_rows', ['3', '7'])
+def test_chunked_prepare_matches_single_read(workdir, monkeypatch, chunk_rows):
+    raw = mixed_export()
+
+    monkeypatch.setenv('PREPARE_CHUNK_ROWS', '0')
+    set_data.prepare_data(True, 'w', io.BytesIO(raw), bundles=BUNDLES)
+    expected = (workdir / 'CleanedArbitrage.csv').read_bytes()
+    expected_stats = set_data.prepare_data.last_stats
+
+    monkeypatch.setenv('PREPARE_CHUNK_ROWS', chunk_rows)
+    set_data.prepare_data(True, 'w', io.BytesIO(raw), bundles=BUNDLES)
+
+    assert (workdir / 'CleanedArbitrage.csv').read_bytes() == expected
+    assert set_data.prepare_data.last_stats == expected_stats
+    assert expected_stats['prepared_count'] == 16
+
+
+def test_own_dedup_index_closes_the_registry(workdir, monkeypatch):
+    opened = []
+    original_init = set_data.CaseRegistry.__init__
+
+    def tracking_init(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        opened.append(self)
+
+    monkeypatch.setattr(set_data.CaseRegistry, '__init__', tracking_init)
+    set_data.prepare_data(True, 'w', io.BytesIO(export_bytes([row('А40-1/2026', 'ООО Ромашка', '7700000001')])))
+
+    assert len(opened) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].conn.execute('SELECT 1')
+
+
+def test_shared_dedup_index_skips_cases_written_earlier_in_the_run(workdir):
+    raw = export_bytes([row('А40-1/2026', 'ООО Ромашка', '7700000001')])
+    with set_data.DedupIndex() as dedup_index:
+        assert set_data.prepare_data(True, 'w', io.BytesIO(raw), dedup_index=dedup_index)
+        assert not set_data.prepare_data(False, 'a', io.BytesIO(raw), dedup_index=dedup_index)
+        assert set_data.prepare_data.last_stats['skipped_duplicate_in_run'] == 1
+
+
+def test_export_is_read_once_for_counts_watermark_and_hash(workdir, monkeypatch):
+    rows = [row('А40-1/2026', 'ООО Ромашка', '7700000001'), row('А40-9/2026', 'ПАО Банк', '7700000002')]
+    rows[1][2] = '23'
+    raw = export_bytes(rows)
+    export_path = workdir / 'ArbitrageSearchExport.csv'
+    export_path.write_bytes(raw)
+    monkeypatch.setenv('PREPARE_CHUNK_ROWS', '1')
+    bundles = [(0, {'category': '2', 'min_sum': '50000'}), (1, {'category': '23', 'min_sum': '500000'})]
+
+    assert set_data.prepare_data(True, 'w', str(export_path), bundles=bundles)
+
+    stats = set_data.prepare_data.last_stats
+    assert stats['bundle_counts'] == {0: 1, 1: 0, None: 0}
+    assert stats['export_watermark'] == {'А40/2026': 9}
+    assert stats['content_hash'] == hashlib.sha256(raw).hexdigest()
+    assert not export_path.exists()
+
+
+def test_rows_without_case_number_are_kept_across_searches(workdir):
+    with set_data.DedupIndex() as dedup_index:
+        first = export_bytes([row('', 'ООО Ромашка', '7700000001')])
+        second = export_bytes([row('', 'ООО Лютик', '7700000002')])
+        assert set_data.prepare_data(True, 'w', io.BytesIO(first), dedup_index=dedup_index)
+        assert set_data.prepare_data(False, 'a', io.BytesIO(second), dedup_index=dedup_index)
+        assert set_data.prepare_data.last_stats['skipped_duplicate_in_run'] == 0
+        assert dedup_index.written_cases == set()
@@ -0,0 +1,81 @@
+import pytest
+import rate_limiter
+from rate_limiter import AdaptiveRateLimiter, SIGNAL_FACTORS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', fake.monotonic)
+    monkeypatch.setattr(rate_limiter.time, 'sleep', fake.sleep)
+    return fake
+
+
+def make_limiter(**kwargs):
+    options = dict(rate=1.0, min_rate=0.1, max_rate=2.0, burst=2, step=0.5, slow_sec=10, cooldown_sec=60)
+    options.update(kwargs)
+    return AdaptiveRateLimiter(**options)
+
+
+def test_burst_then_paced_by_rate(clock):
+    limiter = make_limiter()
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == pytest.approx(1.0)
+
+
+def test_success_adds_step_up_to_max_rate(clock):
+    limiter = make_limiter()
+    limiter.record_success(1)
+    assert limiter.current_rate == pytest.approx(1.5)
+    limiter.record_success(1)
+    limiter.record_success(1)
+    assert limiter.current_rate == pytest.approx(2.0)
+
+
+def test_slow_response_and_signals_cut_rate(clock):
+    limiter = make_limiter()
+    limiter.record_success(30)
+    assert limiter.current_rate == pytest.approx(SIGNAL_FACTORS['slow'])
+    limiter.record_signal('unknown')
+    assert limiter.current_rate == pytest.approx(SIGNAL_FACTORS['slow'] * SIGNAL_FACTORS['error'])
+    for _ in range(20):
+        limiter.record_signal('captcha')
+    assert limiter.current_rate == pytest.approx(0.1)
+    assert limiter.signals == {'slow': 1, 'unknown': 1, 'captcha': 20}
+
+
+def test_blocking_signal_pauses_all_requests(clock):
+    limiter = make_limiter()
+    limiter.record_signal('login')
+    waited = limiter.acquire()
+    assert waited >= 60
+
+
+def test_env_configuration(monkeypatch):
+    monkeypatch.setenv('CASEBOOK_RATE_INITIAL', '5')
+    monkeypatch.setenv('CASEBOOK_RATE_MAX', '3')
+    monkeypatch.setenv('CASEBOOK_RATE_MIN', 'bad')
+    limiter = AdaptiveRateLimiter()
+    assert limiter.current_rate == 3
+    assert limiter.min_rate == 0.05
+
+
+def test_backoff_grows_with_attempts():
+    limiter = make_limiter(rate=1.0)
+    assert 0.8 <= limiter.backoff(1) <= 1.2
+    assert 3.2 <= limiter.backoff(3) <= 4.8
+    assert limiter.backoff(20) <= 120 * 1.2
@@ -0,0 +1,72 @@
+import io
+import hashlib
+import json
+import time
+from result_cache import ResultCache, HashingReader, get_cache_file
+
+
+def test_key_normalizes_categories_and_min_sum():
+    assert ResultCache.key('АС города Москвы', ['3', '2'], '1 000 000', '01.02.2026', '01.02.2026') == \
+        ResultCache.key('АС города Москвы', '2,3', 1000000, '01.02.2026', '01.02.2026')
+
+
+def test_entries_are_saved_only_on_commit(tmp_path):
+    path = tmp_path / 'cache.json'
+    cache = ResultCache(str(path))
+    key = cache.key('АС города Москвы', '2', 1000000, '01.02.2026', '01.02.2026')
+    cache.record(key, 12, 'abc', {'А40/2026': 100})
+
+    assert cache.is_unchanged(key, 12)
+    assert not path.exists()
+
+    cache.commit()
+    reloaded = ResultCache(str(path))
+    assert reloaded.is_unchanged(key, 12)
+    assert not reloaded.is_unchanged(key, 13)
+    assert reloaded.same_content(key, 'abc')
+    assert reloaded.get(key)['watermark'] == {'А40/2026': 100}
+
+
+def test_discard_keeps_previous_entries(tmp_path):
+    path = tmp_path / 'cache.json'
+    cache = ResultCache(str(path))
+    cache.record('k', 1, 'old')
+    cache.commit()
+    cache.record('k', 2, 'new')
+    cache.discard()
+    cache.commit()
+
+    assert ResultCache(str(path)).get('k')['hash'] == 'old'
+
+
+def test_commit_drops_expired_entries(tmp_path, monkeypatch):
+    monkeypatch.setenv('CASEBOOK_RESULT_CACHE_MAX_AGE_H', '1')
+    path = tmp_path / 'cache.json'
+    path.write_text(json.dumps({'old': {'count': 1, 'hash': 'x', 'updated_at': time.time() - 7200}}), encoding='utf-8')
+    cache = ResultCache(str(path))
+    cache.record('new', 2, 'y')
+    cache.commit()
+
+    assert set(json.loads(path.read_text(encoding='utf-8'))) == {'new'}
+
+
+def test_disabled_cache(monkeypatch):
+    monkeypatch.setenv('CASEBOOK_RESULT_CACHE', 'off')
+    assert get_cache_file() is None
+    cache = ResultCache()
+    cache.record('k', 1, 'x')
+    assert not cache.enabled
+    assert not cache.is_unchanged('k', 1)
+
+
+def test_corrupted_cache_file_is_ignored(tmp_path):
+    path = tmp_path / 'cache.json'
+    path.write_text('{broken', encoding='utf-8')
+    assert ResultCache(str(path)).entries == {}
+
+
+def test_hashing_reader_hashes_the_whole_stream():
+    content = 'Номер дела;Суд\nА40-1/2026;АС\n'.encode('windows-1251')
+    reader = HashingReader(io.BytesIO(content))
+    assert io.BufferedReader(reader).readline() == 'Номер дела;Суд\n'.encode('windows-1251')
+    assert reader.hexdigest() == hashlib.sha256(content).hexdigest()